@@ -232,7 +232,8 @@ async function loadTodayData() {
   try {
     // 直接加载本地数据（由GitHub Actions定期更新）
     // 注：前端直接调用东方财富API会遇到CORS跨域限制，因此使用后端更新的数据
-    const res = await fetch('./data/daily.json', {cache:'no-store'});
+    // no-cache：每次向服务器确认，未变化时返回 304 并使用浏览器缓存
+    const res = await fetch('./data/daily.json', {cache:'no-cache'});
     currentData = await res.json();
 
     displayTodayData(currentData);
@@ -301,7 +302,7 @@ function renderBoardList(boards, containerId) {
             ${b.core_stocks && b.core_stocks.length > 0
               ? b.core_stocks.map(s => `
                   <div style="display: flex; justify-content: space-between; padding: 8px; background: #f5f5f5; border-radius: 4px;">
-                    <span><strong>${s.name}</strong> (${s.code})</span>
+                    <span><strong>${s.name}</strong> (${s.code})${s.lu_streak >= 2 ? ` <span style="color: #ef5350; font-size: 12px;">${s.lu_streak}连板</span>` : ''}</span>
                     <span style="color: ${(s.ret || 0) >= 0 ? '#ef5350' : '#26a69a'}; font-weight: 600;">
                       ${((s.ret || 0)*100).toFixed(2)}%
                     </span>
@@ -354,7 +355,15 @@ function renderBoardList(boards, containerId) {
         if (refreshTimers[boardCode]) {
           clearInterval(refreshTimers[boardCode]);
         }
+        const chartElement = document.getElementById(chartId);
         refreshTimers[boardCode] = setInterval(async () => {
+          // 列表已被推送更新重新渲染：停止旧图表的刷新
+          if (document.getElementById(chartId) !== chartElement) {
+            clearInterval(refreshTimers[boardCode]);
+            delete refreshTimers[boardCode];
+            return;
+          }
+
           // 如果上一次还在加载中，跳过本次刷新
           if (loadingState[boardCode]) {
             console.log(`⏭️  跳过刷新(上次请求未完成): ${boardName}`);
@@ -363,7 +372,7 @@ function renderBoardList(boards, containerId) {
 
           console.log(`🔄 自动刷新K线图: ${boardName}`);
           loadingState[boardCode] = true;
-          await loadBoardKlineData(boardCode, boardName, chartId);
+          await loadBoardKlineData(boardCode, boardName, chartId, true);
           loadingState[boardCode] = false;
         }, 20000); // 20秒
 
@@ -385,6 +394,46 @@ function renderBoardList(boards, containerId) {
   });
 }
 
+// 预计算技术指标（history.json 中的 indicators，与K线日期对齐）
+const INDICATOR_LINES = [
+  { key: 'ma5', name: 'MA5', color: '#f5a623' },
+  { key: 'ma10', name: 'MA10', color: '#7e57c2' },
+  { key: 'ma20', name: 'MA20', color: '#29b6f6' }
+];
+
+// keep: 图表中每根K线在指标数组中的下标（-1 表示没有对应的指标值）
+function indicatorLineSeries(indicators, keep) {
+  if (!indicators) return [];
+  return INDICATOR_LINES.filter(line => indicators[line.key]).map(line => ({
+    name: line.name,
+    type: 'line',
+    data: keep.map(i => (i >= 0 ? indicators[line.key][i] : null)),
+    xAxisIndex: 0,
+    yAxisIndex: 0,
+    showSymbol: false,
+    smooth: true,
+    lineStyle: { width: 1, color: line.color }
+  }));
+}
+
+// 降采样后的历史K线（periods 标记每根K线的粒度：D=日线，W=周线，M=月线）
+const PERIOD_LABELS = { W: '（周线）', M: '（月线）' };
+
+function periodLabel(history, i) {
+  const period = history && history.periods ? history.periods[i] : null;
+  return PERIOD_LABELS[period] || '';
+}
+
+function indicatorTooltip(indicators, i) {
+  if (!indicators || i === undefined || i < 0) return '';
+  const fmt = (key, digits = 2) => {
+    const v = indicators[key] ? indicators[key][i] : null;
+    return v === null || v === undefined ? '-' : v.toFixed(digits);
+  };
+  return `<br/>MA5/10/20: ${fmt('ma5')} / ${fmt('ma10')} / ${fmt('ma20')}<br/>` +
+         `MACD: ${fmt('macd', 3)}　RSI14: ${fmt('rsi')}　ATR14: ${fmt('atr')}`;
+}
+
 function renderMainIndicesChart(currentIndexCode = 'HS300') {
   const container = document.getElementById('indices-dashboard');
   if (!container) {
@@ -420,12 +469,15 @@ function renderMainIndicesChart(currentIndexCode = 'HS300') {
   // 过滤掉null值，只保留有效数据
   const validData = [];
   const dates = [];
+  const keep = [];
   for (let i = 0; i < allDates.length; i++) {
     if (allIndexHistory[i] && allIndexHistory[i] !== null) {
       dates.push(allDates[i]);
       validData.push(allIndexHistory[i]);
+      keep.push(i);
     }
   }
+  const indicators = (mainIndicesHistory.indicators || {})[currentIndexCode];
 
   if (validData.length === 0) {
     console.warn('没有有效的指数数据');
@@ -473,13 +525,14 @@ function renderMainIndicesChart(currentIndexCode = 'HS300') {
         const ret = (kdata.ret || 0) * 100;
         const volume = (kdata.volume || 0) / 100000000;
 
-        let result = `<strong>${date}</strong><br/>`;
+        let result = `<strong>${date}${periodLabel(mainIndicesHistory, keep[dateIdx])}</strong><br/>`;
         result += `开盘: ${kdata.open.toFixed(2)}<br/>`;
         result += `收盘: ${kdata.close.toFixed(2)}<br/>`;
         result += `最高: ${kdata.high.toFixed(2)}<br/>`;
         result += `最低: ${kdata.low.toFixed(2)}<br/>`;
         result += `涨跌幅: <strong style="color: ${ret >= 0 ? '#ef5350' : '#26a69a'}">${ret.toFixed(2)}%</strong><br/>`;
         result += `成交量: ${volume.toFixed(2)}亿手`;
+        result += indicatorTooltip(indicators, keep[dateIdx]);
 
         return result;
       }
@@ -563,6 +616,7 @@ function renderMainIndicesChart(currentIndexCode = 'HS300') {
           borderColor0: '#26a69a'
         }
       },
+      ...indicatorLineSeries(indicators, keep),
       {
         name: '成交量',
         type: 'bar',
@@ -782,12 +836,15 @@ function renderMarketIndicesChart(currentIndexCode = 'SHCOMP') {
   // 过滤掉null值，只保留有效数据
   const validData = [];
   const dates = [];
+  const keep = [];
   for (let i = 0; i < allDates.length; i++) {
     if (allIndexHistory[i] && allIndexHistory[i] !== null) {
       dates.push(allDates[i]);
       validData.push(allIndexHistory[i]);
+      keep.push(i);
     }
   }
+  const indicators = (marketIndicesHistory.indicators || {})[currentIndexCode];
 
   if (validData.length === 0) {
     console.warn('没有有效的大盘指数数据');
@@ -838,13 +895,14 @@ function renderMarketIndicesChart(currentIndexCode = 'SHCOMP') {
 
         const ret = (kdata.ret || 0) * 100; // 转换为百分比
 
-        return `<strong>${date}</strong><br/>` +
+        return `<strong>${date}${periodLabel(marketIndicesHistory, keep[dateIdx])}</strong><br/>` +
                `开盘: ${kdata.open.toFixed(2)}<br/>` +
                `收盘: ${kdata.close.toFixed(2)}<br/>` +
                `最高: ${kdata.high.toFixed(2)}<br/>` +
                `最低: ${kdata.low.toFixed(2)}<br/>` +
                `涨跌幅: <strong style="color: ${ret >= 0 ? '#ef5350' : '#26a69a'}">${ret.toFixed(2)}%</strong><br/>` +
-               `成交量: ${(kdata.volume / 100000000).toFixed(2)}亿`;
+               `成交量: ${(kdata.volume / 100000000).toFixed(2)}亿` +
+               indicatorTooltip(indicators, keep[dateIdx]);
       }
     },
     grid: [
@@ -929,6 +987,7 @@ function renderMarketIndicesChart(currentIndexCode = 'SHCOMP') {
           borderColor0: '#26a69a'
         }
       },
+      ...indicatorLineSeries(indicators, keep),
       {
         name: '成交量',
         type: 'bar',
@@ -949,8 +1008,17 @@ function renderMarketIndicesChart(currentIndexCode = 'SHCOMP') {
 }
 
 function displayTodayData(data) {
-  // 更新日期
-  document.getElementById('date').textContent = data.date;
+  // 更新日期（部分接口失败时数据来自缓存快照、抓取时间预算用完时部分板块没有成分股，标注数据时效和覆盖情况）
+  const status = data.data_status;
+  const notes = [];
+  if (status && status.stale) {
+    notes.push(`部分数据为 ${Math.round(status.max_age_sec / 60)} 分钟前的缓存快照`);
+  }
+  if (status && status.coverage) {
+    const missing = status.coverage.deferred.length + status.coverage.failed.length;
+    if (missing > 0) notes.push(`${missing} 个板块暂无成分股数据`);
+  }
+  document.getElementById('date').textContent = notes.length ? `${data.date} ⚠️ ${notes.join('，')}` : data.date;
 
   // 显示行业板块和概念板块列表
   if (data.industry_boards && data.concept_boards) {
@@ -972,12 +1040,80 @@ function displayTodayData(data) {
   document.getElementById('disclaimer').textContent = data.disclaimer || '本页面仅为个人研究与技术演示，不构成投资建议。';
 }
 
+// ============================================
+// 3.1 盘中推送（query_server.py 的 /api/stream）
+// ============================================
+// 由本地查询服务提供页面时，ETL 每算出一个快照就推送变化的板块、排名和指数行情，页面不再重新加载整个 daily.json；
+// 静态托管（GitHub Pages）没有该接口，首次连接失败后不再重试，页面照常使用 daily.json
+let updateStream = null;
+
+function subscribeUpdates() {
+  if (!window.EventSource || updateStream) return;
+  let opened = false;
+  updateStream = new EventSource('./api/stream');
+  updateStream.onopen = () => {
+    opened = true;
+    console.log('📡 已连接盘中推送');
+  };
+  updateStream.onerror = () => {
+    // 连接过的推送断线时由浏览器按 Last-Event-ID 自动重连；从未连上说明没有推送接口
+    if (!opened) {
+      updateStream.close();
+      updateStream = null;
+    }
+  };
+  updateStream.addEventListener('delta', e => applyUpdate(JSON.parse(e.data)));
+  updateStream.addEventListener('reset', () => loadTodayData());
+}
+
+function applyUpdate(event) {
+  // 跨日或尚未加载：重新加载完整数据
+  if (!currentData || event.date !== currentData.date) {
+    loadTodayData();
+    return;
+  }
+
+  // 合并变化的板块，按推送的榜单顺序重排（未推送顺序的榜单保持原顺序）
+  const boards = {};
+  ['industry_boards', 'concept_boards'].forEach(key => {
+    (currentData[key] || []).forEach(b => { boards[b.code] = b; });
+  });
+  Object.assign(boards, event.boards || {});
+  (event.removed || []).forEach(code => { delete boards[code]; });
+  ['industry', 'concept'].forEach(type => {
+    const key = `${type}_boards`;
+    const order = (event.ranks && event.ranks[type]) || (currentData[key] || []).map(b => b.code);
+    currentData[key] = order.map(code => boards[code]).filter(Boolean);
+  });
+
+  if (event.indices) currentData.indices = Object.assign({}, currentData.indices, event.indices);
+  if (event.market_indices) {
+    currentData.market_indices = Object.assign({}, currentData.market_indices, event.market_indices);
+  }
+  if ('market' in event) currentData.market = event.market;
+  if ('data_status' in event) currentData.data_status = event.data_status;
+
+  // 重新渲染后恢复已展开的板块详情
+  const expanded = Array.from(document.querySelectorAll('.board-expand-btn'))
+    .filter(btn => {
+      const detail = document.getElementById(btn.getAttribute('data-board-id'));
+      return detail && detail.style.display !== 'none';
+    })
+    .map(btn => btn.getAttribute('data-board-code'));
+  displayTodayData(currentData);
+  expanded.forEach(code => {
+    const btn = document.querySelector(`.board-expand-btn[data-board-code="${code}"]`);
+    if (btn) btn.click();
+  });
+  console.log(`📡 推送更新 #${event.seq}（${event.slot}）：${Object.keys(event.boards || {}).length} 个板块变化`);
+}
+
 // ============================================
 // 4. 加载历史数据
 // ============================================
 async function loadHistoryData() {
   try {
-    const res = await fetch('./data/history.json', {cache:'no-store'});
+    const res = await fetch('./data/history.json', {cache:'no-cache'});
     historyData = await res.json();
     displayHistoryData(historyData);
 
@@ -1183,7 +1319,7 @@ function renderBoardListInline(boards, container, emptyMessage = '暂无数据')
         <small style="color: #666;">分歧：${((b.dispersion ?? 0)).toFixed(3)}</small> |
         <small style="color: #666;">核心个股：${
           b.core_stocks && b.core_stocks.length > 0
-            ? b.core_stocks.map(s=>`${s.name}(${s.code}) ${((s.ret || 0)*100).toFixed(1)}%`).join('， ')
+            ? b.core_stocks.map(s=>`${s.name}(${s.code}) ${((s.ret || 0)*100).toFixed(1)}%${s.lu_streak >= 2 ? ` ${s.lu_streak}连板` : ''}`).join('， ')
             : '暂无数据'
         }</small>
       </div>
@@ -2326,7 +2462,9 @@ async function batchAnalyzeAllIndices() {
 // ============================================
 // 5. 板块K线图加载和渲染
 // ============================================
-async function loadBoardKlineData(boardCode, boardName, chartId) {
+// live=false 时优先使用 history.json 中预计算的K线和指标，展开板块无需请求接口；
+// 自动刷新时（live=true）请求实时K线，指标按日期对齐到预计算结果
+async function loadBoardKlineData(boardCode, boardName, chartId, live = false) {
   console.log(`📊 加载板块K线数据: ${boardName} (${boardCode})`);
 
   const chartContainer = document.getElementById(chartId);
@@ -2335,6 +2473,33 @@ async function loadBoardKlineData(boardCode, boardName, chartId) {
     return;
   }
 
+  const boardKlines = historyData && historyData.board_klines;
+  const precomputed = boardKlines && boardKlines.boards[boardCode];
+  const indicators = precomputed ? precomputed.indicators : null;
+  if (precomputed && !live) {
+    const dates = [];
+    const candlestickData = [];
+    const volumeData = [];
+    const keep = [];
+    precomputed.ohlc.forEach((bar, i) => {
+      if (!bar || bar.some(v => v === null)) return;
+      const [open, close] = bar;
+      dates.push(boardKlines.dates[i]);
+      candlestickData.push(bar);
+      volumeData.push({
+        value: precomputed.volume[i] || 0,
+        ret: precomputed.ret[i] || 0,
+        itemStyle: { color: close >= open ? '#ef5350' : '#26a69a' }
+      });
+      keep.push(i);
+    });
+    if (dates.length > 0) {
+      renderBoardKlineChart(chartId, boardName, dates, candlestickData, volumeData, indicators, keep);
+      console.log(`✅ 使用预计算的${boardName}K线数据，共${dates.length}天`);
+      return;
+    }
+  }
+
   // 显示加载中
   chartContainer.innerHTML = '<div style="display: flex; align-items: center; justify-content: center; height: 100%;"><span style="color: #999;">加载中...</span></div>';
 
@@ -2399,8 +2564,9 @@ async function loadBoardKlineData(boardCode, boardName, chartId) {
       });
     });
 
-    // 渲染K线图
-    renderBoardKlineChart(chartId, boardName, dates, candlestickData, volumeData);
+    // 渲染K线图（指标按日期对齐，当天盘中K线没有指标）
+    const keep = dates.map(d => (boardKlines && indicators ? boardKlines.dates.indexOf(d) : -1));
+    renderBoardKlineChart(chartId, boardName, dates, candlestickData, volumeData, indicators, keep);
 
     console.log(`✅ 成功加载${boardName}的K线数据，共${dates.length}天`);
 
@@ -2426,7 +2592,7 @@ async function loadBoardKlineData(boardCode, boardName, chartId) {
   }
 }
 
-function renderBoardKlineChart(chartId, boardName, dates, candlestickData, volumeData) {
+function renderBoardKlineChart(chartId, boardName, dates, candlestickData, volumeData, indicators = null, keep = []) {
   const container = document.getElementById(chartId);
   if (!container) {
     console.error('图表容器不存在');
@@ -2476,7 +2642,8 @@ function renderBoardKlineChart(chartId, boardName, dates, candlestickData, volum
                `最高: ${high.toFixed(2)}<br/>` +
                `最低: ${low.toFixed(2)}<br/>` +
                `涨跌幅: <strong style="color: ${ret >= 0 ? '#ef5350' : '#26a69a'}">${ret.toFixed(2)}%</strong><br/>` +
-               `成交量: ${(vdata.value / 100000000).toFixed(2)}亿`;
+               `成交量: ${(vdata.value / 100000000).toFixed(2)}亿` +
+               indicatorTooltip(indicators, keep[dateIdx]);
       }
     },
     grid: [
@@ -2545,6 +2712,7 @@ function renderBoardKlineChart(chartId, boardName, dates, candlestickData, volum
           borderColor0: '#26a69a'
         }
       },
+      ...indicatorLineSeries(indicators, keep),
       {
         name: '成交量',
         type: 'bar',
@@ -2681,8 +2849,9 @@ async function init() {
     });
   });
 
-  // 加载今日数据
+  // 加载今日数据，之后通过推送接收盘中变化
   await loadTodayData();
+  subscribeUpdates();
 
   // 加载历史数据（用于主要指数看板的走势图）
   await loadHistoryData();
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+板块上榜位图索引
+每个板块（行业/概念分别记录）在交易日轴上有一个位图：第 i 位表示 dates[i] 是否进入 Top10
+同时维护首次/最近上榜、以最近上榜日结尾的连续天数和最长连续天数，
+使“近N日是否上榜”“当前连续上榜”“最长连续上榜”等查询为常数时间
+
+索引由存档增量同步（只读取新增日期的存档），保存为 JSON：
+{
+    "version": 1,
+    "dates": ["2025-11-10", ...],
+    "industry": {"BK1031": {"name": "光伏设备", "bits": "1f", "first": 0, "last": 4, "streak": 5, "longest": 5}},
+    "concept": {...}
+}
+"""
+import json
+import os
+from pathlib import Path
+
+BOARD_TYPES = ('industry', 'concept')
+INDEX_VERSION = 1
+
+
+def default_index_path(archive_dir):
+    """索引默认与存档目录同级：data/store/board_appearance.json"""
+    return Path(archive_dir).parent / 'store' / 'board_appearance.json'
+
+
+def top_boards_by_type(archive_data, top_n=10):
+    """从存档中提取每类板块的 Top N（兼容新旧格式），返回 {type: [board, ...]}"""
+    if 'industry_boards' in archive_data or 'concept_boards' in archive_data:
+        return {
+            'industry': archive_data.get('industry_boards', [])[:top_n],
+            'concept': archive_data.get('concept_boards', [])[:top_n],
+        }
+
+    # 旧格式：单一 boards 列表
+    result = {'industry': [], 'concept': []}
+    for b in archive_data.get('boards', [])[:top_n]:
+        result['concept' if b.get('type') == 'concept' else 'industry'].append(b)
+    return result
+
+
+def _run_stats(bits):
+    """由位图计算 (first, last, streak, longest)，streak 为以 last 结尾的连续位数"""
+    if bits == 0:
+        return None, None, 0, 0
+    first = (bits & -bits).bit_length() - 1
+    last = bits.bit_length() - 1
+
+    zeros_below = ~bits & ((1 << last) - 1)
+    streak = last - (zeros_below.bit_length() - 1) if zeros_below else last + 1
+
+    longest, x = 0, bits
+    while x:
+        x >>= (x & -x).bit_length() - 1       # 去掉末尾的0
+        run = (~x & (x + 1)).bit_length() - 1  # 末尾连续1的个数
+        longest = max(longest, run)
+        x >>= run
+    return first, last, streak, longest
+
+
+class AppearanceIndex:
+    """板块上榜位图索引"""
+
+    def __init__(self, dates=None, boards=None):
+        self.dates = list(dates or [])
+        self.pos = {d: i for i, d in enumerate(self.dates)}
+        self.boards = boards or {t: {} for t in BOARD_TYPES}
+
+    # ---------- 持久化 ----------
+
+    @classmethod
+    def load(cls, path):
+        """加载索引，不存在或版本不符时返回空索引"""
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"⚠️  读取上榜索引失败: {e}")
+            return cls()
+        if data.get('version') != INDEX_VERSION:
+            return cls()
+
+        boards = {}
+        for board_type in BOARD_TYPES:
+            boards[board_type] = {
+                code: dict(entry, bits=int(entry['bits'], 16))
+                for code, entry in data.get(board_type, {}).items()
+            }
+        return cls(data.get('dates', []), boards)
+
+    def save(self, path):
+        """原子写入索引"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {'version': INDEX_VERSION, 'dates': self.dates}
+        for board_type in BOARD_TYPES:
+            data[board_type] = {
+                code: dict(entry, bits=format(entry['bits'], 'x'))
+                for code, entry in sorted(self.boards[board_type].items())
+            }
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    # ---------- 更新 ----------
+
+    def record_day(self, date_str, top_boards):
+        """
+        记录某个交易日的 Top 板块
+
+        参数:
+            top_boards: {type: [{'code': ..., 'name': ...}, ...]}
+        返回:
+            True=已记录; False=日期早于索引最新日期（需要重建）
+        """
+        if self.dates and date_str < self.dates[-1]:
+            return False
+
+        rerecord = bool(self.dates) and date_str == self.dates[-1]
+        if not rerecord:
+            self.dates.append(date_str)
+            self.pos[date_str] = len(self.dates) - 1
+        t = self.pos[date_str]
+
+        for board_type in BOARD_TYPES:
+            entries = self.boards[board_type]
+            today = {b['code']: b.get('name', '') for b in top_boards.get(board_type, [])}
+
+            if rerecord:
+                # 同一天重复记录（盘中多次运行）：撤销该日旧的上榜位
+                for code, entry in entries.items():
+                    if entry['last'] == t and code not in today:
+                        entry['bits'] &= ~(1 << t)
+                        self._refresh(entry)
+
+            for code, name in today.items():
+                entry = entries.get(code)
+                if entry is None:
+                    entries[code] = {'name': name, 'bits': 1 << t, 'first': t,
+                                     'last': t, 'streak': 1, 'longest': 1}
+                    continue
+                entry['name'] = name or entry['name']
+                if entry['last'] == t:
+                    continue
+                entry['streak'] = entry['streak'] + 1 if entry['last'] == t - 1 else 1
+                entry['longest'] = max(entry['longest'], entry['streak'])
+                entry['last'] = t
+                entry['bits'] |= 1 << t
+
+            # 撤销后可能出现空位图
+            for code in [c for c, e in entries.items() if e['bits'] == 0]:
+                del entries[code]
+        return True
+
+    @staticmethod
+    def _refresh(entry):
+        first, last, streak, longest = _run_stats(entry['bits'])
+        entry.update(first=first, last=last, streak=streak, longest=longest)
+
+    def sync(self, archive_dir):
+        """
+        与存档目录同步：只读取索引最新日期及之后的存档
+        存档中出现早于最新日期的新文件（回补）时全量重建
+
+        返回: 是否有更新
+        """
+        from generate_history import list_archive_dates, load_archive
+
+        archive_dates = sorted(list_archive_dates(archive_dir))
+        indexed = set(self.dates)
+        if any(d not in indexed for d in archive_dates if self.dates and d < self.dates[-1]):
+            print("  [上榜索引] 检测到回补存档，重建索引")
+            self.__init__()
+
+        pending = [d for d in archive_dates if not self.dates or d >= self.dates[-1]]
+        for date_str in pending:
+            data = load_archive(archive_dir, date_str)
+            if data:
+                self.record_day(date_str, top_boards_by_type(data))
+        return bool(pending)
+
+    # ---------- 查询（常数时间） ----------
+
+    def entry(self, code, board_type=None):
+        """查找板块记录（未指定类型时依次查找行业和概念）"""
+        for t in ([board_type] if board_type else BOARD_TYPES):
+            if code in self.boards[t]:
+                return self.boards[t][code]
+        return None
+
+    def streak(self, code, board_type=None, as_of=None):
+        """截至 as_of（默认最新交易日）的当前连续上榜天数"""
+        entry = self.entry(code, board_type)
+        t = self.pos.get(as_of, len(self.dates) - 1) if as_of else len(self.dates) - 1
+        return entry['streak'] if entry and entry['last'] == t else 0
+
+    def last_streak(self, code, board_type=None):
+        """以最近一次上榜日结尾的连续上榜天数"""
+        entry = self.entry(code, board_type)
+        return entry['streak'] if entry else 0
+
+    def longest_streak(self, code, board_type=None):
+        entry = self.entry(code, board_type)
+        return entry['longest'] if entry else 0
+
+    def first_seen(self, code, board_type=None):
+        entry = self.entry(code, board_type)
+        return self.dates[entry['first']] if entry else None
+
+    def last_seen(self, code, board_type=None):
+        entry = self.entry(code, board_type)
+        return self.dates[entry['last']] if entry else None
+
+    def appeared_within(self, code, board_type, n, before):
+        """before（不含）之前的最近 n 个交易日内是否上榜"""
+        entry = self.entry(code, board_type)
+        if entry is None:
+            return False
+        end = self._position_before(before)
+        start = max(0, end - n)
+        window = ((1 << (end - start)) - 1) << start
+        return bool(entry['bits'] & window)
+
+    def new_boards(self, board_type, codes, lookback, before):
+        """codes 中在 before 之前 lookback 个交易日内都未上榜的板块"""
+        return {code for code in codes if not self.appeared_within(code, board_type, lookback, before)}
+
+    def _position_before(self, date_str):
+        """严格早于 date_str 的交易日数量（即窗口右端位置）"""
+        if date_str in self.pos:
+            return self.pos[date_str]
+        import bisect
+        return bisect.bisect_left(self.dates, date_str)
+
+
+def load_appearance_index(archive_dir, index_path=None):
+    """加载索引并与存档同步，有更新时写回磁盘"""
+    index_path = index_path or default_index_path(archive_dir)
+    index = AppearanceIndex.load(index_path)
+    if index.sync(archive_dir):
+        try:
+            index.save(index_path)
+        except OSError as e:
+            print(f"⚠️  保存上榜索引失败: {e}")
+    return index
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+存档月度合并
+每天的存档 archive/<date>.json 会一直累积在仓库里。已结束且早于最近窗口的月份
+合并为一个压缩的列式包 archive/bundles/<YYYY-MM>.json.gz，删除对应的单日文件：
+- 每天的非板块字段（market/indices/market_indices/...）原样保存一份
+- 全月的板块记录按列存放（code 一列、ret 一列……），相同字段放在一起压缩率更高
+- archive/bundles/index.json 记录每个包包含的日期和每天内容的哈希，
+  列出日期时只读索引，不再扫描全部文件
+- 合并前逐日校验包能还原出与原文件完全相同的内容，失败则不删除原文件
+
+load_archive / list_archive_dates 同时读取单日文件和月度包（同一天两者都有时以单日文件为准，
+例如 reprocess.py 重算了已合并的日期，下次合并时写回包中）
+"""
+import copy
+import gzip
+import json
+import os
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+
+BUNDLE_VERSION = 1
+BUNDLE_DIR = 'bundles'
+INDEX_FILE = 'index.json'
+
+# 保留为单日文件的最近交易日数
+KEEP_DAYS = 60
+
+BOARD_LISTS = ('industry_boards', 'concept_boards')
+
+
+def bundle_root(archive_dir):
+    return Path(archive_dir) / BUNDLE_DIR
+
+
+def _canonical(data):
+    """用于比较的规范 JSON（NaN 也能比较）"""
+    return json.dumps(data, ensure_ascii=False, sort_keys=True)
+
+
+def day_hash(data):
+    from pipeline import stable_hash
+    return stable_hash(data)
+
+
+# ---------- 索引 ----------
+
+@lru_cache(maxsize=8)
+def _read_index(path, mtime_ns, size):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_index(archive_dir):
+    """月度包索引 {'version', 'bundles': {month: {'file', 'dates': {date: hash}}}}，不存在时为空"""
+    path = bundle_root(archive_dir) / INDEX_FILE
+    try:
+        st = path.stat()
+        index = _read_index(str(path), st.st_mtime_ns, st.st_size)
+        if index.get('version') == BUNDLE_VERSION:
+            return index
+        print(f"⚠️  月度包索引版本不符: {path}")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"⚠️  读取月度包索引失败: {e}")
+    return {'version': BUNDLE_VERSION, 'bundles': {}}
+
+
+def _save_index(index, archive_dir):
+    path = bundle_root(archive_dir) / INDEX_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def bundled_dates(archive_dir):
+    """已合并的日期 {date: month}"""
+    return {d: month for month, entry in load_index(archive_dir)['bundles'].items() for d in entry['dates']}
+
+
+def bundle_fingerprint(archive_dir):
+    """月度包指纹（文件名+大小）"""
+    root = bundle_root(archive_dir)
+    return [[f"{BUNDLE_DIR}/{entry['file']}", (root / entry['file']).stat().st_size]
+            for _, entry in sorted(load_index(archive_dir)['bundles'].items())
+            if (root / entry['file']).exists()]
+
+
+def archive_entries(archive_dir):
+    """
+    每个存档日的指纹 [[<date>.json, 大小或内容哈希, 修改时间或包名], ...]（按日期排序）
+    单日文件用文件大小和修改时间，已合并的日期用索引中的内容哈希
+    """
+    archive = Path(archive_dir)
+    entries = {}
+    for month, entry in load_index(archive_dir)['bundles'].items():
+        for d, digest in entry['dates'].items():
+            entries[d] = [f"{d}.json", digest, month]
+    for f in archive.glob('*.json'):
+        try:
+            date.fromisoformat(f.stem)
+        except ValueError:
+            continue
+        st = f.stat()
+        entries[f.stem] = [f.name, st.st_size, st.st_mtime_ns]
+    return [entries[d] for d in sorted(entries)]
+
+
+# ---------- 包的编码 ----------
+
+def encode_bundle(month, days):
+    """
+    一个月的存档 → 列式结构
+
+    参数:
+        days: {date: 存档 dict}
+    """
+    dates = sorted(days)
+    docs, key_sets, key_id, columns = [], [], [], {}
+    n = 0
+    for d in dates:
+        doc = {}
+        for key, value in days[d].items():
+            if key in BOARD_LISTS and isinstance(value, list) and all(isinstance(b, dict) for b in value):
+                doc[key] = len(value)  # 板块列表只记行数，内容放在列中
+                for b in value:
+                    keys = list(b)
+                    if keys not in key_sets:
+                        key_sets.append(keys)
+                    key_id.append(key_sets.index(keys))
+                    for k in keys:
+                        columns.setdefault(k, [None] * n)
+                    for k, col in columns.items():
+                        col.append(b.get(k))
+                    n += 1
+            else:
+                doc[key] = value
+        docs.append(doc)
+    return {
+        'version': BUNDLE_VERSION,
+        'month': month,
+        'dates': dates,
+        'docs': docs,
+        'boards': {'keys': key_sets, 'key_id': key_id, 'columns': columns},
+    }
+
+
+def decode_day(bundle, i):
+    """列式结构 → 第 i 天的存档 dict（新对象，调用方可修改）"""
+    boards = bundle['boards']
+    start = bundle['_offsets'][i]
+    data = {}
+    for key, value in bundle['docs'][i].items():
+        if key in BOARD_LISTS and isinstance(value, int):
+            rows = []
+            for r in range(start, start + value):
+                keys = boards['keys'][boards['key_id'][r]]
+                rows.append({k: copy.deepcopy(boards['columns'][k][r]) for k in keys})
+            data[key] = rows
+            start += value
+        else:
+            data[key] = copy.deepcopy(value)
+    return data
+
+
+def write_bundle(bundle, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    payload = json.dumps(bundle, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    # mtime=0：内容不变时压缩结果不变，避免仓库里出现无意义的改动
+    with open(tmp, 'wb') as f:
+        with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=9, mtime=0) as gz:
+            gz.write(payload)
+    os.replace(tmp, path)
+
+
+@lru_cache(maxsize=4)
+def _read_bundle(path, mtime_ns, size):
+    with gzip.open(path, 'rb') as f:
+        bundle = json.loads(f.read().decode('utf-8'))
+    # 每天板块记录在列中的起始行
+    offsets, n = [], 0
+    for doc in bundle['docs']:
+        offsets.append(n)
+        n += sum(v for k, v in doc.items() if k in BOARD_LISTS and isinstance(v, int))
+    bundle['_offsets'] = offsets
+    bundle['_pos'] = {d: i for i, d in enumerate(bundle['dates'])}
+    return bundle
+
+
+def read_bundle(path):
+    """读取月度包（按文件修改时间缓存解压结果）"""
+    st = Path(path).stat()
+    return _read_bundle(str(path), st.st_mtime_ns, st.st_size)
+
+
+def load_bundled(archive_dir, date_str):
+    """从月度包读取一天的存档，不在包中或读取失败返回 None"""
+    entry = load_index(archive_dir)['bundles'].get(date_str[:7])
+    if not entry or date_str not in entry['dates']:
+        return None
+    try:
+        bundle = read_bundle(bundle_root(archive_dir) / entry['file'])
+        return decode_day(bundle, bundle['_pos'][date_str])
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️  读取月度包 {entry['file']} 中的 {date_str} 失败: {e}")
+        return None
+
+
+def load_month(archive_dir, month):
+    """已合并月份的全部存档 {date: dict}"""
+    entry = load_index(archive_dir)['bundles'].get(month)
+    if not entry:
+        return {}
+    bundle = read_bundle(bundle_root(archive_dir) / entry['file'])
+    return {d: decode_day(bundle, i) for i, d in enumerate(bundle['dates'])}
+
+
+# ---------- 合并 / 展开 ----------
+
+def plan_compaction(archive_dir, keep_days=KEEP_DAYS, today=None):
+    """
+    需要合并的月份 {month: [单日文件日期, ...]}
+    只合并已结束（早于本月）且整月都在最近 keep_days 个交易日之前的月份
+    """
+    from generate_history import list_archive_dates
+
+    all_dates = sorted(list_archive_dates(archive_dir))
+    if len(all_dates) <= keep_days:
+        return {}
+    cutoff = all_dates[-keep_days][:7] if keep_days > 0 else '9999-99'
+    current = (today or date.today()).isoformat()[:7]
+    files = sorted(f.stem for f in Path(archive_dir).glob('*.json') if f.stem in set(all_dates))
+    months = {}
+    for d in files:
+        if d[:7] < min(cutoff, current):
+            months.setdefault(d[:7], []).append(d)
+    return months
+
+
+def compact(archive_dir, keep_days=KEEP_DAYS, dry_run=False, today=None):
+    """
+    把已结束月份的单日存档合并为月度包并删除单日文件
+
+    返回: {month: 合并的单日文件数}
+    """
+    from generate_history import load_archive
+
+    months = plan_compaction(archive_dir, keep_days, today)
+    print(f"🗜️  需要合并 {len(months)} 个月（保留最近 {keep_days} 个交易日为单日文件）")
+    if dry_run or not months:
+        for month, days in months.items():
+            print(f"  ▶️  {month}: {len(days)} 个单日文件")
+        return {month: len(days) for month, days in months.items()}
+
+    archive = Path(archive_dir)
+    index = copy.deepcopy(load_index(archive_dir))
+    result = {}
+    for month, files in sorted(months.items()):
+        # 已有包中的日期与新的单日文件合并，单日文件优先
+        days = load_month(archive_dir, month)
+        loaded = {}
+        for d in files:
+            data = load_archive(archive_dir, d)
+            if data is None:
+                print(f"  ⚠️  {d}: 无法读取，保留单日文件")
+                continue
+            loaded[d] = days[d] = data
+        if not loaded:
+            continue
+
+        bundle = encode_bundle(month, days)
+        path = bundle_root(archive_dir) / f"{month}.json.gz"
+        write_bundle(bundle, path)
+        check = read_bundle(path)
+        mismatched = [d for d, data in days.items()
+                      if _canonical(decode_day(check, check['_pos'][d])) != _canonical(data)]
+        if mismatched:
+            raise RuntimeError(f"月度包 {month} 还原校验失败: {mismatched}")
+
+        index['bundles'][month] = {'file': path.name, 'dates': {d: day_hash(data) for d, data in sorted(days.items())}}
+        _save_index(index, archive_dir)
+        for d in loaded:
+            (archive / f"{d}.json").unlink()
+        result[month] = len(loaded)
+        print(f"  ✅ {month}: {len(loaded)} 个单日文件 → {path.name} ({len(days)} 天, {path.stat().st_size / 1024:.0f} KB)")
+    return result
+
+
+def expand(archive_dir, month):
+    """把一个月度包还原为单日文件（手工修改历史存档时使用），返回还原的天数"""
+    days = load_month(archive_dir, month)
+    if not days:
+        print(f"⚠️  没有 {month} 的月度包")
+        return 0
+    archive = Path(archive_dir)
+    for d, data in days.items():
+        target = archive / f"{d}.json"
+        if target.exists():
+            continue
+        tmp = target.with_name(f".{target.name}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, target)
+    index = copy.deepcopy(load_index(archive_dir))
+    entry = index['bundles'].pop(month)
+    _save_index(index, archive_dir)
+    (bundle_root(archive_dir) / entry['file']).unlink()
+    print(f"✅ {month}: 还原 {len(days)} 个单日文件")
+    return len(days)
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description='把已结束月份的存档合并为压缩的月度包')
+    ap.add_argument('--archive-dir', default='site/data/archive', help='存档目录')
+    ap.add_argument('--keep-days', type=int, default=KEEP_DAYS, help=f'保留为单日文件的最近交易日数（默认{KEEP_DAYS}）')
+    ap.add_argument('--dry-run', action='store_true', help='只显示需要合并的月份')
+    ap.add_argument('--expand', metavar='YYYY-MM', default=None, help='把指定月份的包还原为单日文件')
+    args = ap.parse_args()
+
+    if args.expand:
+        expand(args.archive_dir, args.expand)
+    else:
+        compact(args.archive_dir, args.keep_days, args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
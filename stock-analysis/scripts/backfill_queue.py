@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+回填任务队列
+板块/指数K线、板块成分和历史板块排名的回填与实时快照共用东方财富的请求频率。
+回填任务持久化在 store/backfill.db（SQLite），带优先级和重试状态，只在实时数据发布之后用剩余时间执行：
+
+- 交易时间内：每次 ETL 发布 daily.json 后，用抓取时间预算的剩余部分排空队列（任务之间留出间隔）
+- 非交易时间：按 --backfill-budget 全速排空
+- 失败的任务按指数退避重试，连续失败 MAX_ATTEMPTS 次后标记为 dead（--retry-dead 可重新启用）
+
+任务类型（数字越小越优先）:
+    index_kline    指数K线（注册表中的全部指数）
+    board_kline    板块K线（当天上榜板块，按类型内排名）
+    board_members  板块成分（market 模式下成分缓存已过期的板块，实时路径只补全没有缓存的板块）
+    board_wheel    历史板块排名（存档不足 ARCHIVE_TARGET_DAYS 个交易日时，用板块轮动接口补齐存档）
+
+示例:
+    python backfill_queue.py --store-dir site/data/store --status
+    python backfill_queue.py --store-dir site/data/store --archive-dir site/data/archive --drain --budget 600
+"""
+import json
+import sqlite3
+import time
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+from fetch_scheduler import REQUEST_TIMEOUT, FetchBudget
+
+# 非交易时间排空队列的默认时间预算（秒，不超过定时任务间隔）
+BACKFILL_BUDGET_SECONDS = 240
+
+# 交易时间内两个回填任务之间的间隔（秒），避免挤占下一轮实时抓取的请求频率
+TRADING_TASK_DELAY = 0.5
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 3600
+
+# 已完成的任务保留天数（用于状态统计），之后从队列中删除
+DONE_RETENTION_DAYS = 30
+
+# 存档少于该交易日数时回填历史板块排名
+ARCHIVE_TARGET_DAYS = 30
+
+PRIORITY = {
+    'index_kline': 10,
+    'board_kline': 20,
+    'board_members': 60,
+    'board_wheel': 100,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    params TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE INDEX IF NOT EXISTS tasks_due ON tasks (status, priority, next_at);
+"""
+
+
+def default_queue_path(store_dir):
+    return Path(store_dir) / 'backfill.db'
+
+
+class BackfillQueue:
+    """SQLite 持久化的回填任务队列，(kind, key) 唯一"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, kind, key, priority=None, params=None):
+        """
+        加入任务；已在队列中的任务取更高的优先级并更新参数，
+        已完成的任务重新打开，dead 任务保持不变（见 retry_dead）
+        """
+        now = time.time()
+        priority = PRIORITY[kind] if priority is None else priority
+        with self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO tasks (kind, key, priority, params, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, key) DO UPDATE SET
+                    priority = CASE WHEN status = 'pending' THEN MIN(priority, excluded.priority)
+                                    ELSE excluded.priority END,
+                    params = excluded.params,
+                    attempts = CASE WHEN status = 'done' THEN 0 ELSE attempts END,
+                    next_at = CASE WHEN status = 'done' THEN 0 ELSE next_at END,
+                    status = CASE WHEN status = 'done' THEN 'pending' ELSE status END,
+                    updated_at = excluded.updated_at
+                """,
+                (kind, str(key), int(priority), json.dumps(params or {}, sort_keys=True), now, now))
+
+    def next_task(self, now=None):
+        """优先级最高的到期任务（sqlite3.Row），没有返回 None"""
+        now = time.time() if now is None else now
+        return self.conn.execute(
+            "SELECT * FROM tasks WHERE status = 'pending' AND next_at <= ? "
+            "ORDER BY priority, created_at LIMIT 1", (now,)).fetchone()
+
+    def complete(self, kind, key):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE tasks SET status = 'done', last_error = NULL, updated_at = ? WHERE kind = ? AND key = ?",
+                (time.time(), kind, key))
+
+    def fail(self, kind, key, error):
+        """记录一次失败：按指数退避推迟重试，达到 MAX_ATTEMPTS 次标记为 dead"""
+        row = self.conn.execute("SELECT attempts FROM tasks WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+        attempts = (row['attempts'] if row else 0) + 1
+        now = time.time()
+        status = 'dead' if attempts >= MAX_ATTEMPTS else 'pending'
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+        with self.conn:
+            self.conn.execute(
+                "UPDATE tasks SET status = ?, attempts = ?, next_at = ?, last_error = ?, updated_at = ? "
+                "WHERE kind = ? AND key = ?",
+                (status, attempts, now + delay, str(error)[:500], now, kind, key))
+        return status
+
+    def retry_dead(self):
+        """重新启用全部 dead 任务，返回数量"""
+        with self.conn:
+            cur = self.conn.execute(
+                "UPDATE tasks SET status = 'pending', attempts = 0, next_at = 0, updated_at = ? WHERE status = 'dead'",
+                (time.time(),))
+        return cur.rowcount
+
+    def purge_done(self, days=DONE_RETENTION_DAYS):
+        with self.conn:
+            self.conn.execute("DELETE FROM tasks WHERE status = 'done' AND updated_at < ?",
+                              (time.time() - days * 86400,))
+
+    def counts(self):
+        """{'pending': n, 'due': n, 'done': n, 'dead': n}"""
+        result = {'pending': 0, 'due': 0, 'done': 0, 'dead': 0}
+        for row in self.conn.execute("SELECT status, COUNT(*) AS n FROM tasks GROUP BY status"):
+            result[row['status']] = row['n']
+        result['due'] = self.conn.execute(
+            "SELECT COUNT(*) FROM tasks WHERE status = 'pending' AND next_at <= ?", (time.time(),)).fetchone()[0]
+        return result
+
+    def tasks(self, status=None):
+        sql, args = "SELECT * FROM tasks", ()
+        if status:
+            sql, args = sql + " WHERE status = ?", (status,)
+        return [dict(row) for row in self.conn.execute(sql + " ORDER BY status, priority, created_at", args)]
+
+
+# ---------- 任务执行 ----------
+
+def _board_kline(key, params, ctx):
+    from eastmoney import fetch_board_kline
+    from kline_store import KlineStore, default_store_root
+    store = KlineStore(default_store_root(ctx['store_dir']))
+    if not store.update([key], lambda code, n: fetch_board_kline(code, days=n), params.get('days', 120), delay=0):
+        raise RuntimeError('板块K线请求失败')
+
+
+def _index_kline(key, params, ctx):
+    from eastmoney import fetch_index_kline
+    from kline_store import KlineStore, default_store_root
+    store = KlineStore(default_store_root(ctx['store_dir']))
+    if not store.update([key], lambda code, n: fetch_index_kline(code, days=n), params.get('days', 250), delay=0):
+        raise RuntimeError('指数K线请求失败')
+
+
+def _board_members(key, params, ctx):
+    from eastmoney import fetch_board_members
+    from membership import load_membership, refresh_membership, save_membership, stale_boards
+    path = Path(ctx['store_dir']) / 'board_members.json'
+    table = load_membership(path)
+    if refresh_membership(table, [key], fetch_board_members, today=ctx.get('today'), delay=0):
+        save_membership(table, str(path))
+    elif stale_boards(table, [key], ctx.get('today')):
+        raise RuntimeError('板块成分请求失败')
+
+
+def _board_wheel(key, params, ctx):
+    from fetch_board_history import fetch_board_wheel_history, save_to_archive
+    result = fetch_board_wheel_history(days=params.get('days', ARCHIVE_TARGET_DAYS), top_n=30)
+    if not result or not any(result):
+        raise RuntimeError('板块轮动历史请求失败')
+    save_to_archive(*result, ctx['archive_dir'])
+
+
+HANDLERS = {
+    'index_kline': _index_kline,
+    'board_kline': _board_kline,
+    'board_members': _board_members,
+    'board_wheel': _board_wheel,
+}
+
+
+def drain(queue, store_dir, archive_dir, seconds=BACKFILL_BUDGET_SECONDS, delay=0.0, today=None):
+    """
+    在时间预算内按优先级执行到期任务
+
+    参数:
+        seconds: 时间预算（None=不限时）；剩余时间不足一个请求超时时不再开始新任务
+        delay: 任务之间的间隔（秒）
+    返回: {'done': n, 'failed': n, 'dead': n}
+    """
+    budget = FetchBudget(seconds)
+    ctx = {'store_dir': store_dir, 'archive_dir': archive_dir, 'today': today}
+    result = {'done': 0, 'failed': 0, 'dead': 0}
+    queue.purge_done()
+
+    while budget.remaining() >= REQUEST_TIMEOUT:
+        task = queue.next_task()
+        if task is None:
+            break
+        kind, key = task['kind'], task['key']
+        handler = HANDLERS.get(kind)
+        try:
+            if handler is None:
+                raise ValueError(f'未知任务类型 {kind}')
+            handler(key, json.loads(task['params']), ctx)
+        except Exception as e:
+            status = queue.fail(kind, key, e)
+            result['dead' if status == 'dead' else 'failed'] += 1
+            print(f"  [回填] ⚠️  {kind} {key} 失败（第 {task['attempts'] + 1} 次）: {e}")
+        else:
+            queue.complete(kind, key)
+            result['done'] += 1
+        if delay and budget.remaining() >= REQUEST_TIMEOUT + delay:
+            time.sleep(delay)
+
+    return result
+
+
+# ---------- 生成任务 ----------
+
+def _previous_trading_day(today):
+    """today 之前最近的工作日（不含节假日判断）"""
+    return (pd.Timestamp(today) - pd.offsets.BDay(1)).date().isoformat()
+
+
+def enqueue_snapshot(queue, boards_df, store_dir, archive_dir, today=None):
+    """
+    根据本次快照加入回填任务：K线落后于上一交易日的指数和上榜板块、成分缓存过期的板块，
+    以及存档不足 ARCHIVE_TARGET_DAYS 个交易日时的历史板块排名
+
+    返回: 加入的任务数
+    """
+    from generate_history import list_archive_dates
+    from index_registry import INDEX_REGISTRY
+    from kline_store import KlineStore, default_store_root
+    from membership import load_membership
+
+    today = today or date.today().isoformat()
+    cutoff = _previous_trading_day(today)
+    store = KlineStore(default_store_root(store_dir))
+
+    def behind(code):
+        last = store.last_date(code)
+        return last is None or last < cutoff
+
+    count = 0
+    for entry in INDEX_REGISTRY:
+        if behind(entry['code']):
+            queue.enqueue('index_kline', entry['code'], params={'days': 250})
+            count += 1
+
+    if boards_df is not None and not boards_df.empty:
+        if 'bk_type' in boards_df.columns:
+            rank = boards_df.groupby('bk_type', sort=False).cumcount()
+        else:
+            rank = pd.Series(range(len(boards_df)), index=boards_df.index)
+        members = load_membership(Path(store_dir) / 'board_members.json').get('boards', {})
+        for code, r in zip(boards_df['bk_code'].astype(str), rank):
+            if behind(code):
+                queue.enqueue('board_kline', code, PRIORITY['board_kline'] + int(r), {'days': 120})
+                count += 1
+            if code in members and members[code].get('date') != today:
+                queue.enqueue('board_members', code, PRIORITY['board_members'] + int(r))
+                count += 1
+
+    if len(list_archive_dates(archive_dir)) < ARCHIVE_TARGET_DAYS:
+        queue.enqueue('board_wheel', 'recent', params={'days': ARCHIVE_TARGET_DAYS})
+        count += 1
+
+    return count
+
+
+def enqueue_board_klines(queue, codes, store_dir, today=None, priority=None, days=120):
+    """
+    把K线落后于上一交易日的板块加入回填任务（generate_history --fetch-klines 跟踪的板块），
+    每个板块每个交易日最多请求一次
+
+    返回: 加入的任务数
+    """
+    from kline_store import KlineStore, default_store_root
+
+    cutoff = _previous_trading_day(today or date.today().isoformat())
+    store = KlineStore(default_store_root(store_dir))
+    count = 0
+    for code in codes:
+        last = store.last_date(code)
+        if last is None or last < cutoff:
+            queue.enqueue('board_kline', code, priority, {'days': days})
+            count += 1
+    return count
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description='查看或排空回填任务队列')
+    ap.add_argument('--store-dir', default='site/data/store', help='数据存储目录（队列文件 backfill.db）')
+    ap.add_argument('--archive-dir', default='site/data/archive', help='存档目录（历史板块排名回填）')
+    ap.add_argument('--status', action='store_true', help='显示队列中的任务')
+    ap.add_argument('--drain', action='store_true', help='按优先级执行到期任务')
+    ap.add_argument('--budget', type=float, default=BACKFILL_BUDGET_SECONDS, help='排空的时间预算（秒，0=不限时）')
+    ap.add_argument('--retry-dead', action='store_true', help='重新启用多次失败后放弃的任务')
+    args = ap.parse_args()
+
+    queue = BackfillQueue(default_queue_path(args.store_dir))
+    try:
+        if args.retry_dead:
+            print(f"🔁 重新启用 {queue.retry_dead()} 个任务")
+        if args.drain:
+            from host_pool import load_stats, report, save_stats
+            stats_path = Path(args.store_dir) / 'host_stats.json'
+            load_stats(stats_path)
+            result = drain(queue, args.store_dir, args.archive_dir, args.budget or None)
+            report()
+            save_stats(stats_path)
+            print(f"✅ 回填完成 {result['done']} 个，失败 {result['failed']} 个，放弃 {result['dead']} 个")
+        if args.status or not (args.drain or args.retry_dead):
+            counts = queue.counts()
+            print(f"📋 回填队列: 待执行 {counts['pending']}（到期 {counts['due']}），"
+                  f"已完成 {counts['done']}，已放弃 {counts['dead']}")
+            for task in queue.tasks():
+                if task['status'] == 'done':
+                    continue
+                error = f"  {task['last_error']}" if task['last_error'] else ''
+                print(f"  {task['status']:<7} P{task['priority']:<3} {task['kind']:<13} {task['key']:<8} "
+                      f"尝试 {task['attempts']}{error}")
+    finally:
+        queue.close()
+
+
+if __name__ == '__main__':
+    main()
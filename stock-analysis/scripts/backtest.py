@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+板块评级与市场节奏回测
+- 从存档读取 日期×板块 的面板（score, stance, 当日 advice）
+- 由K线存储计算每个板块未来N日收益（收盘到N日后收盘）
+- 按评级统计命中率/平均收益/超额收益，按节奏分组统计，
+  计算 score 与未来收益的截面秩相关（IC）和多空收益
+- 用指数K线检验 advice：DEFENSE 应对应大盘跑赢小盘，OFFENSE 反之
+
+面板和K线默认从内存映射的只读面板（panel.py）读取，面板不可用时逐个读取存档 JSON
+
+所有统计均在整个面板上一次性分组计算，不逐日循环
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from generate_history import list_archive_dates, load_archive
+from kline_store import KlineStore, default_store_root
+from panel import ADVICES, STANCES, open_panel
+
+LONG_STANCES = ['STRONG_BUY', 'BUY']
+
+# 计算截面 IC 所需的最少板块数
+MIN_CROSS_SECTION = 3
+
+
+def load_panel(archive_dir, start=None, end=None):
+    """
+    逐个读取存档 JSON 组成面板（跳过历史回填数据，其评级和节奏是默认值）
+    与 panel.Panel.boards() 结果一致，面板不可用时使用
+
+    返回:
+        DataFrame(date, type, code, name, rank, score, stance, ret, advice,
+                  pop, dispersion, pop_turnover, up_count)
+        后四列为评分分量（旧存档没有 pop_turnover/up_count，为 NaN）
+    """
+    dates = sorted(list_archive_dates(archive_dir))
+    dates = [d for d in dates if (not start or d >= start) and (not end or d <= end)]
+
+    rows = []
+    for date_str in dates:
+        data = load_archive(archive_dir, date_str)
+        if not data or data.get('source') == 'history_backfill':
+            continue
+        advice = data.get('market', {}).get('advice', 'NEUTRAL')
+        for board_type in ('industry', 'concept'):
+            for rank, b in enumerate(data.get(f'{board_type}_boards', []), 1):
+                rows.append((date_str, board_type, b.get('code'), b.get('name', ''), rank,
+                             b.get('score'), b.get('stance'), b.get('ret'), advice,
+                             b.get('pop'), b.get('dispersion'), b.get('pop_turnover'), b.get('up_count')))
+
+    panel = pd.DataFrame(rows, columns=['date', 'type', 'code', 'name', 'rank',
+                                        'score', 'stance', 'ret', 'advice',
+                                        'pop', 'dispersion', 'pop_turnover', 'up_count'])
+    for col in ('score', 'ret', 'pop', 'dispersion', 'pop_turnover', 'up_count'):
+        panel[col] = pd.to_numeric(panel[col], errors='coerce')
+    return panel.dropna(subset=['code', 'score', 'stance']).reset_index(drop=True)
+
+
+def forward_returns(close, horizon):
+    """
+    未来N日收益矩阵：close[t+N] / close[t] - 1
+
+    参数:
+        close: DataFrame(index=date, columns=code) 收盘价宽表
+    返回:
+        与 close 同形状的 ndarray，末尾N行为 NaN
+    """
+    values = close.to_numpy(dtype=float)
+    fwd = np.full_like(values, np.nan)
+    if horizon < len(values):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fwd[:-horizon] = values[horizon:] / values[:-horizon] - 1
+    return fwd
+
+
+def lookup(matrix, frame, dates, codes):
+    """按 (date, code) 从 frame 形状的矩阵中批量取值，缺失为 NaN"""
+    row = frame.index.get_indexer(dates)
+    col = frame.columns.get_indexer(codes)
+    ok = (row >= 0) & (col >= 0)
+    out = np.full(len(dates), np.nan)
+    out[ok] = matrix[row[ok], col[ok]]
+    return out
+
+
+def attach_forward_returns(panel, close, horizons):
+    """
+    为面板添加 fwd_N（未来N日收益）和 xs_N（相对同日同类板块均值的超额收益）列
+    section 列为 (日期, 板块类型) 截面的整数编号，后续分组都按它进行，避免反复对字符串分组
+    """
+    panel = panel.copy()
+    panel['section'] = panel.groupby(['date', 'type'], sort=True).ngroup()
+    for col in ('type', 'stance', 'advice'):
+        panel[col] = panel[col].astype('category')
+    for n in horizons:
+        fwd = forward_returns(close, n)
+        panel[f'fwd_{n}'] = lookup(fwd, close, panel['date'], panel['code'])
+        panel[f'xs_{n}'] = panel[f'fwd_{n}'] - panel.groupby('section')[f'fwd_{n}'].transform('mean')
+    return panel
+
+
+def sections(panel):
+    """截面编号 → (date, type)"""
+    return pd.MultiIndex.from_frame(
+        panel.drop_duplicates('section').sort_values('section')[['date', 'type']].astype(str))
+
+
+def group_stats(panel, keys, horizon):
+    """按 keys 分组的样本数、平均收益、胜率、平均超额和超额胜率"""
+    fwd, xs = f'fwd_{horizon}', f'xs_{horizon}'
+    df = panel.dropna(subset=[fwd])
+    if df.empty:
+        return pd.DataFrame()
+    return df.assign(win=df[fwd] > 0, beat=df[xs] > 0).groupby(keys, observed=True).agg(
+        n=(fwd, 'size'),
+        mean_ret=(fwd, 'mean'),
+        hit_rate=('win', 'mean'),
+        mean_excess=(xs, 'mean'),
+        beat_rate=('beat', 'mean'),
+    )
+
+
+def rank_ic(panel, horizon, min_count=MIN_CROSS_SECTION):
+    """
+    每个 (日期, 板块类型) 截面上 score 与未来收益的 Spearman 秩相关
+
+    返回: Series(index=(date, type))
+    """
+    fwd = f'fwd_{horizon}'
+    df = panel.dropna(subset=[fwd])[['section', 'score', fwd]]
+    g = df.groupby('section')
+    rs = g['score'].rank()
+    rf = g[fwd].rank()
+    rs -= rs.groupby(df['section']).transform('mean')
+    rf -= rf.groupby(df['section']).transform('mean')
+
+    sums = pd.DataFrame({'section': df['section'], 'cov': rs * rf, 'vs': rs ** 2, 'vf': rf ** 2}) \
+             .groupby('section').agg(n=('cov', 'size'), cov=('cov', 'sum'), vs=('vs', 'sum'), vf=('vf', 'sum'))
+    denom = np.sqrt(sums['vs'] * sums['vf'])
+    ic = (sums['cov'] / denom.where(denom > 0))[sums['n'] >= min_count].dropna()
+    ic.index = sections(panel)[ic.index]
+    return ic
+
+
+def long_short(panel, horizon):
+    """
+    每个 (日期, 板块类型) 截面的多空收益
+    - stance: 看多评级（STRONG_BUY/BUY）均值 - 其余评级均值
+    - score: score 上半区均值 - 下半区均值
+
+    返回: DataFrame(index=(date, type), columns=[stance, score])
+    """
+    fwd = f'fwd_{horizon}'
+    df = panel.dropna(subset=[fwd])
+
+    def spread(is_long):
+        means = df[fwd].groupby([df['section'], is_long]).mean().unstack()
+        return means.reindex(columns=[True, False]).pipe(lambda m: m[True] - m[False])
+
+    is_long_stance = pd.Series(df['stance'].isin(LONG_STANCES), index=df.index)
+    is_long_score = df.groupby('section')['score'].rank(pct=True) > 0.5
+    out = pd.DataFrame({'stance': spread(is_long_stance), 'score': spread(is_long_score)})
+    out.index = sections(panel)[out.index]
+    return out
+
+
+def summarize(series):
+    """均值、标准差、t 值、正值占比、样本数"""
+    s = pd.Series(series).dropna()
+    n = len(s)
+    if n == 0:
+        return {'n': 0}
+    std = float(s.std(ddof=1)) if n > 1 else None
+    t = float(s.mean() / std * np.sqrt(n)) if std else None
+    return {'n': n, 'mean': float(s.mean()), 'std': std, 't': t, 'positive': float((s > 0).mean())}
+
+
+def advice_stats(panel, index_close, horizon):
+    """
+    检验节奏建议：未来N日 大盘(沪深300) - 小盘(中证1000) 的收益差
+    DEFENSE 命中 = 差值 > 0；OFFENSE 命中 = 差值 < 0；NEUTRAL 只统计均值
+    """
+    if index_close.empty or not {'HS300', 'CSI1000'} <= set(index_close.columns):
+        return pd.DataFrame()
+    fwd = forward_returns(index_close[['HS300', 'CSI1000']], horizon)
+    spread = pd.Series(fwd[:, 0] - fwd[:, 1], index=index_close.index)
+
+    days = panel.drop_duplicates('date').set_index('date')['advice']
+    df = pd.DataFrame({'advice': days, 'spread': spread.reindex(days.index)}).dropna()
+    if df.empty:
+        return pd.DataFrame()
+    hit = np.where(df['advice'] == 'DEFENSE', df['spread'] > 0,
+                   np.where(df['advice'] == 'OFFENSE', df['spread'] < 0, np.nan))
+    return df.assign(hit=hit).groupby('advice', observed=True).agg(
+        n=('spread', 'size'), mean_spread=('spread', 'mean'), hit_rate=('hit', 'mean'))
+
+
+def run_backtest(panel, close, index_close, horizons):
+    """
+    计算全部回测统计
+
+    返回: {horizon: {stance, regime_stance, ic, long_short, advice}}
+    """
+    panel = attach_forward_returns(panel, close, horizons)
+    report = {}
+    for n in horizons:
+        ic = rank_ic(panel, n)
+        ls = long_short(panel, n)
+        report[n] = {
+            'coverage': float(panel[f'fwd_{n}'].notna().mean()) if len(panel) else 0.0,
+            'stance': group_stats(panel, ['stance'], n).reindex(STANCES).dropna(how='all'),
+            'regime_stance': group_stats(panel, ['advice', 'stance'], n),
+            'ic': {'all': summarize(ic),
+                   **{t: summarize(ic.xs(t, level='type')) for t in ic.index.get_level_values('type').unique()}},
+            'ic_by_regime': {
+                advice: summarize(ic[ic.index.get_level_values('date').isin(
+                    panel.loc[panel['advice'] == advice, 'date'])])
+                for advice in ADVICES
+            },
+            'long_short': {col: summarize(ls[col]) for col in ls.columns},
+            'advice': advice_stats(panel, index_close, n),
+        }
+    return report
+
+
+def _jsonable(value):
+    if isinstance(value, pd.DataFrame):
+        frame = value.reset_index()
+        return json.loads(frame.to_json(orient='records', force_ascii=False))
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    return value
+
+
+def save_report(report, output_path):
+    """原子写入 JSON 报告"""
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    tmp = f"{output_path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(_jsonable(report), f, ensure_ascii=False, indent=2)
+    os.replace(tmp, output_path)
+
+
+def print_report(report):
+    def pct(v):
+        return '-' if v is None or v != v else f"{v * 100:+.2f}%"
+
+    for n, r in report.items():
+        print(f"\n📈 未来 {n} 日（K线覆盖率 {r['coverage'] * 100:.0f}%）")
+
+        print("  按评级:")
+        for stance, row in r['stance'].iterrows():
+            print(f"    {stance:<10} n={int(row['n']):<5} 平均 {pct(row['mean_ret'])}  胜率 {row['hit_rate'] * 100:.0f}%"
+                  f"  超额 {pct(row['mean_excess'])}  跑赢同类 {row['beat_rate'] * 100:.0f}%")
+
+        print("  按节奏×评级:")
+        for (advice, stance), row in r['regime_stance'].iterrows():
+            print(f"    {advice:<8}{stance:<10} n={int(row['n']):<5} 平均 {pct(row['mean_ret'])}"
+                  f"  超额 {pct(row['mean_excess'])}")
+
+        for key, s in r['ic'].items():
+            if s['n']:
+                print(f"  IC[{key}]: 均值 {s['mean']:+.3f}  t={s['t'] if s['t'] is None else round(s['t'], 2)}"
+                      f"  正值占比 {s['positive'] * 100:.0f}%  ({s['n']} 个截面)")
+        for key, s in r['long_short'].items():
+            if s['n']:
+                print(f"  多空[{key}]: 均值 {pct(s['mean'])}  t={s['t'] if s['t'] is None else round(s['t'], 2)}"
+                      f"  ({s['n']} 个截面)")
+
+        if not r['advice'].empty:
+            print("  节奏建议（大盘-小盘 未来收益差）:")
+            for advice, row in r['advice'].iterrows():
+                hit = '-' if row['hit_rate'] != row['hit_rate'] else f"{row['hit_rate'] * 100:.0f}%"
+                print(f"    {advice:<8} n={int(row['n']):<4} 平均差 {pct(row['mean_spread'])}  命中率 {hit}")
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description='板块评级与市场节奏回测')
+    ap.add_argument('--archive-dir', default='site/data/archive', help='存档目录')
+    ap.add_argument('--store-dir', default=None, help='数据存储目录（默认与存档目录同级的 store）')
+    ap.add_argument('--horizons', default='1,3,5', help='未来收益天数，逗号分隔')
+    ap.add_argument('--start', default=None, help='起始日期 YYYY-MM-DD')
+    ap.add_argument('--end', default=None, help='结束日期 YYYY-MM-DD')
+    ap.add_argument('--fetch', action='store_true', help='先增量更新面板中板块和节奏指数的K线')
+    ap.add_argument('--kline-days', type=int, default=500, help='首次抓取的K线天数')
+    ap.add_argument('--out', default=None, help='输出 JSON 报告路径')
+    ap.add_argument('--no-panel', action='store_true', help='不使用只读面板，逐个读取存档 JSON')
+    args = ap.parse_args()
+
+    horizons = sorted({int(h) for h in args.horizons.split(',') if h.strip()})
+    store_dir = args.store_dir or Path(args.archive_dir).parent / 'store'
+    store = KlineStore(default_store_root(store_dir))
+
+    shared = None if args.no_panel else open_panel(args.archive_dir, store_dir)
+    if shared is not None:
+        panel = shared.boards(args.start, args.end)
+    else:
+        panel = load_panel(args.archive_dir, args.start, args.end)
+    print(f"📊 面板: {panel['date'].nunique()} 个交易日，{panel['code'].nunique()} 个板块，{len(panel)} 条记录")
+    if panel.empty:
+        return
+
+    board_codes = sorted(panel['code'].unique())
+    if args.fetch:
+        print("\n🌐 更新K线...")
+        n_boards = store.update_boards(board_codes, days=args.kline_days)
+        n_index = store.update_indices(['HS300', 'CSI1000'], days=args.kline_days)
+        print(f"✅ 已更新 {n_boards} 个板块、{n_index} 个指数的K线")
+        if shared is not None:
+            shared = open_panel(args.archive_dir, store_dir)
+
+    if shared is not None:
+        close, index_close = shared.close(board_codes), shared.index_close(['HS300', 'CSI1000'])
+    else:
+        close, index_close = store.panel(board_codes), store.panel(['HS300', 'CSI1000'])
+    if close.empty:
+        print(f"❌ K线存储 {store.root} 中没有面板板块的数据，可使用 --fetch 抓取")
+        return
+
+    report = run_backtest(panel, close, index_close, horizons)
+    print_report(report)
+
+    if args.out:
+        save_report(report, args.out)
+        print(f"\n✅ 回测报告已保存: {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+板块滚动相关性
+在最近 N 个交易日的窗口上维护板块日收益的两两协方差/相关系数：
+- 窗口内按成对有效样本累计 n、Σx、Σx²、Σxy（矩阵形式，缺失值不参与）
+- 新交易日进入窗口时加上该行的外积，最早的一行移出窗口时减去，
+  每天的更新量为 O(N²)，不随窗口长度增长
+- 每追加 REFRESH_EVERY 天由窗口缓冲重新累计一次，消除浮点误差
+- 代码表变化或窗口内的K线被修订（盘中数据被收盘数据覆盖）时由缓冲重建
+
+状态缓存在 store/board_corr.npz
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+
+CORR_WINDOW = 20
+# 计算相关系数所需的最少成对样本数
+MIN_PERIODS = 10
+REFRESH_EVERY = 250
+
+# 轮动簇：相关系数不低于该值的板块连通
+CLUSTER_CORR = 0.8
+
+
+class RollingCorrelation:
+    """N 个代码在最近 window 个交易日上的成对滚动统计"""
+
+    def __init__(self, codes, window=CORR_WINDOW):
+        self.codes = list(codes)
+        self.window = window
+        n = len(self.codes)
+        self.dates = []
+        self.buffer = np.full((0, n), np.nan)  # 窗口内的收益（行=交易日）
+        self.n = np.zeros((n, n))
+        self.sx = np.zeros((n, n))    # sx[i, j] = Σ x_i（i、j 均有效的日期）
+        self.sxx = np.zeros((n, n))
+        self.sxy = np.zeros((n, n))
+        self.since_refresh = 0
+
+    @staticmethod
+    def _parts(rows):
+        rows = np.atleast_2d(rows)
+        m = np.isfinite(rows).astype(float)
+        x = np.where(m > 0, rows, 0.0)
+        return m, x
+
+    def _accumulate(self, rows, sign):
+        m, x = self._parts(rows)
+        self.n += sign * (m.T @ m)
+        self.sx += sign * (x.T @ m)
+        self.sxx += sign * ((x * x).T @ m)
+        self.sxy += sign * (x.T @ x)
+
+    def refresh(self):
+        """由窗口缓冲重新累计"""
+        for arr in (self.n, self.sx, self.sxx, self.sxy):
+            arr[:] = 0
+        if len(self.buffer):
+            self._accumulate(self.buffer, 1)
+        self.since_refresh = 0
+
+    def append(self, date_str, row):
+        """追加一个交易日的收益（长度为代码数，缺失为 NaN），窗口满时移出最早的一天"""
+        row = np.asarray(row, dtype=float)
+        self._accumulate(row, 1)
+        self.buffer = np.vstack([self.buffer, row])
+        self.dates.append(date_str)
+        if len(self.buffer) > self.window:
+            self._accumulate(self.buffer[0], -1)
+            self.buffer = self.buffer[1:]
+            self.dates = self.dates[1:]
+        self.since_refresh += 1
+        if self.since_refresh >= REFRESH_EVERY:
+            self.refresh()
+
+    def covariance(self):
+        """成对样本协方差（样本不足为 NaN）"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = (self.sxy - self.sx * self.sx.T / self.n) / (self.n - 1)
+        return np.where(self.n >= MIN_PERIODS, cov, np.nan)
+
+    def correlation(self):
+        """成对相关系数（样本不足或方差为0为 NaN）"""
+        n = self.n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            num = n * self.sxy - self.sx * self.sx.T
+            var = n * self.sxx - self.sx * self.sx
+            corr = num / np.sqrt(var * var.T)
+        corr = np.clip(corr, -1, 1)
+        return np.where((n >= MIN_PERIODS) & (var > 0) & (var.T > 0), corr, np.nan)
+
+    # ---------- 缓存 ----------
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        with open(tmp, 'wb') as f:
+            np.savez(f, codes=np.array(self.codes, dtype=str), dates=np.array(self.dates, dtype=str),
+                     window=self.window, buffer=self.buffer, n=self.n, sx=self.sx, sxx=self.sxx,
+                     sxy=self.sxy, since_refresh=self.since_refresh)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """加载缓存，不存在或损坏返回 None"""
+        if not path or not Path(path).exists():
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                state = cls(z['codes'].tolist(), int(z['window']))
+                state.dates = z['dates'].tolist()
+                state.buffer, state.n, state.sx = z['buffer'], z['n'], z['sx']
+                state.sxx, state.sxy = z['sxx'], z['sxy']
+                state.since_refresh = int(z['since_refresh'])
+            return state
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  读取相关性缓存失败: {e}")
+            return None
+
+
+def daily_returns(close):
+    """收盘价矩阵 → 日收益（相对上一个有效收盘价，停牌日为 NaN）"""
+    import pandas as pd
+    close = pd.DataFrame(close)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (close / close.ffill().shift() - 1).to_numpy(float)
+
+
+def update_correlation(dates, codes, close, cache_path=None, window=CORR_WINDOW):
+    """
+    用 日期 × 代码 收盘价更新滚动相关性，缓存可用时只追加新的交易日
+
+    返回: RollingCorrelation（窗口为最近 window 个交易日）
+    """
+    rets = daily_returns(close)
+    state = RollingCorrelation.load(cache_path) if cache_path else None
+    pos = {d: i for i, d in enumerate(dates)}
+
+    usable = (state is not None and state.codes == list(codes) and state.window == window
+              and state.dates and all(d in pos for d in state.dates))
+    if usable:
+        rows = [pos[d] for d in state.dates]
+        # 窗口内的数据被修订时不能增量更新
+        usable = np.array_equal(rets[rows], state.buffer, equal_nan=True)
+
+    if usable:
+        start = pos[state.dates[-1]] + 1
+        for t in range(start, len(dates)):
+            state.append(dates[t], rets[t])
+        print(f"🔗 板块相关性: 增量追加 {len(dates) - start} 个交易日，{len(codes)} 个板块，窗口 {window} 天")
+    else:
+        state = RollingCorrelation(codes, window)
+        state.dates = list(dates[-window:])
+        state.buffer = rets[-window:] if len(rets) else np.full((0, len(codes)), np.nan)
+        state.refresh()
+        print(f"🔗 板块相关性: 由最近 {len(state.dates)} 个交易日重建，{len(codes)} 个板块")
+
+    if cache_path:
+        state.save(cache_path)
+    return state
+
+
+def top_pairs(corr, codes, k=20, subset=None):
+    """
+    相关系数最高的 k 对板块（每对一次）
+
+    参数:
+        subset: 只在这些代码之间挑选（默认全部）
+    返回: [(code_a, code_b, corr), ...]
+    """
+    ids = np.arange(len(codes)) if subset is None else \
+        np.array([i for i, c in enumerate(codes) if c in subset], dtype=int)
+    if len(ids) < 2:
+        return []
+    sub = corr[np.ix_(ids, ids)]
+    i, j = np.triu_indices(len(ids), k=1)
+    values = sub[i, j]
+    ok = np.isfinite(values)
+    i, j, values = i[ok], j[ok], values[ok]
+    order = np.argsort(-values, kind='stable')[:k]
+    return [(codes[ids[i[o]]], codes[ids[j[o]]], float(values[o])) for o in order]
+
+
+def clusters(corr, codes, threshold=CLUSTER_CORR, subset=None):
+    """
+    轮动簇：相关系数 ≥ 阈值的板块连通（同涨同跌的一组板块）
+
+    返回: [[code, ...], ...]，只包含2个及以上板块的簇，按簇大小降序
+    """
+    ids = np.arange(len(codes)) if subset is None else \
+        np.array([i for i, c in enumerate(codes) if c in subset], dtype=int)
+    parent = list(range(len(ids)))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    sub = corr[np.ix_(ids, ids)]
+    i, j = np.nonzero(np.triu(np.nan_to_num(sub, nan=-1) >= threshold, k=1))
+    for a, b in zip(i.tolist(), j.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[rb] = ra
+
+    groups = {}
+    for k in range(len(ids)):
+        groups.setdefault(find(k), []).append(codes[ids[k]])
+    return sorted((g for g in groups.values() if len(g) > 1), key=len, reverse=True)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+板块×个股稀疏成员矩阵（CSR）
+由板块成分缓存构建，提供：
+- 所有板块两两之间的 Jaccard 重合度（按个股共现计数，不展开稠密矩阵）
+- 近似重复板块聚类（概念板块大量重叠，同一批龙头反复出现）
+- 全成分的板块聚合指标（广度、成交额加权涨幅），以稀疏矩阵×向量计算
+
+只依赖 NumPy：行偏移 indptr + 列下标 indices 即 CSR 的布尔矩阵
+"""
+import numpy as np
+import pandas as pd
+
+# 判定为近似重复板块的 Jaccard 阈值
+DUPLICATE_JACCARD = 0.6
+
+
+class BoardMatrix:
+    """板块×个股布尔 CSR 矩阵"""
+
+    def __init__(self, boards, stocks, indptr, indices):
+        self.boards = list(boards)          # 行：板块代码
+        self.stocks = list(stocks)          # 列：个股代码
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.board_pos = {code: i for i, code in enumerate(self.boards)}
+        self.stock_pos = pd.Index(self.stocks)
+
+    @classmethod
+    def from_frame(cls, members):
+        """由 (bk_code, ts_code) 关系表构建"""
+        members = members[['bk_code', 'ts_code']].drop_duplicates()
+        board_codes, rows = np.unique(members['bk_code'].to_numpy(), return_inverse=True)
+        stock_codes, cols = np.unique(members['ts_code'].to_numpy(), return_inverse=True)
+
+        order = np.lexsort((cols, rows))
+        rows, cols = rows[order], cols[order]
+        indptr = np.zeros(len(board_codes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(board_codes)), out=indptr[1:])
+        return cls(board_codes, stock_codes, indptr, cols)
+
+    @classmethod
+    def from_membership(cls, table, board_codes=None):
+        """由板块成分缓存（membership.py）构建"""
+        from membership import membership_frame
+        return cls.from_frame(membership_frame(table, board_codes))
+
+    @property
+    def shape(self):
+        return len(self.boards), len(self.stocks)
+
+    @property
+    def sizes(self):
+        """每个板块的成分股数量"""
+        return np.diff(self.indptr)
+
+    @property
+    def row_ids(self):
+        """每个非零元素所在的行"""
+        return np.repeat(np.arange(len(self.boards)), self.sizes)
+
+    def align(self, values, fill=np.nan):
+        """把按个股代码索引的 Series 对齐为列向量"""
+        return values.reindex(self.stock_pos).to_numpy(dtype=float, na_value=fill)
+
+    def matvec(self, x):
+        """y = A·x，x 为长度等于个股数的向量"""
+        return np.bincount(self.row_ids, weights=np.asarray(x, dtype=float)[self.indices],
+                           minlength=len(self.boards))
+
+    def intersections(self):
+        """
+        板块两两共有成分股数量 A·Aᵀ（nb×nb）
+        按个股分组枚举共现的板块对，计算量为 Σ(每只个股所属板块数)²
+        """
+        nb, ns = self.shape
+        counts = np.bincount(self.indices, minlength=ns)
+        starts = np.cumsum(counts) - counts
+
+        # 按个股排序（CSC 视图）
+        order = np.argsort(self.indices, kind='stable')
+        entry_board = self.row_ids[order]
+        entry_stock = self.indices[order]
+
+        deg = counts[entry_stock]
+        total = int(deg.sum())
+        if total == 0:
+            return np.zeros((nb, nb), dtype=np.int64)
+
+        left = np.repeat(entry_board, deg)
+        within = np.arange(total) - np.repeat(np.cumsum(deg) - deg, deg)
+        right = entry_board[np.repeat(starts[entry_stock], deg) + within]
+        return np.bincount(left * nb + right, minlength=nb * nb).reshape(nb, nb)
+
+    def jaccard(self):
+        """板块两两 Jaccard 重合度矩阵"""
+        inter = self.intersections().astype(float)
+        sizes = self.sizes.astype(float)
+        union = sizes[:, None] + sizes[None, :] - inter
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(union > 0, inter / union, 0.0)
+
+    def overlap_pairs(self, threshold=0.0, jac=None):
+        """
+        重合度不低于阈值的板块对（每对只出现一次）
+
+        返回: DataFrame(board_a, board_b, shared, jaccard)，按 jaccard 降序
+        """
+        jac = self.jaccard() if jac is None else jac
+        inter = self.intersections()
+        i, j = np.triu_indices(len(self.boards), k=1)
+        mask = (jac[i, j] >= threshold) & (inter[i, j] > 0)
+        i, j = i[mask], j[mask]
+        pairs = pd.DataFrame({
+            'board_a': np.asarray(self.boards, dtype=object)[i],
+            'board_b': np.asarray(self.boards, dtype=object)[j],
+            'shared': inter[i, j],
+            'jaccard': jac[i, j],
+        })
+        return pairs.sort_values('jaccard', ascending=False).reset_index(drop=True)
+
+    def clusters(self, threshold=DUPLICATE_JACCARD, jac=None):
+        """
+        近似重复板块聚类（Jaccard ≥ 阈值的板块连通）
+
+        返回: [[板块代码, ...], ...]，只包含2个及以上板块的簇，按簇大小降序
+        """
+        jac = self.jaccard() if jac is None else jac
+        parent = list(range(len(self.boards)))
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        i, j = np.nonzero(np.triu(jac >= threshold, k=1))
+        for a, b in zip(i.tolist(), j.tolist()):
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[rb] = ra
+
+        groups = {}
+        for k in range(len(self.boards)):
+            groups.setdefault(find(k), []).append(self.boards[k])
+        return sorted((g for g in groups.values() if len(g) > 1), key=len, reverse=True)
+
+    def aggregates(self, quotes):
+        """
+        全成分板块聚合指标
+
+        参数:
+            quotes: 全市场行情，需包含 ts_code, close, prev_close, turnover
+        返回:
+            DataFrame(bk_code, members, covered, breadth, tw_ret)
+            covered=有行情的成分股数, breadth=上涨占比, tw_ret=成交额加权涨幅
+        """
+        q = quotes.drop_duplicates('ts_code').set_index('ts_code')
+        ret = self.align(q['close'] / q['prev_close'] - 1)
+        turnover = self.align(q['turnover'].astype(float))
+
+        valid = np.isfinite(ret)
+        ret0 = np.where(valid, ret, 0.0)
+        turnover0 = np.where(valid & np.isfinite(turnover), turnover, 0.0)
+
+        covered = self.matvec(valid)
+        up = self.matvec(valid & (ret0 > 0))
+        weight = self.matvec(turnover0)
+        weighted = self.matvec(turnover0 * ret0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return pd.DataFrame({
+                'bk_code': self.boards,
+                'members': self.sizes,
+                'covered': covered.astype(int),
+                'breadth': np.where(covered > 0, up / covered, np.nan),
+                'tw_ret': np.where(weight > 0, weighted / weight, np.nan),
+            })
+
+
+def collapse_redundant(boards_df, matrix, threshold=DUPLICATE_JACCARD):
+    """
+    合并近似重复的板块：同一簇中只保留排名最靠前的板块
+
+    参数:
+        boards_df: 板块表（已按展示顺序排列），需包含 bk_code, bk_name
+    返回:
+        (保留的板块表, {被合并板块: 保留板块})
+    """
+    order = {code: i for i, code in enumerate(boards_df['bk_code'])}
+    dropped = {}
+    for cluster in matrix.clusters(threshold):
+        ranked = sorted((c for c in cluster if c in order), key=order.get)
+        for code in ranked[1:]:
+            dropped[code] = ranked[0]
+
+    if dropped:
+        names = dict(zip(boards_df['bk_code'], boards_df['bk_name']))
+        print(f"  [板块去重] 合并 {len(dropped)} 个近似重复板块（Jaccard ≥ {threshold}）:")
+        for code, keep in dropped.items():
+            print(f"    {names.get(code, code)} → {names.get(keep, keep)}")
+
+    return boards_df[~boards_df['bk_code'].isin(dropped)].reset_index(drop=True), dropped
+
+
+def main():
+    import argparse
+    from membership import load_membership
+
+    ap = argparse.ArgumentParser(description='板块成分重合度分析')
+    ap.add_argument('--membership', default='site/data/store/board_members.json', help='板块成分缓存文件')
+    ap.add_argument('--threshold', type=float, default=DUPLICATE_JACCARD, help='近似重复的 Jaccard 阈值')
+    ap.add_argument('--top', type=int, default=20, help='显示重合度最高的N对板块')
+    args = ap.parse_args()
+
+    matrix = BoardMatrix.from_membership(load_membership(args.membership))
+    nb, ns = matrix.shape
+    print(f"📊 成员矩阵: {nb} 个板块 × {ns} 只个股，{len(matrix.indices)} 个非零元素")
+    if nb == 0:
+        return
+
+    jac = matrix.jaccard()
+    print(f"\n🔗 重合度最高的 {args.top} 对板块:")
+    for _, row in matrix.overlap_pairs(jac=jac).head(args.top).iterrows():
+        print(f"  {row['board_a']} ~ {row['board_b']}: 共有 {row['shared']} 只, Jaccard {row['jaccard']:.2f}")
+
+    clusters = matrix.clusters(args.threshold, jac=jac)
+    print(f"\n🧩 近似重复板块簇（Jaccard ≥ {args.threshold}）: {len(clusters)} 个")
+    for cluster in clusters:
+        print(f"  {', '.join(cluster)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+图表序列降采样
+历史变长后不再把每一根日K线都发给浏览器，按距今远近分级：
+- 最近 FULL_RES_DAYS 个交易日保留日线
+- 之前 WEEKLY_DAYS 个交易日聚合为周线
+- 更早的聚合为月线；月线超过 MAX_MONTHLY_BARS 根时每N个月合并一根
+  （开=首个有效开盘，收=最后有效收盘，高/低=区间极值，量=区间合计）
+折线序列（如市场节奏）最近部分保留原始点，更早部分用 LTTB 选点
+
+聚合对所有代码、所有字段一次分组完成，输出长度与历史长度无关
+"""
+import numpy as np
+import pandas as pd
+
+FULL_RES_DAYS = 120
+WEEKLY_DAYS = 500
+MAX_MONTHLY_BARS = 120
+
+# 折线序列：保留原始点的天数和总点数上限
+LINE_FULL_DAYS = 250
+LINE_MAX_POINTS = 500
+
+
+def lod_groups(dates, full_days=FULL_RES_DAYS, weekly_days=WEEKLY_DAYS, max_monthly=MAX_MONTHLY_BARS):
+    """
+    为每个交易日分配聚合组
+
+    返回:
+        (group, periods): group 为每个日期所属组的编号（递增）；periods 为每组的粒度 'M'/'W'/'D'
+    """
+    d = pd.to_datetime(pd.Series(dates))
+    n = len(d)
+    tier = np.full(n, 'M', dtype='<U1')
+    tier[max(0, n - full_days - weekly_days):] = 'W'
+    tier[max(0, n - full_days):] = 'D'
+
+    month = (d.dt.year * 12 + d.dt.month).to_numpy(copy=True)
+    monthly = tier == 'M'
+    if monthly.any():
+        months = month[monthly] - month[monthly][0]
+        step = -(-(months[-1] + 1) // max_monthly)  # 每组合并的月数（向上取整）
+        month[monthly] = month[monthly][0] + months // step * step
+    week = (d - pd.to_timedelta(d.dt.weekday, unit='D')).dt.strftime('%Y%m%d').astype(int).to_numpy()
+
+    key = np.where(tier == 'M', month, np.where(tier == 'W', week, np.arange(n)))
+    # 组边界：粒度或组键变化处
+    change = np.ones(n, dtype=bool)
+    change[1:] = (key[1:] != key[:-1]) | (tier[1:] != tier[:-1])
+    group = np.cumsum(change) - 1
+    return group, tier[change].tolist()
+
+
+def resample_ohlc(dates, bars, group):
+    """
+    按组聚合 日期 × 代码 的 OHLCV 矩阵（所有代码一次分组）
+
+    参数:
+        bars: {'open','high','low','close','volume': ndarray(日期, 代码)}，可含 NaN
+    返回:
+        (组内最后一个交易日列表, {field: ndarray(组, 代码)})
+    """
+    frames = {field: pd.DataFrame(values) for field, values in bars.items()}
+    out = {
+        'open': frames['open'].groupby(group).first(),
+        'high': frames['high'].groupby(group).max(),
+        'low': frames['low'].groupby(group).min(),
+        'close': frames['close'].groupby(group).last(),
+    }
+    if 'volume' in frames:
+        out['volume'] = frames['volume'].groupby(group).sum(min_count=1)
+    # 组中 close 全缺失的代码整根K线缺失
+    valid = out['close'].notna()
+    out = {field: df.where(valid).to_numpy(float) for field, df in out.items()}
+    last = pd.Series(np.arange(len(dates))).groupby(group).last().to_numpy()
+    return [dates[i] for i in last], out
+
+
+def lttb(y, n_out):
+    """
+    Largest-Triangle-Three-Buckets 选点，返回保留点的下标（含首尾）
+
+    NaN 按相邻有效值参与面积计算
+    """
+    y = pd.Series(np.asarray(y, dtype=float)).ffill().bfill().fillna(0).to_numpy()
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            cx, cy = x[hi:edges[i + 2]].mean(), y[hi:edges[i + 2]].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def lod_line_indices(values, full_days=LINE_FULL_DAYS, max_points=LINE_MAX_POINTS):
+    """折线序列的保留下标：最近 full_days 个点全部保留，更早部分 LTTB 选点"""
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+    split = max(0, n - full_days)
+    budget = max(3, max_points - (n - split))
+    # 旧段与第一个保留的近期点一起选点，保证衔接处连续
+    old = lttb(np.asarray(values, dtype=float)[:split + 1], budget + 1)[:-1]
+    return np.concatenate([old, np.arange(split, n)])
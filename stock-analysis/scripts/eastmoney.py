@@ -5,9 +5,17 @@
 """
 import requests
 import pandas as pd
-from datetime import date, datetime
+from datetime import datetime, timedelta, timezone
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
+from host_pool import get_json
+from index_registry import INDEX_REGISTRY, INDEX_BY_CODE, INDEX_BY_EM_CODE, index_codes
+
+
+def beijing_today():
+    """行情日期：北京时间的当天（与运行机器的时区无关）"""
+    return datetime.now(timezone(timedelta(hours=8))).date().isoformat()
 
 # 配置
 HEADERS = {
@@ -15,6 +23,16 @@ HEADERS = {
     'Referer': 'https://data.eastmoney.com/'
 }
 
+
+def _em_valid(data):
+    """东方财富接口返回是否有效（对冲请求据此判断是否采用该主机的结果）"""
+    return isinstance(data, dict) and data.get('rc') == 0 and data.get('data') is not None
+
+
+# 成分股请求失败的板块在同一次运行中后台重试的轮数和间隔（秒，逐轮递增）
+RETRY_ROUNDS = 2
+RETRY_DELAY = 2.0
+
 def is_valid_concept_board(board_name):
     """
     判断是否是有效的概念板块（过滤掉选股条件类的伪概念）
@@ -46,16 +64,15 @@ def is_valid_concept_board(board_name):
     return True
 
 
-def fetch_board_data(board_type='industry'):
+def fetch_board_data(board_type='industry', timeout=10):
     """
     获取板块涨跌幅排行数据
     API: 东方财富板块排行接口
 
     参数:
         board_type: 'industry' 行业板块, 'concept' 概念板块
+        timeout: 请求超时（秒）
     """
-    url = "https://push2.eastmoney.com/api/qt/clist/get"
-
     # t:2=行业板块, t:3=概念板块
     fs_type = 'm:90+t:2' if board_type == 'industry' else 'm:90+t:3'
 
@@ -76,10 +93,7 @@ def fetch_board_data(board_type='industry'):
     try:
         board_name = "行业板块" if board_type == 'industry' else "概念板块"
         print(f"  [{board_name}] 请求东方财富数据...")
-        response = requests.get(url, params=params, headers=HEADERS, timeout=10)
-        response.raise_for_status()
-
-        data = response.json()
+        data = get_json("quote", "/api/qt/clist/get", params, HEADERS, timeout=timeout, validate=_em_valid)
         if data.get('rc') != 0 or 'data' not in data:
             print(f"  [{board_name}] ⚠️  API返回异常: {data}")
             return None
@@ -89,7 +103,7 @@ def fetch_board_data(board_type='industry'):
 
         # 转换为 DataFrame
         records = []
-        today = date.today().isoformat()
+        today = beijing_today()
         filtered_count = 0
 
         for item in boards:
@@ -131,12 +145,34 @@ def fetch_board_data(board_type='industry'):
         return None
 
 
-def fetch_board_stocks(board_code, top_n=10):
+def _parse_stock_item(item):
+    """解析 clist 接口返回的个股行情（不含日期和板块）"""
+    pct = item.get('f3', 0) / 100.0
+    price = item.get('f2', 0)
+
+    # 计算前收盘价，避免除以零
+    if price > 0 and pct > -0.99:  # 避免除以接近0的数
+        prev_close = price / (1 + pct)
+    else:
+        prev_close = price
+
+    return {
+        'ts_code': item.get('f12', ''),
+        'name': item.get('f14', ''),
+        'close': price,
+        'prev_close': prev_close,
+        'turnover': item.get('f6', 0),
+        'turnover_ratio': item.get('f8', 0),
+        'amplitude': item.get('f7', 0),
+    }
+
+
+def fetch_board_stocks(board_code, top_n=10, timeout=10):
     """
     获取指定板块的成分股数据
-    """
-    url = "https://push2.eastmoney.com/api/qt/clist/get"
 
+    返回: 个股记录列表，请求失败返回 None（与板块确实没有成分股的空列表区分）
+    """
     params = {
         'fid': 'f3',
         'po': '1',
@@ -152,140 +188,284 @@ def fetch_board_stocks(board_code, top_n=10):
     }
 
     try:
-        response = requests.get(url, params=params, headers=HEADERS, timeout=10)
-        response.raise_for_status()
-
-        data = response.json()
+        data = get_json("quote", "/api/qt/clist/get", params, HEADERS, timeout=timeout, validate=_em_valid)
         if data.get('rc') != 0 or 'data' not in data:
-            return []
+            print(f"  [个股] ⚠️  板块 {board_code} 成分股接口返回异常")
+            return None
 
-        stocks = data['data'].get('diff', [])
+        stocks = (data['data'] or {}).get('diff', [])
 
         records = []
-        today = date.today().isoformat()
+        today = beijing_today()
 
         for item in stocks:
-            pct = item.get('f3', 0) / 100.0
-            price = item.get('f2', 0)
+            records.append({'date': today, 'bk_code': board_code, **_parse_stock_item(item)})
 
-            # 计算前收盘价，避免除以零
-            if price > 0 and pct > -0.99:  # 避免除以接近0的数
-                prev_close = price / (1 + pct)
+        return records
+
+    except Exception as e:
+        print(f"  [个股] ⚠️  获取板块 {board_code} 成分股失败: {e}")
+        return None
+
+
+def retry_board_stocks(board_codes, top_n=10, rounds=RETRY_ROUNDS, delay=RETRY_DELAY, budget=None):
+    """
+    重试成分股请求失败的板块（在后台线程中与后续请求并行）
+
+    参数:
+        budget: FetchBudget，预算用完时停止重试
+    返回: {板块代码: 个股记录列表}，只包含重试成功的板块
+    """
+    from fetch_scheduler import FetchBudget
+    budget = budget or FetchBudget()
+    recovered = {}
+    pending = list(board_codes)
+    for attempt in range(1, rounds + 1):
+        if not pending or budget.remaining() < delay * attempt:
+            break
+        time.sleep(delay * attempt)
+        still_failed = []
+        for bk_code in pending:
+            if budget.expired():
+                still_failed.append(bk_code)
+                continue
+            stocks = fetch_board_stocks(bk_code, top_n=top_n, timeout=budget.timeout())
+            if stocks is None:
+                still_failed.append(bk_code)
             else:
-                prev_close = price
+                recovered[bk_code] = stocks
+            time.sleep(0.3)
+        pending = still_failed
+    return recovered
 
-            records.append({
-                'date': today,
-                'bk_code': board_code,
-                'ts_code': item.get('f12', ''),
-                'name': item.get('f14', ''),
-                'close': price,
-                'prev_close': prev_close,
-                'turnover': item.get('f6', 0),
-                'turnover_ratio': item.get('f8', 0),
-                'amplitude': item.get('f7', 0),
-            })
 
-        return records
+def _fetch_clist_pages(params, page_size, max_pages=100):
+    """
+    分页请求 clist 接口，返回全部 diff 记录
+    按接口返回的 total 判断是否还有下一页（服务端可能限制单页数量）
+    """
+    items = []
+
+    for page in range(1, max_pages + 1):
+        query = dict(params, pn=str(page), pz=str(page_size), np='1')
+        data = get_json("quote", "/api/qt/clist/get", query, HEADERS, timeout=10, validate=_em_valid)
+        if data.get('rc') != 0 or not data.get('data'):
+            break
+
+        diff = data['data'].get('diff') or []
+        if isinstance(diff, dict):
+            diff = list(diff.values())
+        items.extend(diff)
+
+        total = data['data'].get('total', 0)
+        if not diff or len(items) >= total:
+            break
 
+        time.sleep(0.2)
+
+    return items
+
+
+def fetch_board_members(board_code, page_size=500):
+    """
+    获取板块全部成分股代码（用于板块成分缓存）
+
+    返回: 个股代码列表，请求失败返回 None
+    """
+    params = {
+        'fid': 'f12',
+        'po': '0',
+        'fltt': '2',
+        'invt': '2',
+        'fs': f'b:{board_code}',
+        'fields': 'f12',
+    }
+
+    try:
+        items = _fetch_clist_pages(params, page_size)
+        return [item.get('f12', '') for item in items if item.get('f12')]
     except Exception as e:
-        print(f"  [个股] ⚠️  获取板块 {board_code} 成分股失败: {e}")
-        return []
+        print(f"  [成分股] ⚠️  获取板块 {board_code} 成分失败: {e}")
+        return None
+
+
+# 全部A股：深主板、创业板、沪主板、科创板、北交所
+A_SHARE_FS = 'm:0+t:6,m:0+t:80,m:1+t:2,m:1+t:23,m:0+t:81+s:2048'
+
+
+def fetch_market_quotes(page_size=5000):
+    """
+    分页获取全部A股实时行情（一个快照通常只需数个请求）
+
+    返回:
+        DataFrame with columns: ts_code, name, close, prev_close, turnover, turnover_ratio, amplitude
+        请求失败返回 None
+    """
+    params = {
+        'fid': 'f3',
+        'po': '1',
+        'fltt': '2',
+        'invt': '2',
+        'fs': A_SHARE_FS,
+        'fields': 'f12,f14,f2,f3,f6,f7,f8',
+    }
+
+    try:
+        print(f"  [全市场] 请求全部A股行情...")
+        items = _fetch_clist_pages(params, page_size)
+        records = [_parse_stock_item(item) for item in items
+                   if isinstance(item.get('f2'), (int, float)) and isinstance(item.get('f3'), (int, float))]
+        df = pd.DataFrame(records)
+        print(f"  [全市场] ✅ 成功获取 {len(df)} 只个股行情")
+        return df.drop_duplicates('ts_code') if not df.empty else None
+    except Exception as e:
+        print(f"  [全市场] ❌ 请求失败: {e}")
+        return None
 
 
-def fetch_index_data():
+def load_stocks_from_market(boards_df, stocks_per_board, membership_path, defer_membership=False):
     """
-    获取主要指数数据（中证100/沪深300/中证500/中证1000/中证2000）
-    移除上证50，保留上证指数用于对比
+    快照模式：全市场行情一次拉取，在本地与板块成分缓存关联
+
+    参数:
+        defer_membership: 只请求没有成分缓存的板块，已过期的成分继续使用并交给回填队列刷新（见 backfill_queue.py）
+
+    返回:
+        (stocks_df, boards_df)，失败返回 None
+        stocks_df: 每板块涨幅前N只个股
+        boards_df: 附加全成分广度(breadth_full)和成交额加权涨幅(tw_ret)，
+                   并合并近似重复的概念板块
     """
-    url = "https://push2.eastmoney.com/api/qt/ulist.np/get"
+    from membership import load_membership, refresh_membership, save_membership, membership_frame
+    from board_matrix import BoardMatrix, collapse_redundant
+
+    board_codes = boards_df['bk_code'].tolist()
+    table = load_membership(membership_path)
+    refresh_codes = board_codes
+    if defer_membership:
+        refresh_codes = [code for code in board_codes if code not in table.get('boards', {})]
+    refreshed = refresh_membership(table, refresh_codes, fetch_board_members)
+    if refreshed:
+        save_membership(table, membership_path)
+    print(f"  [成分股] 成分缓存: {len(board_codes)} 个板块，本次刷新 {refreshed} 个")
+
+    quotes = fetch_market_quotes()
+    if quotes is None:
+        return None
 
-    # secids 格式: 市场代码.指数代码
-    # 1.000903=中证100, 1.000300=沪深300
-    # 1.000905=中证500, 1.000852=中证1000
-    # 2.932000=中证2000 (注意：中证2000使用市场代码2)
-    # 1.000001=上证指数（用于对比）
+    members = membership_frame(table, board_codes)
+
+    # 全成分板块聚合（稀疏矩阵×向量）
+    stats = BoardMatrix.from_frame(members).aggregates(quotes)
+    boards_df = boards_df.merge(
+        stats[['bk_code', 'breadth', 'tw_ret']].rename(columns={'breadth': 'breadth_full'}),
+        on='bk_code', how='left')
+
+    # 概念板块重叠严重，合并近似重复的板块
+    if 'bk_type' in boards_df.columns:
+        is_concept = boards_df['bk_type'] == 'concept'
+        concept_df = boards_df[is_concept]
+        concept_matrix = BoardMatrix.from_frame(members[members['bk_code'].isin(concept_df['bk_code'])])
+        concept_df, dropped = collapse_redundant(concept_df, concept_matrix)
+        boards_df = pd.concat([boards_df[~is_concept], concept_df], ignore_index=True)
+        members = members[~members['bk_code'].isin(dropped)]
+
+    stocks_df = members.merge(quotes, on='ts_code', how='inner')
+    stocks_df['pct'] = stocks_df['close'] / stocks_df['prev_close'] - 1
+    stocks_df = (stocks_df.sort_values('pct', ascending=False, kind='mergesort')
+                          .groupby('bk_code', sort=False)
+                          .head(stocks_per_board)
+                          .drop(columns='pct')
+                          .reset_index(drop=True))
+    stocks_df.insert(0, 'date', beijing_today())
+    return stocks_df, boards_df
+
+
+def _to_float(value, default=0.0):
+    """行情字段转浮点数（停牌/缺失时接口返回 '-'）"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def fetch_index_quotes(timeout=10):
+    """
+    一次请求获取注册表中所有指数的实时行情，再在本地拆分为两组输出
+
+    返回:
+        (indices_df, market_indices_df)
+        indices_df: 市场节奏判断用指数（中证100/沪深300/中证500/中证1000/中证2000/上证指数）
+        market_indices_df: 大盘核心指数（上证指数/深证成指/创业板指/科创50/北证50）
+        请求失败时返回 (None, None)
+    """
     params = {
-        'secids': '1.000903,1.000300,1.000905,1.000852,2.932000,1.000001',
+        'secids': ','.join(entry['secid'] for entry in INDEX_REGISTRY),
+        'fltt': '2',        # 返回实际数值（不再需要按100缩放）
+        'invt': '2',
         'fields': 'f12,f14,f2,f3,f4,f5,f6,f15,f16,f17'
-        # f2=最新价, f3=涨跌幅, f4=涨跌额, f5=成交量, f6=成交额
+        # f2=最新价, f3=涨跌幅(%), f4=涨跌额, f5=成交量, f6=成交额
         # f15=最高, f16=最低, f17=开盘
     }
 
     try:
-        print(f"  [指数] 请求东方财富指数数据...")
-        response = requests.get(url, params=params, headers=HEADERS, timeout=10)
-        response.raise_for_status()
-
-        data = response.json()
-        if data.get('rc') != 0 or 'data' not in data:
+        print(f"  [指数] 请求东方财富指数行情（{len(INDEX_REGISTRY)} 个）...")
+        data = get_json("quote", "/api/qt/ulist.np/get", params, HEADERS, timeout=timeout, validate=_em_valid)
+        if data.get('rc') != 0 or not data.get('data'):
             print(f"  [指数] ⚠️  API返回异常")
-            return None
+            return None, None
 
-        indices = data['data']['diff']
-        print(f"  [指数] ✅ 成功获取 {len(indices)} 个指数数据")
-
-        # 映射：东方财富代码 -> 我们的代码（移除上证50）
-        code_map = {
-            '000903': 'CSI100',      # 中证100
-            '000300': 'HS300',       # 沪深300
-            '000905': 'CSI500',      # 中证500
-            '000852': 'CSI1000',     # 中证1000
-            '932000': 'CSI2000',     # 中证2000
-            '000001': 'SHCOMP'       # 上证指数
-        }
-
-        # 指数中文名称
-        name_map = {
-            'CSI100': '中证100',
-            'HS300': '沪深300',
-            'CSI500': '中证500',
-            'CSI1000': '中证1000',
-            'CSI2000': '中证2000',
-            'SHCOMP': '上证指数'
-        }
+        items = data['data']['diff']
+        print(f"  [指数] ✅ 成功获取 {len(items)} 个指数数据")
 
         records = []
-        today = date.today().isoformat()
-
-        for item in indices:
-            code = item.get('f12', '')
-            if code in code_map:
-                index_code = code_map[code]
-                pct = item.get('f3', 0) / 100.0  # 涨跌幅转小数
-                price = item.get('f2', 0)
-
-                # 获取OHLC数据
-                open_price = item.get('f17', 0) if item.get('f17') else price
-                high = item.get('f15', 0) if item.get('f15') else price
-                low = item.get('f16', 0) if item.get('f16') else price
-
-                # 计算前收盘价，避免除以零
-                if price > 0 and pct > -0.99:  # 避免除以接近0的数
-                    prev_close = price / (1 + pct)
-                else:
-                    prev_close = price
-
-                records.append({
-                    'date': today,
-                    'index_code': index_code,
-                    'index_name': name_map.get(index_code, ''),
-                    'open': open_price,
-                    'high': high,
-                    'low': low,
-                    'close': price,
-                    'prev_close': prev_close,
-                    'ret': pct,
-                    'volume': item.get('f5', 0),      # 成交量
-                    'turnover': item.get('f6', 0),    # 成交额
-                })
+        today = beijing_today()
+
+        for item in items:
+            entry = INDEX_BY_EM_CODE.get(str(item.get('f12', '')))
+            if entry is None:
+                continue
+
+            pct = _to_float(item.get('f3')) / 100.0  # 涨跌幅转小数
+            price = _to_float(item.get('f2'))
+
+            # 获取OHLC数据（缺失时用最新价代替）
+            open_price = _to_float(item.get('f17')) or price
+            high = _to_float(item.get('f15')) or price
+            low = _to_float(item.get('f16')) or price
+
+            # 计算前收盘价，避免除以零
+            if price > 0 and pct > -0.99:  # 避免除以接近0的数
+                prev_close = price / (1 + pct)
+            else:
+                prev_close = price
+
+            records.append({
+                'date': today,
+                'index_code': entry['code'],
+                'index_name': entry['name'],
+                'open': open_price,
+                'high': high,
+                'low': low,
+                'close': price,
+                'prev_close': prev_close,
+                'ret': pct,
+                'volume': _to_float(item.get('f5')),      # 成交量
+                'turnover': _to_float(item.get('f6')),    # 成交额
+            })
 
         df = pd.DataFrame(records)
-        return df
+        if df.empty:
+            return df, df
+
+        # 本地拆分为两组输出（同一指数可同时属于两组，如上证指数）
+        indices_df = df[df['index_code'].isin(index_codes('indices'))].reset_index(drop=True)
+        market_indices_df = df[df['index_code'].isin(index_codes('market'))].reset_index(drop=True)
+        return indices_df, market_indices_df
 
     except Exception as e:
         print(f"  [指数] ❌ 请求失败: {e}")
-        return None
+        return None, None
 
 
 def fetch_index_kline(index_code, days=30):
@@ -293,34 +473,17 @@ def fetch_index_kline(index_code, days=30):
     获取指数的历史K线数据（日线）
 
     参数:
-        index_code: 指数代码，如 'HS300', 'CSI500', 'CSI1000', 'CSI2000'
-                    或大盘指数 'SHCOMP', 'SZCOMP', 'CYBZ', 'KCB50', 'BJ50'
+        index_code: 指数注册表中的代码，如 'HS300', 'CSI500', 'SHCOMP', 'CYBZ'
         days: 获取最近N天的数据，默认30天
 
     返回:
         DataFrame with columns: date, open, high, low, close, volume, ret
     """
-    # 映射：我们的代码 -> 东方财富secid
-    secid_map = {
-        # 主要指数
-        'HS300': '1.000300',      # 沪深300
-        'CSI500': '1.000905',     # 中证500
-        'CSI1000': '1.000852',    # 中证1000
-        'CSI2000': '2.932000',    # 中证2000 (市场代码2)
-        'SHCOMP': '1.000001',     # 上证指数
-        # 大盘核心指数
-        'SZCOMP': '0.399001',     # 深证成指
-        'CYBZ': '0.399006',       # 创业板指
-        'KCB50': '1.000688',      # 科创50
-        'BJ50': '0.899050'        # 北证50
-    }
-
-    if index_code not in secid_map:
+    if index_code not in INDEX_BY_CODE:
         print(f"  [K线] ⚠️  不支持的指数代码: {index_code}")
         return None
 
-    secid = secid_map[index_code]
-    url = "https://push2his.eastmoney.com/api/qt/stock/kline/get"
+    secid = INDEX_BY_CODE[index_code]['secid']
 
     params = {
         'secid': secid,
@@ -337,10 +500,7 @@ def fetch_index_kline(index_code, days=30):
 
     try:
         print(f"  [K线] 请求 {index_code} 最近{days}天数据...")
-        response = requests.get(url, params=params, headers=HEADERS, timeout=10)
-        response.raise_for_status()
-
-        data = response.json()
+        data = get_json("kline", "/api/qt/stock/kline/get", params, HEADERS, timeout=10, validate=_em_valid)
         if data.get('rc') != 0 or 'data' not in data:
             print(f"  [K线] ⚠️  API返回异常: {data}")
             return None
@@ -403,7 +563,6 @@ def fetch_board_kline(board_code, board_type='industry', days=30):
     # 板块K线API
     # 板块代码格式：90.BK1031（行业板块）或 90.BK0XXX（概念板块）
     secid = f"90.{board_code}"
-    url = "https://push2his.eastmoney.com/api/qt/stock/kline/get"
 
     params = {
         'secid': secid,
@@ -420,10 +579,7 @@ def fetch_board_kline(board_code, board_type='industry', days=30):
 
     try:
         print(f"  [板块K线] 请求 {board_code} 最近{days}天数据...")
-        response = requests.get(url, params=params, headers=HEADERS, timeout=10)
-        response.raise_for_status()
-
-        data = response.json()
+        data = get_json("kline", "/api/qt/stock/kline/get", params, HEADERS, timeout=10, validate=_em_valid)
         if data.get('rc') != 0 or 'data' not in data:
             print(f"  [板块K线] ⚠️  API返回异常")
             return None
@@ -474,169 +630,117 @@ def fetch_board_kline(board_code, board_type='industry', days=30):
         return None
 
 
-def fetch_market_indices():
-    """
-    获取大盘核心指数数据（用于大盘看板）
-    包括：上证指数/深证成指/创业板指/科创50/北证50
-    """
-    url = "https://push2.eastmoney.com/api/qt/ulist.np/get"
-
-    # secids 格式: 市场代码.指数代码
-    # 1.000001=上证指数, 0.399001=深证成指, 0.399006=创业板指
-    # 1.000688=科创50, 0.899050=北证50
-    params = {
-        'secids': '1.000001,0.399001,0.399006,1.000688,0.899050',
-        'fields': 'f12,f14,f2,f3,f4,f5,f6,f15,f16,f17'
-        # f2=最新价, f3=涨跌幅, f4=涨跌额, f5=成交量, f6=成交额
-        # f15=最高, f16=最低, f17=开盘
-    }
-
-    try:
-        print(f"  [大盘指数] 请求东方财富大盘核心指数数据...")
-        response = requests.get(url, params=params, headers=HEADERS, timeout=10)
-        response.raise_for_status()
-
-        data = response.json()
-        if data.get('rc') != 0 or 'data' not in data:
-            print(f"  [大盘指数] ⚠️  API返回异常")
-            return None
-
-        indices = data['data']['diff']
-        print(f"  [大盘指数] ✅ 成功获取 {len(indices)} 个大盘指数数据")
-
-        # 映射：东方财富代码 -> 我们的代码
-        code_map = {
-            '000001': 'SHCOMP',      # 上证指数
-            '399001': 'SZCOMP',      # 深证成指
-            '399006': 'CYBZ',        # 创业板指
-            '000688': 'KCB50',       # 科创50
-            '899050': 'BJ50'         # 北证50
-        }
-
-        # 指数中文名称
-        name_map = {
-            'SHCOMP': '上证指数',
-            'SZCOMP': '深证成指',
-            'CYBZ': '创业板指',
-            'KCB50': '科创50',
-            'BJ50': '北证50'
-        }
-
-        records = []
-        today = date.today().isoformat()
-
-        for item in indices:
-            code = item.get('f12', '')
-            if code in code_map:
-                index_code = code_map[code]
-                # f3返回的是百分比的100倍，如-39表示-0.39%
-                # 除以10000转换为小数形式：-39/10000 = -0.0039
-                pct = item.get('f3', 0) / 10000.0
-                # f2返回的值需要除以100得到实际点数
-                price = item.get('f2', 0) / 100.0
-
-                # 获取OHLC数据
-                open_price = item.get('f17', 0) / 100.0 if item.get('f17') else price
-                high = item.get('f15', 0) / 100.0 if item.get('f15') else price
-                low = item.get('f16', 0) / 100.0 if item.get('f16') else price
-
-                records.append({
-                    'date': today,
-                    'index_code': index_code,
-                    'index_name': name_map.get(index_code, ''),
-                    'open': open_price,
-                    'high': high,
-                    'low': low,
-                    'close': price,
-                    'prev_close': price / (1 + pct) if pct != 0 else price,
-                    'ret': pct,
-                    'volume': item.get('f5', 0),      # 成交量
-                    'turnover': item.get('f6', 0),    # 成交额
-                })
-
-        df = pd.DataFrame(records)
-        return df
-
-    except Exception as e:
-        print(f"  [大盘指数] ❌ 请求失败: {e}")
-        return None
+def _fetch_cached(cache, endpoint, func, key='', label=None):
+    """有快照缓存时请求成功写入缓存、失败降级使用缓存；没有缓存时直接请求"""
+    if cache is None:
+        return func()
+    return cache.fetch(endpoint, func, key=key, label=label)
 
 
-def load_eastmoney_data(top_boards=20, stocks_per_board=10):
+def load_eastmoney_data(top_boards=20, stocks_per_board=10, stock_mode='board', membership_path=None,
+                        cache_dir=None, max_stale=None, budget_seconds=None, queue_path=None,
+                        defer_membership=False):
     """
-    加载东方财富完整数据
+    加载东方财富完整数据（按时间预算和优先级调度，见 fetch_scheduler.py）
 
     参数:
         top_boards: 每种类型抓取前N个板块
         stocks_per_board: 每个板块抓取前N只个股
+        stock_mode: 'board'=逐板块请求成分股, 'market'=全市场行情 + 板块成分缓存
+        membership_path: 板块成分缓存文件（stock_mode='market' 时使用）
+        cache_dir: 接口快照缓存目录（见 snapshot_cache.py）；提供时接口失败降级使用 max_stale 秒内的缓存，
+                   使用了缓存的行带 stale_sec 列
+        max_stale: 降级模式允许的最旧快照（秒，默认 MAX_STALE_SECONDS）
+        budget_seconds: 抓取时间预算（秒，None=不限时）；到期时发布已完成的部分
+        queue_path: 未完成板块的队列文件，下一轮优先抓取
+        defer_membership: market 模式下过期的板块成分交给回填队列刷新，不占用实时抓取的时间
 
     返回:
-        (boards_df, stocks_df, indices_df)
+        (boards_df, stocks_df, indices_df, market_indices_df)
+        boards_df 的 stocks_source 列记录每个板块成分股的来源（live/retry/cache/deferred/failed）
     """
+    from fetch_scheduler import COVERAGE_COLUMN, FetchBudget, load_queue, save_queue
+
+    budget = FetchBudget(budget_seconds)
+    cache = None
+    if cache_dir:
+        from snapshot_cache import MAX_STALE_SECONDS, SnapshotCache
+        cache = SnapshotCache(cache_dir, MAX_STALE_SECONDS if max_stale is None else max_stale)
+
     print("📡 开始从东方财富获取实时数据...")
+    if budget_seconds is not None:
+        print(f"   时间预算 {budget_seconds:.0f} 秒")
     print("=" * 50)
 
-    # 1. 获取行业板块数据
-    industry_df = fetch_board_data(board_type='industry')
+    # 1. 板块列表和指数行情优先
+    industry_df = _fetch_cached(cache, 'boards_industry',
+                                lambda: fetch_board_data(board_type='industry', timeout=budget.timeout()),
+                                label='行业板块')
     if industry_df is None or industry_df.empty:
-        raise Exception("行业板块数据获取失败")
+        raise Exception("行业板块数据获取失败（无可用的缓存快照）")
     industry_df = industry_df.head(top_boards)
     print(f"\n  ✅ 已筛选 Top {len(industry_df)} 行业板块")
 
     time.sleep(0.5)
 
-    # 2. 获取概念板块数据
-    concept_df = fetch_board_data(board_type='concept')
+    concept_df = _fetch_cached(cache, 'boards_concept',
+                               lambda: fetch_board_data(board_type='concept', timeout=budget.timeout()),
+                               label='概念板块')
     if concept_df is None or concept_df.empty:
-        raise Exception("概念板块数据获取失败")
+        raise Exception("概念板块数据获取失败（无可用的缓存快照）")
     concept_df = concept_df.head(top_boards)
     print(f"\n  ✅ 已筛选 Top {len(concept_df)} 概念板块")
 
     # 合并两类板块
     boards_df = pd.concat([industry_df, concept_df], ignore_index=True)
 
-    # 延迟，避免请求过快
-    time.sleep(0.5)
-
-    # 2. 获取每个板块的成分股
-    print(f"\n  [个股] 开始获取板块成分股（每板块 Top {stocks_per_board}）...")
-    all_stocks = []
-
-    for idx, row in boards_df.iterrows():
-        bk_code = row['bk_code']
-        bk_name = row['bk_name']
-
-        stocks = fetch_board_stocks(bk_code, top_n=stocks_per_board)
-        all_stocks.extend(stocks)
-
-        print(f"    {idx+1}/{len(boards_df)} {bk_name}({bk_code}): {len(stocks)} 只个股")
-
-        # 延迟，避免请求过快
-        if idx < len(boards_df) - 1:
-            time.sleep(0.3)
-
-    stocks_df = pd.DataFrame(all_stocks)
-    print(f"  ✅ 共获取 {len(stocks_df)} 只个股数据")
-
     time.sleep(0.5)
 
-    # 3. 获取指数数据
+    # 指数数据（节奏指数与大盘核心指数合并为一次请求）
     print()
-    indices_df = fetch_index_data()
+    indices_df, market_indices_df = fetch_index_quotes(timeout=budget.timeout())
+    indices_df = _fetch_cached(cache, 'index_quotes', lambda: indices_df, key='indices', label='指数')
+    market_indices_df = _fetch_cached(cache, 'index_quotes', lambda: market_indices_df, key='market',
+                                      label='大盘指数')
     if indices_df is None or indices_df.empty:
-        raise Exception("指数数据获取失败")
-
-    time.sleep(0.5)
+        raise Exception("指数数据获取失败（无可用的缓存快照）")
 
-    # 4. 获取大盘核心指数数据
-    print()
-    market_indices_df = fetch_market_indices()
     if market_indices_df is None or market_indices_df.empty:
         print("  ⚠️  大盘核心指数数据获取失败，继续使用现有数据")
         market_indices_df = pd.DataFrame()
 
+    time.sleep(0.5)
+
+    # 2. 获取每个板块的成分股
+    stocks_df = None
+    if stock_mode == 'market' and not budget.expired():
+        print(f"\n  [个股] 全市场快照 + 板块成分缓存（每板块 Top {stocks_per_board}）...")
+        result = load_stocks_from_market(boards_df, stocks_per_board, membership_path, defer_membership)
+        if result is None:
+            print("  ⚠️  全市场行情获取失败，改为逐板块获取成分股")
+        else:
+            stocks_df, boards_df = result
+            boards_df[COVERAGE_COLUMN] = 'live'
+
+    if stocks_df is None:
+        stocks_df, source = _load_board_stocks(boards_df, stocks_per_board, cache, budget, load_queue(queue_path))
+        boards_df[COVERAGE_COLUMN] = boards_df['bk_code'].map(source)
+        # 未完成的板块进入下一轮队列（按本轮优先级）
+        unfinished = [code for code, src in source.items() if src in ('cache', 'deferred', 'failed')]
+        save_queue(queue_path, unfinished)
+    else:
+        save_queue(queue_path, [])
+
+    print(f"  ✅ 共获取 {len(stocks_df)} 只个股数据")
+
+    if cache is not None:
+        cache.save()
+        if cache.stale:
+            print("  ♻️  降级模式: " + ", ".join(
+                f"{endpoint}{'/' + key if key else ''} {age // 60} 分钟前" for (endpoint, key), age in cache.stale.items()))
+
     print("\n" + "=" * 50)
-    print("✅ 数据获取完成！")
+    print(f"✅ 数据获取完成！（用时 {budget.elapsed():.1f} 秒）")
     print(f"   板块: {len(boards_df)} 个")
     print(f"   个股: {len(stocks_df)} 只")
     print(f"   指数: {len(indices_df)} 个")
@@ -645,6 +749,79 @@ def load_eastmoney_data(top_boards=20, stocks_per_board=10):
     return boards_df, stocks_df, indices_df, market_indices_df
 
 
+def _load_board_stocks(boards_df, stocks_per_board, cache, budget, queued=()):
+    """
+    逐板块获取成分股：按优先级请求，失败的板块在后台重试，预算用完时停止
+
+    返回:
+        (stocks_df, {板块代码: 来源})，来源为 live/retry/cache/deferred/failed，按请求优先级排列
+    """
+    from fetch_scheduler import prioritize
+
+    names = dict(zip(boards_df['bk_code'], boards_df['bk_name']))
+    order = prioritize(boards_df, queued)
+    carried = len(set(queued) & set(order))
+    if carried:
+        print(f"\n  [个股] 上一轮未完成的板块优先: {carried} 个")
+    print(f"\n  [个股] 开始获取板块成分股（每板块 Top {stocks_per_board}）...")
+
+    frames, source = [], {}
+    failed, deferred = [], []
+    # 失败的板块交给后台线程重试，不阻塞后续板块
+    executor = ThreadPoolExecutor(max_workers=1)
+    retries = []
+    for i, bk_code in enumerate(order):
+        if budget.expired():
+            deferred = order[i:]
+            print(f"  [个股] ⏰ 时间预算用完，{len(deferred)} 个板块推迟到下一轮")
+            break
+        stocks = fetch_board_stocks(bk_code, top_n=stocks_per_board, timeout=budget.timeout())
+        if stocks is None:
+            failed.append(bk_code)
+            retries.append(executor.submit(retry_board_stocks, [bk_code], stocks_per_board, budget=budget))
+            print(f"    {i+1}/{len(order)} {names[bk_code]}({bk_code}): 失败，后台重试")
+        else:
+            frames.append(pd.DataFrame(stocks))
+            source[bk_code] = 'live'
+            if cache is not None:
+                cache.put('board_stocks', frames[-1], key=bk_code)
+            print(f"    {i+1}/{len(order)} {names[bk_code]}({bk_code}): {len(stocks)} 只个股")
+
+        # 延迟，避免请求过快
+        if i < len(order) - 1:
+            time.sleep(0.3)
+
+    # 汇总后台重试结果（最多等到预算用完）
+    recovered = {}
+    for future in retries:
+        try:
+            recovered.update(future.result(timeout=budget.remaining() if budget.seconds is not None else None))
+        except Exception:
+            pass
+    executor.shutdown(wait=False, cancel_futures=True)
+    if failed:
+        print(f"  [个股] 后台重试: {len(failed)} 个失败板块，恢复 {len(recovered)} 个")
+
+    # 重试仍失败和推迟的板块降级使用该板块的缓存快照
+    for bk_code in failed + deferred:
+        if bk_code in recovered:
+            frames.append(pd.DataFrame(recovered[bk_code]))
+            source[bk_code] = 'retry'
+            if cache is not None:
+                cache.put('board_stocks', frames[-1], key=bk_code)
+            continue
+        cached = cache.get('board_stocks', key=bk_code)[0] if cache is not None else None
+        if cached is not None:
+            frames.append(cached)
+            source[bk_code] = 'cache'
+        else:
+            source[bk_code] = 'deferred' if bk_code in deferred else 'failed'
+            print(f"  [个股] ❌ 板块 {bk_code} 没有可用数据（{'推迟' if bk_code in deferred else '重试失败'}且无可用缓存）")
+
+    stocks_df = pd.concat([f for f in frames if not f.empty] or [pd.DataFrame()], ignore_index=True)
+    return stocks_df, {code: source[code] for code in order}
+
+
 if __name__ == "__main__":
     # 测试
     try:
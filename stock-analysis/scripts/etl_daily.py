@@ -1,49 +1,131 @@
 # -*- coding: utf-8 -*-
 import json, argparse
-from datetime import date
+from pathlib import Path
 import pandas as pd
 from sources import load_mock, load_csv, load_api
-from factors import board_metrics, core_stocks, market_regime
+from factors import board_metrics, core_stocks, market_regime, stance
+from pipeline import Pipeline, code_version, file_hash, stable_hash
+from fetch_scheduler import COVERAGE_COLUMN, FETCH_BUDGET_SECONDS, coverage
+from backfill_queue import BACKFILL_BUDGET_SECONDS, TRADING_TASK_DELAY
+from snapshot_cache import MAX_STALE_SECONDS, STALE_COLUMN, frame_staleness
 
-def to_json(out_path, industry_boards, concept_boards, indices, market_indices=None):
+# 模拟时钟：replay.py 回放录制的快照时设为快照时刻（北京时间），None 表示使用真实时间
+SIM_NOW = None
+
+def beijing_now():
+    """当前北京时间（回放时为模拟时钟）"""
+    from datetime import datetime, timezone, timedelta
+    if SIM_NOW is not None:
+        return SIM_NOW
+    return datetime.now(timezone(timedelta(hours=8)))
+
+def today_str():
+    """当天日期 YYYY-MM-DD（北京时间，与快照时段同源；回放时为模拟时钟的日期）"""
+    return beijing_now().date().isoformat()
+
+def daily_payload(date_str, industry_boards, concept_boards, indices, market_indices=None, status=None):
+    """组装 daily.json / 存档的内容（status: 降级使用缓存快照时的数据时效，见 data_status）"""
     # 提取所有指数数据（排除市场判断字段）
     indices_data = {}
-    exclude_keys = {'risk_on', 'broad_strength', 'advice'}
+    exclude_keys = {'risk_on', 'broad_strength', 'advice', 'spread_ewm', 'threshold'}
     for key, value in indices.items():
         if key not in exclude_keys and isinstance(value, dict) and 'ret' in value:
             # 保存完整的指数数据（ret, volume, turnover）
             indices_data[key] = value
 
-    result = {
-        "date": date.today().isoformat(),
+    return {
+        "date": date_str,
         "market": {
             "risk_on": indices["risk_on"],
             "broad_strength": indices["broad_strength"],
-            "advice": "OFFENSE" if indices["advice"]=="OFFENSE" else ("DEFENSE" if indices["advice"]=="DEFENSE" else "NEUTRAL")
+            "advice": "OFFENSE" if indices["advice"]=="OFFENSE" else ("DEFENSE" if indices["advice"]=="DEFENSE" else "NEUTRAL"),
+            **{k: indices[k] for k in ("spread_ewm", "threshold") if k in indices}
         },
         "industry_boards": industry_boards,
         "concept_boards": concept_boards,
         "indices": indices_data,
         "market_indices": market_indices if market_indices else {},  # 新增：大盘核心指数
+        **({"data_status": status} if status else {}),
         "disclaimer": "本页面仅为个人研究与技术演示，不构成投资建议。"
     }
+
+def to_json(out_path, industry_boards, concept_boards, indices, market_indices=None, status=None):
+    result = daily_payload(today_str(), industry_boards, concept_boards, indices, market_indices, status)
     with open(out_path, "w", encoding="utf-8") as f:
         json.dump(result, f, ensure_ascii=False, indent=2)
     return result
 
-def archive_daily_data(data, archive_dir):
-    """存档当日数据到 archive 目录"""
-    import os
-    os.makedirs(archive_dir, exist_ok=True)
+def data_status(raw):
+    """
+    原始数据的时效和覆盖情况
+    - 接口失败时降级使用的缓存快照（snapshot_cache 提供，行上带 stale_sec 列）
+    - 时间预算内成分股的覆盖情况（fetch_scheduler 记录在板块表的 stocks_source 列）
 
-    date_str = data['date']
-    archive_path = os.path.join(archive_dir, f"{date_str}.json")
+    返回: {"stale", "max_age_sec", "sources": {数据: 秒数}, "board_stocks": {板块代码: 秒数},
+           "coverage": {...}（成分股未全部实时获取时）}，全部为实时数据时返回 None
+    """
+    bk, stk, idx, market_idx = raw
+    sources = {name: age for name, age in (("boards", frame_staleness(bk)), ("indices", frame_staleness(idx)),
+                                            ("market_indices", frame_staleness(market_idx))) if age is not None}
+    board_stocks = frame_staleness(stk, key="bk_code")
+    cov = coverage(bk)
+    incomplete = cov is not None and cov["live"] + cov["retry"] < cov["boards"]
+    if not sources and not board_stocks and not incomplete:
+        return None
+    ages = [*sources.values(), *board_stocks.values()]
+    return {
+        "stale": bool(ages),
+        "max_age_sec": max(ages, default=0),
+        "sources": sources,
+        "board_stocks": board_stocks,
+        **({"coverage": cov} if incomplete else {}),
+    }
 
-    with open(archive_path, 'w', encoding='utf-8') as f:
+def factor_version(params=None):
+    """派生数据的公式版本：因子与评级代码 + 评分参数（reprocess.py 据此判断存档是否过期）"""
+    return stable_hash([code_version(["factors.py", "regime.py", "stock_store.py", normalize_frames, compute_factors,
+                                      process_boards, daily_payload]), params or {}])
+
+def write_archive(data, archive_dir):
+    """原子写入 archive/<date>.json"""
+    import os
+    os.makedirs(archive_dir, exist_ok=True)
+    archive_path = os.path.join(archive_dir, f"{data['date']}.json")
+    tmp = f"{archive_path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, archive_path)
+    return archive_path
 
+def archive_daily_data(data, archive_dir, raw=None, params=None, staging_dir=None):
+    """
+    存档当日数据到 archive 目录
+    提供 raw 时同时保存原始数据（archive/raw/<date>/），并在存档中记录公式版本和输入哈希；
+    给出 staging_dir（交易时间内）时原始数据先写入 store/raw_pending/，收盘后由 close_raw_days 移入存档
+    """
+    meta = {"factor_version": factor_version(params)}
+    if raw is not None:
+        from raw_archive import save_raw
+        meta["input_hash"] = save_raw(raw, archive_dir, data['date'], staging_dir)
+    archive_path = write_archive(dict(data, meta=meta), archive_dir)
     print(f"   📁 存档: {archive_path}")
 
+def close_raw_days(args):
+    """把已收盘交易日（今天15:00以后含今天）暂存的原始数据移入存档，每个交易日只写入一次"""
+    from datetime import time as dtime, timedelta
+    from raw_archive import promote_pending
+    now = beijing_now()
+    through = now.date() if now.time() >= dtime(15, 0) else now.date() - timedelta(days=1)
+    for date_str in promote_pending(args.store_dir, args.archive_dir, through.isoformat()):
+        print(f"📁 原始数据已移入存档: archive/raw/{date_str}/")
+
+def record_intraday(factors, store_dir, slot):
+    """阶段 intraday：把本次快照追加到当天的盘中日志（store/intraday/<date>.jsonl.gz）"""
+    from intraday_store import record_snapshot
+    date_str, time_str = slot.split()
+    record_snapshot(store_dir, date_str, time_str, factors["boards"], factors["indices"], factors["market_indices"])
+    return slot
+
 def is_trading_time():
     """
     检测当前是否在交易时间内
@@ -51,12 +133,10 @@ def is_trading_time():
     - 上午：9:30-11:30
     - 下午：13:00-15:00
     """
-    from datetime import datetime, time, timezone, timedelta
+    from datetime import time
 
     # 使用北京时间（UTC+8）
-    beijing_tz = timezone(timedelta(hours=8))
-    now = datetime.now(beijing_tz)
-    current_time = now.time()
+    current_time = beijing_now().time()
 
     morning_start = time(9, 30)
     morning_end = time(11, 30)
@@ -75,11 +155,8 @@ def is_trading_day():
     简单判断：排除周末（周六、周日）+ 检查交易时间
     注意：不包含法定节假日判断，如需更精确请使用交易日历API
     """
-    from datetime import datetime, timezone, timedelta
-
     # 使用北京时间（UTC+8）
-    beijing_tz = timezone(timedelta(hours=8))
-    today = datetime.now(beijing_tz)
+    today = beijing_now()
     weekday = today.weekday()  # 0=Monday, 6=Sunday
 
     # 周六(5)和周日(6)不是交易日
@@ -92,32 +169,410 @@ def is_trading_day():
 
     return True
 
-def main():
+def load_raw(args):
+    """阶段 raw：按模式抓取原始数据"""
+    if args.mode in ("EASTMONEY", "API"):
+        # 实时接口经镜像主机池对冲请求，主机延迟样本跨次运行保存
+        from host_pool import load_stats, report, save_stats
+        stats_path = Path(args.store_dir) / "host_stats.json"
+        load_stats(stats_path)
+        try:
+            return load_live(args)
+        finally:
+            report()
+            save_stats(stats_path)
+    elif args.mode == "CSV":
+        return load_csv(args.board_csv, args.stock_csv, args.index_csv)
+    elif args.mode == "REPLAY":
+        from raw_archive import load_frames
+        raw = load_frames(args.replay_snapshot)
+        if raw is None:
+            raise FileNotFoundError(f"录制快照不完整: {args.replay_snapshot}")
+        return raw
+    else:  # MOCK
+        print("⚠️  使用 Mock 数据（仅用于测试）")
+        return load_mock()
+
+def load_live(args):
+    """从东方财富实时接口抓取（EASTMONEY / API 模式）"""
+    live = dict(cache_dir=str(Path(args.store_dir) / "snapshots"), max_stale=args.max_stale,
+                budget_seconds=args.fetch_budget or None,
+                queue_path=str(Path(args.store_dir) / "fetch_queue.json"))
+    if args.mode == "EASTMONEY":
+        from sources import load_eastmoney
+        return load_eastmoney(top_boards=args.top_boards, stocks_per_board=args.stocks_per_board,
+                              stock_mode=args.stock_mode, defer_membership=backfill_enabled(args),
+                              membership_path=str(Path(args.store_dir) / "board_members.json"), **live)
+    from os import getenv
+    api_key = getenv("DATA_API_KEY","")
+    return load_api(api_key, **live)
+
+def backfill_enabled(args):
+    """回填队列只用于实时模式（EASTMONEY / API）"""
+    return args.mode in ("EASTMONEY", "API") and args.backfill_budget > 0
+
+def run_backfill(args, seconds, delay=0.0, boards=None):
+    """
+    用剩余时间排空回填队列（见 backfill_queue.py）
+
+    参数:
+        seconds: 可用时间（秒）
+        boards: 本次快照的板块表，提供时先按它加入K线和成分回填任务
+    """
+    from backfill_queue import BackfillQueue, default_queue_path, drain, enqueue_snapshot
+    from fetch_scheduler import REQUEST_TIMEOUT
+
+    queue = BackfillQueue(default_queue_path(args.store_dir))
+    try:
+        if boards is not None:
+            enqueue_snapshot(queue, boards, args.store_dir, args.archive_dir, today_str())
+        counts = queue.counts()
+        if not counts["due"]:
+            return
+        if seconds < REQUEST_TIMEOUT:
+            print(f"\n⏭️  回填队列 {counts['due']} 个到期任务，剩余时间不足（{max(seconds, 0):.0f}秒），下次执行")
+            return
+
+        from host_pool import load_stats, report, save_stats
+        stats_path = Path(args.store_dir) / "host_stats.json"
+        load_stats(stats_path)
+        print(f"\n🧱 回填队列: {counts['due']} 个到期任务，可用 {seconds:.0f} 秒")
+        result = drain(queue, args.store_dir, args.archive_dir, seconds, delay, today_str())
+        report()
+        save_stats(stats_path)
+        print(f"   完成 {result['done']} 个，失败 {result['failed']} 个，放弃 {result['dead']} 个，"
+              f"剩余 {queue.counts()['pending']} 个")
+    finally:
+        queue.close()
+
+def normalize_frames(raw):
+    """阶段 frames：把原始数据整理成后续计算使用的表"""
+    # 数据时效标记只用于 data_status，不参与因子计算
+    bk, stk, idx, market_idx = (df.drop(columns=[STALE_COLUMN, COVERAGE_COLUMN], errors="ignore") for df in raw)
+
+    # 处理大盘核心指数数据
+    market_indices_dict = {}
+    if not market_idx.empty:
+        for _, row in market_idx.iterrows():
+            index_code = row['index_code']
+            market_indices_dict[index_code] = {
+                "name": row.get('index_name', index_code),
+                "open": float(row.get('open', 0)) if pd.notna(row.get('open', 0)) else 0.0,
+                "high": float(row.get('high', 0)) if pd.notna(row.get('high', 0)) else 0.0,
+                "low": float(row.get('low', 0)) if pd.notna(row.get('low', 0)) else 0.0,
+                "close": float(row.get('close', 0)) if pd.notna(row.get('close', 0)) else 0.0,
+                "ret": float(row['ret']) if pd.notna(row['ret']) else 0.0,
+                "volume": float(row.get('volume', 0)) if pd.notna(row.get('volume', 0)) else 0.0,
+                "turnover": float(row.get('turnover', 0)) if pd.notna(row.get('turnover', 0)) else 0.0
+            }
+
+    return {
+        "boards": bk,
+        "stocks": stk,
+        "indices": idx,
+        "market_indices": market_indices_dict,
+    }
+
+def load_params(path):
+    """
+    加载评分参数文件（可直接使用 sweep.py 的输出，读取其中的 best 部分）
+    格式: {"score": {...}, "core": {...}, "regime": {...}}，缺省项使用代码中的默认值
+    """
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    data = data.get("best", data)
+    return {k: data.get(k) or {} for k in ("score", "core", "regime")}
+
+def load_regime_state(store_dir, archive_dir, params=None):
+    """加载市场节奏增量状态，不存在或参数变化时由全部存档冷启动"""
+    from regime import REGIME_PARAMS, RegimeState
+    state = RegimeState.load(Path(store_dir) / "regime_state.json")
+    if state is None or state.params != dict(REGIME_PARAMS, **(params or {})):
+        from generate_history import load_index_returns
+        state = RegimeState.from_series(load_index_returns(archive_dir, store_dir=store_dir), params)
+    return state
+
+def snapshot_date(stocks):
+    """快照所属交易日"""
+    if "date" in stocks.columns and stocks["date"].notna().any():
+        return str(stocks["date"].dropna().max())
+    return today_str()
+
+def compute_factors(frames, store_dir=None, archive_dir=None, params=None, features=None):
+    """
+    阶段 factors：计算板块、个股因子和市场节奏
+    features: 个股时序特征（重算历史时传入）；未提供且有持久化目录时用当天快照更新个股存储后获取
+    """
+    params = params or {}
+    boards_df = board_metrics(frames["boards"], frames["stocks"], params.get("score"))
+
+    stocks = frames["stocks"]
+    if features is None and store_dir and not stocks.empty:
+        from stock_store import update_stock_store
+        features = update_stock_store(stocks, store_dir, snapshot_date(stocks))
+    if features is not None:
+        stocks = stocks.merge(features, on="ts_code", how="left")
+    stocks_df = core_stocks(stocks, params.get("core"))
+
+    # 市场节奏：提供持久化目录时按增量状态（EWMA + 波动率阈值）判断
+    state = load_regime_state(store_dir, archive_dir, params.get("regime")) if store_dir else None
+    indices = market_regime(frames["indices"], state, params.get("regime"))
+    if state is not None:
+        state.save(Path(store_dir) / "regime_state.json")
+
+    # 按涨幅排序（而不是综合评分），综合评分仅用于购买推荐
+    boards_df = boards_df.sort_values("ret", ascending=False)
+
+    return {
+        "boards": boards_df,
+        "stocks": stocks_df,
+        "indices": indices,
+        "market_indices": frames["market_indices"],
+    }
+
+def detect_today_new_boards(boards_df, archive_dir):
+    """检测今天新上榜的板块"""
+    from generate_history import detect_new_boards
+
+    # 提取今天的行业板块和概念板块 Top10（用于检测新上榜）
+    if 'bk_type' in boards_df.columns:
+        industry_df = boards_df[boards_df['bk_type'] == 'industry'].head(10)
+        concept_df = boards_df[boards_df['bk_type'] == 'concept'].head(10)
+
+        today_industry = [{'code': row['bk_code'], 'name': row['bk_name']}
+                         for _, row in industry_df.iterrows()]
+        today_concept = [{'code': row['bk_code'], 'name': row['bk_name']}
+                        for _, row in concept_df.iterrows()]
+
+        return detect_new_boards(
+            archive_dir,
+            today_industry_boards=today_industry,
+            today_concept_boards=today_concept,
+            lookback_days=10,
+            today_date=today_str()
+        )
+
+    # 向后兼容：如果没有分类，使用旧逻辑
+    return detect_new_boards(archive_dir, lookback_days=10)
+
+def process_boards(df, stocks_df, board_type, new_boards, top_n=10):
+    """处理指定类型的板块，保持涨幅排序"""
+    boards = []
+    # 筛选指定类型的板块，保持原有排序（已按涨幅排序）
+    if 'bk_type' in df.columns:
+        type_boards = df[df['bk_type'] == board_type].copy()
+    else:
+        type_boards = df.copy()
+
+    # 取前 top_n 个板块（已按涨幅排序）
+    for _, row in type_boards.head(top_n).iterrows():
+        bcode = row["bk_code"]
+        extra = [c for c in ("ret_5d", "lu_streak") if c in stocks_df.columns]
+        top_core = (stocks_df[stocks_df["bk_code"]==bcode]
+                    .sort_values("core", ascending=False)
+                    .head(3)[["ts_code","name","ret_1d","core"] + extra])
+
+        # 检查是否是新上榜板块
+        is_new = bcode in new_boards.get(board_type, set())
+
+        boards.append({
+            "code": bcode,
+            "name": row["bk_name"],
+            "type": board_type,
+            "ret": round(float(row["ret"]), 6),
+            "pop": round(float(row["pop"]), 6),
+            "persistence": int(row["persistence"]),
+            "dispersion": round(float(row["dispersion"]), 6) if pd.notna(row["dispersion"]) else None,
+            "breadth": round(float(row["breadth"]), 6) if pd.notna(row["breadth"]) else None,
+            "score": round(float(row["score"]), 6),
+            # 评分原始分量，供参数扫描（sweep.py）按不同权重重算综合分
+            "pop_turnover": round(float(row["pop_turnover"]), 6) if pd.notna(row["pop_turnover"]) else None,
+            "up_count": int(row["up_count"]) if pd.notna(row["up_count"]) else None,
+            "stance": stance(row["score"]),
+            "is_new": is_new,  # 新增标记
+            "core_stocks": [
+                {"code": r["ts_code"], "name": r["name"], "ret": round(float(r["ret_1d"]),6), "core": round(float(r["core"]),6),
+                 **({"ret_5d": round(float(r["ret_5d"]),6) if pd.notna(r["ret_5d"]) else None} if "ret_5d" in r else {}),
+                 **({"lu_streak": int(r["lu_streak"]) if pd.notna(r["lu_streak"]) else None} if "lu_streak" in r else {})}
+                for _, r in top_core.iterrows()
+            ]
+        })
+    return boards
+
+def build_daily(factors, raw, out_path, archive_dir, enable_history):
+    """阶段 daily：生成并写出 daily.json"""
+    boards_df = factors["boards"]
+    stocks_df = factors["stocks"]
+
+    # 检测新上榜的板块
+    new_boards = {'industry': set(), 'concept': set()}
+    if enable_history:
+        new_boards = detect_today_new_boards(boards_df, archive_dir)
+
+    # 分别处理行业板块和概念板块
+    industry_boards = process_boards(boards_df, stocks_df, 'industry', new_boards, top_n=10)
+    concept_boards = process_boards(boards_df, stocks_df, 'concept', new_boards, top_n=10)
+
+    return to_json(out_path, industry_boards, concept_boards, factors["indices"], factors["market_indices"],
+                   data_status(raw))
+
+def archive_fingerprint(archive_dir, exclude=None):
+    """存档目录指纹（单日文件和月度包的文件名+大小），用于判断依赖存档的阶段是否过期"""
+    from archive_bundle import bundle_fingerprint
+    archive_path = Path(archive_dir)
+    if not archive_path.exists():
+        return []
+    return [[f.name, f.stat().st_size] for f in sorted(archive_path.glob("*.json"))
+            if f.stem != exclude] + bundle_fingerprint(archive_dir)
+
+def snapshot_slot(now=None, minutes=5):
+    """当前所处的行情快照时段（北京时间，按N分钟取整）"""
+    now = now or beijing_now()
+    return now.replace(minute=now.minute - now.minute % minutes, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M')
+
+def record_raw(raw, record_dir, slot):
+    """阶段 record：把本次抓取的原始数据录制到 <record_dir>/<date>/<HHMM>/，供 replay.py 回放"""
+    from raw_archive import save_frames
+    date_str, time_str = slot.split()
+    folder = Path(record_dir) / date_str / time_str.replace(":", "")
+    save_frames(raw, folder)
+    return str(folder)
+
+def build_pipeline(args):
+    """
+    构建 ETL 流水线：raw → frames → factors → daily → archive → history，factors → intraday，daily → push
+    每个阶段的输出按输入哈希和代码版本缓存，只有过期阶段会重新执行
+    """
+    from intraday_store import intraday_path
+    from push_feed import publish
+    from stock_store import store_files
+
+    today = today_str()
+    archive_path = str(Path(args.archive_dir) / f"{today}.json")
+    slot = snapshot_slot()
+
+    # 原始数据的键：实时模式按5分钟快照时段，文件模式按文件内容
+    raw_params = {"mode": args.mode, "date": today}
+    if args.mode in ("EASTMONEY", "API"):
+        raw_params.update(top_boards=args.top_boards, stocks_per_board=args.stocks_per_board,
+                          stock_mode=args.stock_mode, snapshot=slot)
+    elif args.mode == "CSV":
+        raw_params.update(files=[file_hash(p) for p in (args.board_csv, args.stock_csv, args.index_csv)])
+    elif args.mode == "REPLAY":
+        from raw_archive import frames_hash
+        raw_params.update(snapshot=slot, files=frames_hash(args.replay_snapshot))
+
+    pipeline = Pipeline(args.cache_dir)
+    pipeline.add("raw", lambda: load_raw(args), params=raw_params,
+                 code=[load_raw, load_live, "sources.py", "eastmoney.py", "membership.py", "snapshot_cache.py",
+                       "host_pool.py", "fetch_scheduler.py"])
+    pipeline.add("frames", normalize_frames, deps=["raw"])
+    params = load_params(args.params)
+    # factors 顺带写入个股存储和节奏状态：声明为输出，其他日期/时段改写过它们时不复用缓存
+    pipeline.add("factors", lambda f: compute_factors(f, args.store_dir, args.archive_dir, params),
+                 deps=["frames"], params={"store": args.store_dir, "params": params},
+                 code=[compute_factors, load_regime_state, "factors.py", "regime.py", "stock_store.py"],
+                 outputs=[Path(args.store_dir) / "regime_state.json", *store_files(args.store_dir)])
+    pipeline.add("daily", lambda f, raw: build_daily(f, raw, args.out, args.archive_dir, args.enable_history),
+                 deps=["factors", "raw"],
+                 params={"out": args.out, "enable_history": args.enable_history,
+                         "archive": archive_fingerprint(args.archive_dir, exclude=today) if args.enable_history else None},
+                 code=[build_daily, process_boards, detect_today_new_boards, to_json, data_status,
+                       "generate_history.py", "appearance_index.py"],
+                 outputs=[args.out])
+    # 推送事件紧随 daily.json 之后写出，连接到 query_server.py /api/stream 的页面立即收到变化
+    pipeline.add("push", lambda d: publish(d, args.store_dir, slot), deps=["daily"],
+                 params={"store": args.store_dir, "slot": slot}, code=["push_feed.py"])
+    # 交易时间内的快照当天还会被覆盖，原始数据先暂存，收盘后只写入存档一次
+    staging_dir = args.store_dir if is_trading_time() else None
+    pipeline.add("archive", lambda d, raw: archive_daily_data(d, args.archive_dir, raw, params, staging_dir),
+                 deps=["daily", "raw"], params={"path": archive_path, "params": params, "staging": staging_dir},
+                 code=[archive_daily_data, write_archive, "raw_archive.py"], outputs=[archive_path])
+    pipeline.add("intraday", lambda f: record_intraday(f, args.store_dir, slot), deps=["factors"],
+                 params={"slot": slot}, code=[record_intraday, "intraday_store.py"],
+                 outputs=[str(intraday_path(args.store_dir, slot.split()[0]))])
+    if getattr(args, "record_dir", None):
+        pipeline.add("record", lambda raw: record_raw(raw, args.record_dir, slot), deps=["raw"],
+                     params={"dir": args.record_dir, "slot": slot}, code=[record_raw, "raw_archive.py"])
+
+    if args.enable_history:
+        history_path = args.out.replace('daily.json', 'history.json')
+
+        def run_history(_):
+            print("\n" + "=" * 60)
+            print("📊 生成历史趋势数据...")
+            from generate_history import generate_history, save_history
+            history = generate_history(args.archive_dir, args.history_days, args.store_dir)
+            if history:
+                save_history(history, history_path)
+            return history
+
+        pipeline.add("history", run_history, deps=["archive"],
+                     params={"days": args.history_days, "path": history_path,
+                             "archive": archive_fingerprint(args.archive_dir, exclude=today)},
+                     code=["generate_history.py", "appearance_index.py", "panel.py", "indicators.py",
+                           "board_corr.py", "archive_bundle.py"], outputs=[history_path])
+
+    return pipeline
+
+def build_parser():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--mode", choices=["EASTMONEY","MOCK","CSV","API"], default="EASTMONEY",
-                    help="数据源模式: EASTMONEY=东方财富实时数据(默认), MOCK=模拟数据, CSV=CSV文件, API=自定义API")
+    ap.add_argument("--mode", choices=["EASTMONEY","MOCK","CSV","API","REPLAY"], default="EASTMONEY",
+                    help="数据源模式: EASTMONEY=东方财富实时数据(默认), MOCK=模拟数据, CSV=CSV文件, API=自定义API, "
+                         "REPLAY=读取录制的原始快照（由 replay.py 驱动）")
+    ap.add_argument("--replay-snapshot", default=None, help="REPLAY模式读取的原始快照目录")
+    ap.add_argument("--record-dir", default=None, help="把每个快照时段的原始数据录制到该目录（<date>/<HHMM>/），供 replay.py 回放")
     ap.add_argument("--board_csv", default="scripts/sample/boards.csv")
     ap.add_argument("--stock_csv", default="scripts/sample/stocks.csv")
     ap.add_argument("--index_csv", default="scripts/sample/index.csv")
     ap.add_argument("--out", default="site/data/daily.json")
     ap.add_argument("--top-boards", type=int, default=20, help="抓取前N个板块(EASTMONEY模式)")
     ap.add_argument("--stocks-per-board", type=int, default=10, help="每板块抓取前N只个股(EASTMONEY模式)")
+    ap.add_argument("--max-stale", type=int, default=MAX_STALE_SECONDS,
+                    help="接口失败时允许使用的最旧缓存快照（秒，EASTMONEY/API模式）")
+    ap.add_argument("--fetch-budget", type=float, default=FETCH_BUDGET_SECONDS,
+                    help="实时抓取的时间预算（秒，0=不限时）；到期时发布已完成的部分，未完成的板块下一轮优先")
+    ap.add_argument("--backfill-budget", type=float, default=BACKFILL_BUDGET_SECONDS,
+                    help="非交易时间排空回填队列的时间预算（秒，0=不回填）；交易时间内只用抓取时间预算的剩余部分")
+    ap.add_argument("--stock-mode", choices=["board", "market"], default="board",
+                    help="个股获取方式(EASTMONEY模式): board=逐板块请求成分股, market=全市场行情分页拉取+板块成分缓存")
     ap.add_argument("--archive-dir", default="site/data/archive", help="历史数据存档目录")
+    ap.add_argument("--store-dir", default=None, help="持久化数据目录（默认与输出文件同目录下的 store/）")
     ap.add_argument("--enable-history", action="store_true", help="启用历史趋势数据生成")
     ap.add_argument("--history-days", type=int, default=7, help="历史数据天数")
     ap.add_argument("--skip-trading-day-check", action="store_true", help="跳过交易日检测（用于测试）")
-    args = ap.parse_args()
+    ap.add_argument("--params", default=None, help="评分参数文件（JSON，如 sweep.py 输出的最优参数）")
+    ap.add_argument("--cache-dir", default=".etl_cache", help="流水线阶段缓存目录")
+    ap.add_argument("--force-stage", action="append", default=[],
+                    choices=["raw", "frames", "factors", "daily", "push", "archive", "intraday", "record", "history"],
+                    help="强制重跑指定阶段（可重复）")
+    ap.add_argument("--explain", action="store_true", help="只显示将要执行的阶段及原因，不实际运行")
+    return ap
+
+def main():
+    import time
+    started = time.monotonic()
+    args = build_parser().parse_args()
+    if args.store_dir is None:
+        args.store_dir = str(Path(args.out).parent / "store")
 
     print(f"🚀 ETL 模式: {args.mode}")
     print("=" * 60)
 
+    if args.explain:
+        build_pipeline(args).explain(force=args.force_stage)
+        return
+
+    # 已收盘交易日的盘中原始数据移入存档（收盘后的定时任务或次日第一次运行）
+    close_raw_days(args)
+
     # 检测是否为交易日（MOCK模式和显式跳过检测时除外）
     if args.mode != "MOCK" and not args.skip_trading_day_check:
         if not is_trading_day():
-            from datetime import datetime, timezone, timedelta
             # 使用北京时间（UTC+8）
-            beijing_tz = timezone(timedelta(hours=8))
-            now = datetime.now(beijing_tz)
+            now = beijing_now()
             weekday_name = ['星期一', '星期二', '星期三', '星期四', '星期五', '星期六', '星期日']
             today_name = weekday_name[now.weekday()]
             current_time_str = now.strftime('%H:%M:%S')
@@ -131,138 +586,35 @@ def main():
 
             print("\n💡 如需强制运行，请使用 --skip-trading-day-check 参数")
             print("=" * 60)
-            return
-
-    if args.mode == "EASTMONEY":
-        from sources import load_eastmoney
-        bk, stk, idx, market_idx = load_eastmoney(top_boards=args.top_boards, stocks_per_board=args.stocks_per_board)
-    elif args.mode == "CSV":
-        bk, stk, idx, market_idx = load_csv(args.board_csv, args.stock_csv, args.index_csv)
-    elif args.mode == "API":
-        from os import getenv
-        api_key = getenv("DATA_API_KEY","")
-        bk, stk, idx, market_idx = load_api(api_key)
-    else:  # MOCK
-        print("⚠️  使用 Mock 数据（仅用于测试）")
-        bk, stk, idx, market_idx = load_mock()
 
-    # 计算
-    boards_df = board_metrics(bk, stk)
-    stocks_df = core_stocks(stk)
-    indices = market_regime(idx)
-
-    # 处理大盘核心指数数据
-    market_indices_dict = {}
-    if not market_idx.empty:
-        for _, row in market_idx.iterrows():
-            index_code = row['index_code']
-            market_indices_dict[index_code] = {
-                "name": row.get('index_name', index_code),
-                "open": float(row.get('open', 0)) if pd.notna(row.get('open', 0)) else 0.0,
-                "high": float(row.get('high', 0)) if pd.notna(row.get('high', 0)) else 0.0,
-                "low": float(row.get('low', 0)) if pd.notna(row.get('low', 0)) else 0.0,
-                "close": float(row.get('close', 0)) if pd.notna(row.get('close', 0)) else 0.0,
-                "ret": float(row['ret']) if pd.notna(row['ret']) else 0.0,
-                "volume": float(row.get('volume', 0)) if pd.notna(row.get('volume', 0)) else 0.0,
-                "turnover": float(row.get('turnover', 0)) if pd.notna(row.get('turnover', 0)) else 0.0
-            }
-
-    # 聚合输出（分别处理行业板块和概念板块）
-    # 按涨幅排序（而不是综合评分），综合评分仅用于购买推荐
-    boards_df = boards_df.sort_values("ret", ascending=False)
-
-    # 检测新上榜的板块
-    new_boards = {'industry': set(), 'concept': set()}
-    if args.enable_history:
-        from generate_history import detect_new_boards
-
-        # 提取今天的行业板块和概念板块 Top10（用于检测新上榜）
-        if 'bk_type' in boards_df.columns:
-            industry_df = boards_df[boards_df['bk_type'] == 'industry'].head(10)
-            concept_df = boards_df[boards_df['bk_type'] == 'concept'].head(10)
-
-            today_industry = [{'code': row['bk_code'], 'name': row['bk_name']}
-                             for _, row in industry_df.iterrows()]
-            today_concept = [{'code': row['bk_code'], 'name': row['bk_name']}
-                            for _, row in concept_df.iterrows()]
-
-            new_boards = detect_new_boards(
-                args.archive_dir,
-                today_industry_boards=today_industry,
-                today_concept_boards=today_concept,
-                lookback_days=10
-            )
-        else:
-            # 向后兼容：如果没有分类，使用旧逻辑
-            new_boards = detect_new_boards(args.archive_dir, lookback_days=10)
-
-    def process_boards(df, board_type, top_n=10):
-        """处理指定类型的板块，保持涨幅排序"""
-        boards = []
-        # 筛选指定类型的板块，保持原有排序（已按涨幅排序）
-        if 'bk_type' in df.columns:
-            type_boards = df[df['bk_type'] == board_type].copy()
-        else:
-            type_boards = df.copy()
-
-        # 取前 top_n 个板块（已按涨幅排序）
-        for _, row in type_boards.head(top_n).iterrows():
-            bcode = row["bk_code"]
-            top_core = (stocks_df[stocks_df["bk_code"]==bcode]
-                        .sort_values("core", ascending=False)
-                        .head(3)[["ts_code","name","ret_1d","core"]])
-
-            # 检查是否是新上榜板块
-            is_new = bcode in new_boards.get(board_type, set())
-
-            boards.append({
-                "code": bcode,
-                "name": row["bk_name"],
-                "type": board_type,
-                "ret": round(float(row["ret"]), 6),
-                "pop": round(float(row["pop"]), 6),
-                "persistence": int(row["persistence"]),
-                "dispersion": round(float(row["dispersion"]), 6) if pd.notna(row["dispersion"]) else None,
-                "breadth": round(float(row["breadth"]), 6) if pd.notna(row["breadth"]) else None,
-                "score": round(float(row["score"]), 6),
-                "stance": "STRONG_BUY" if row["score"]>1.5 else ("BUY" if row["score"]>0.5 else ("WATCH" if row["score"]>-0.5 else "AVOID")),
-                "is_new": is_new,  # 新增标记
-                "core_stocks": [
-                    {"code": r["ts_code"], "name": r["name"], "ret": round(float(r["ret_1d"]),6), "core": round(float(r["core"]),6)}
-                    for _, r in top_core.iterrows()
-                ]
-            })
-        return boards
+            # 非交易时间没有实时抓取，全速排空回填队列
+            if backfill_enabled(args):
+                run_backfill(args, args.backfill_budget)
+            return
 
-    # 分别处理行业板块和概念板块
-    industry_boards = process_boards(boards_df, 'industry', top_n=10)
-    concept_boards = process_boards(boards_df, 'concept', top_n=10)
+    pipeline = build_pipeline(args)
+    pipeline.run(force=args.force_stage)
 
-    daily_data = to_json(args.out, industry_boards, concept_boards, indices, market_indices_dict)
+    factors = pipeline.value("factors")
+    daily_data = pipeline.value("daily")
 
     print("\n" + "=" * 60)
     print(f"✅ 数据已保存: {args.out}")
-    print(f"   日期: {date.today().isoformat()}")
-    print(f"   行业板块: {len(industry_boards)}")
-    print(f"   概念板块: {len(concept_boards)}")
-    print(f"   个股数: {len(stocks_df)}")
-    print(f"   大盘指数: {len(market_indices_dict)}")
-    print(f"   市场节奏: {indices['advice']}")
-
-    # 存档当日数据
-    archive_daily_data(daily_data, args.archive_dir)
-
-    # 生成历史趋势数据
-    if args.enable_history:
-        print("\n" + "=" * 60)
-        print("📊 生成历史趋势数据...")
-        from generate_history import generate_history, save_history
-        history = generate_history(args.archive_dir, args.history_days)
-        if history:
-            history_path = args.out.replace('daily.json', 'history.json')
-            save_history(history, history_path)
-
+    print(f"   日期: {daily_data['date']}")
+    print(f"   行业板块: {len(daily_data['industry_boards'])}")
+    print(f"   概念板块: {len(daily_data['concept_boards'])}")
+    print(f"   个股数: {len(factors['stocks'])}")
+    print(f"   大盘指数: {len(daily_data['market_indices'])}")
+    print(f"   市场节奏: {factors['indices']['advice']}")
     print("=" * 60)
 
+    # 实时数据已发布：交易时间内用抓取时间预算的剩余部分执行回填，非交易时间（手动运行）全速回填
+    if backfill_enabled(args):
+        if is_trading_time() and args.fetch_budget:
+            seconds, delay = args.fetch_budget - (time.monotonic() - started), TRADING_TASK_DELAY
+        else:
+            seconds, delay = args.backfill_budget, 0.0
+        run_backfill(args, seconds, delay, boards=pipeline.value("raw")[0])
+
 if __name__ == "__main__":
     main()
@@ -2,20 +2,55 @@
 import numpy as np
 import pandas as pd
 
+# 板块评分权重（sweep.py 可扫描调整）
+SCORE_PARAMS = {
+    'pop_up_weight': 0.5,       # 人气中上涨家数的权重
+    'dispersion_weight': 0.5,   # 综合分中 1/分歧度 的权重
+}
+
+# 个股核心度权重
+CORE_PARAMS = {
+    'amplitude_weight': 0.5,    # 个股人气中振幅的权重
+    'turnover_pct_weight': 0.5, # 个股人气中换手率历史分位的权重（需个股存储）
+    'pop_weight': 0.6,          # 核心度中人气的权重
+    'ret_weight': 0.4,          # 核心度中涨幅的权重
+    'trend_weight': 0.3,        # 核心度中多日趋势（5日涨幅 + 连续涨停）的权重（需个股存储）
+}
+
+# 综合分 → 评级（依次比较，均不满足为 AVOID）
+STANCE_CUTOFFS = [(1.5, "STRONG_BUY"), (0.5, "BUY"), (-0.5, "WATCH")]
+
+def stance(score):
+    for cutoff, label in STANCE_CUTOFFS:
+        if score > cutoff:
+            return label
+    return "AVOID"
+
 def zscore(s: pd.Series):
     return (s - s.mean()) / (s.std(ddof=0) + 1e-9)
 
-def board_metrics(board_df: pd.DataFrame, stocks_df: pd.DataFrame):
+def pop_score(pop_turnover, up_count, params=None, z=zscore):
+    """板块人气 = z(成交额放量) + w × z(上涨家数)"""
+    p = dict(SCORE_PARAMS, **(params or {}))
+    return z(pop_turnover) + p['pop_up_weight'] * z(up_count)
+
+def composite_score(ret, pop, dispersion, params=None, z=zscore):
+    """板块综合分 = z(涨幅) + z(人气) + w × z(1/分歧度)"""
+    p = dict(SCORE_PARAMS, **(params or {}))
+    return z(ret) + z(pop) + p['dispersion_weight'] * z(1.0 / (dispersion + 1e-9))
+
+def board_metrics(board_df: pd.DataFrame, stocks_df: pd.DataFrame, params=None):
     """
     board_df: date,bk_code,bk_name,close,prev_close,turnover,up_count,limit_up
     stocks_df: date,bk_code,ts_code,name,close,prev_close,turnover,turnover_ratio,amplitude
+    params: 覆盖 SCORE_PARAMS 中的权重
     """
     df = board_df.copy()
     df["ret"] = df["close"] / df["prev_close"] - 1
     df["pop_turnover"] = df.groupby("bk_code")["turnover"].transform(
         lambda s: s / (s.rolling(5, min_periods=1).mean() + 1e-9)
     )
-    df["pop"] = zscore(df["pop_turnover"]) + 0.5 * zscore(df["up_count"])
+    df["pop"] = pop_score(df["pop_turnover"], df["up_count"], params)
     # 持续性：mom3,mom5（此处简单用近几日滚动累计，要求上游保证有历史）
     for n in (3, 5):
         df[f"mom{n}"] = df.groupby("bk_code")["ret"].transform(
@@ -31,24 +66,50 @@ def board_metrics(board_df: pd.DataFrame, stocks_df: pd.DataFrame):
     disp = tmp.groupby(["date","bk_code"])["ret_1d"].std(ddof=0).rename("dispersion")
     breadth = (tmp["ret_1d"] > 0).groupby([tmp["date"], tmp["bk_code"]]).mean().rename("breadth")
     df = df.merge(disp, on=["date","bk_code"], how="left").merge(breadth, on=["date","bk_code"], how="left")
+    # 全市场快照模式下，广度按板块全部成分股计算（而不是仅前N只个股）
+    if "breadth_full" in df.columns:
+        df["breadth"] = df["breadth_full"].fillna(df["breadth"])
 
     # 综合分
-    df["score"] = zscore(df["ret"]) + zscore(df["pop"]) + 0.5 * zscore(1.0 / (df["dispersion"] + 1e-9))
+    df["score"] = composite_score(df["ret"], df["pop"], df["dispersion"], params)
     return df
 
-def core_stocks(stocks_df: pd.DataFrame):
+def core_stocks(stocks_df: pd.DataFrame, params=None):
+    """
+    个股核心度评分
+    同一只股票可能属于多个热门板块，因子按个股去重后只计算一次，再映射回每个板块
+    stocks_df 含个股存储的时序特征（ret_5d, lu_streak, turnover_pct）时计入多日趋势和换手率分位
+    params: 覆盖 CORE_PARAMS 中的权重
+    """
+    p = dict(CORE_PARAMS, **(params or {}))
     s = stocks_df.copy()
-    s["ret_1d"] = s["close"] / s["prev_close"] - 1
-    s["score_ret"] = zscore(s["ret_1d"])
-    s["score_pop"] = zscore(s["turnover_ratio"]) + 0.5 * zscore(s.get("amplitude", pd.Series(0, index=s.index)))
-    s["core"] = 0.6 * s["score_pop"] + 0.4 * s["score_ret"]
-    return s
+    key = "ts_code" if "ts_code" in s.columns else None
+    u = s.drop_duplicates(key).copy() if key else s
+    u["ret_1d"] = u["close"] / u["prev_close"] - 1
+    u["score_ret"] = zscore(u["ret_1d"])
+    u["score_pop"] = zscore(u["turnover_ratio"]) \
+                   + p["amplitude_weight"] * zscore(u.get("amplitude", pd.Series(0, index=u.index)))
+    if "turnover_pct" in u.columns:
+        u["score_pop"] += p["turnover_pct_weight"] * zscore(u["turnover_pct"]).fillna(0)
+    u["core"] = p["pop_weight"] * u["score_pop"] + p["ret_weight"] * u["score_ret"]
+    if "ret_5d" in u.columns and "lu_streak" in u.columns:
+        u["score_trend"] = zscore(u["ret_5d"]).fillna(0) + zscore(u["lu_streak"]).fillna(0)
+        u["core"] += p["trend_weight"] * u["score_trend"]
+    if key is None:
+        return u
+    cols = ["ret_1d", "score_ret", "score_pop", "core"] + [c for c in ("score_trend",) if c in u.columns]
+    return s.merge(u[[key] + cols], on=key, how="left")
 
-def market_regime(idx_df: pd.DataFrame):
+def market_regime(idx_df: pd.DataFrame, state=None, params=None):
     """
     idx_df: date,index_code,ret,volume,turnover  (支持所有主要指数)
+    state: regime.RegimeState（可选）。提供时用 EWMA 平滑的强弱差和波动率缩放阈值判断节奏，
+           并以 O(1) 更新状态；否则按当日强弱差和固定阈值判断
+    params: 覆盖 regime.REGIME_PARAMS（无状态时只用到 min_threshold）
     返回所有指数数据 + 市场判断指标
     """
+    from regime import REGIME_PARAMS, classify
+
     # 获取最新一天的数据
     latest_date = idx_df['date'].max()
     latest_data = idx_df[idx_df['date'] == latest_date]
@@ -61,13 +122,7 @@ def market_regime(idx_df: pd.DataFrame):
 
     broad_strength = float(hs300 - csi1000)
     risk_on = int([hs300, csi1000, shcomp].count(np.nan) == 0 and (np.array([hs300, csi1000, shcomp]) > 0).sum() >= 2)
-
-    if broad_strength > 0.002:
-        advice = "DEFENSE"
-    elif broad_strength < -0.002:
-        advice = "OFFENSE"
-    else:
-        advice = "NEUTRAL"
+    advice = classify(broad_strength, dict(REGIME_PARAMS, **(params or {}))['min_threshold'])
 
     # 返回所有指数数据（兼容旧代码的小写键名）
     result = {
@@ -76,6 +131,14 @@ def market_regime(idx_df: pd.DataFrame):
         "advice": advice
     }
 
+    if state is not None:
+        rets = {code: float(v) for code, v in piv.items() if code != "date" and pd.notna(v)}
+        regime = state.update(str(latest_date), rets)
+        result["advice"] = regime["advice"]
+        result["risk_on"] = regime["risk_on"]
+        result["spread_ewm"] = regime["spread_ewm"]
+        result["threshold"] = regime["threshold"]
+
     # 添加所有指数数据（包含OHLC、成交量和成交额）
     for _, row in latest_data.iterrows():
         index_code = row['index_code']
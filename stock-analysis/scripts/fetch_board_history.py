@@ -12,6 +12,8 @@ import os
 from datetime import datetime, timedelta
 from collections import defaultdict
 
+from archive_bundle import bundled_dates
+
 def fetch_board_wheel_history(days=10, top_n=20):
     """
     获取板块轮动历史数据（涨幅榜）
@@ -152,6 +154,7 @@ def save_to_archive(industry_history, concept_history, archive_dir):
     os.makedirs(archive_dir, exist_ok=True)
 
     all_dates = sorted(set(list(industry_history.keys()) + list(concept_history.keys())), reverse=True)
+    bundled = bundled_dates(archive_dir)
 
     saved_count = 0
     for date in all_dates:
@@ -211,8 +214,8 @@ def save_to_archive(industry_history, concept_history, archive_dir):
         # 保存到文件
         archive_file = os.path.join(archive_dir, f"{date}.json")
 
-        # 检查文件是否已存在
-        if os.path.exists(archive_file):
+        # 检查文件是否已存在（包括已合并到月度包的日期）
+        if os.path.exists(archive_file) or date in bundled:
             print(f"  ⏭️  {date}: 已存在，跳过")
             continue
 
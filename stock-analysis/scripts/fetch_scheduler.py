@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+抓取时间预算与优先级调度
+每5分钟一次的定时任务必须在下一次开始前结束。实时抓取阶段按时间预算执行：
+
+1. 板块列表和指数行情（页面和市场节奏的必需数据）最先请求
+2. 成分股按板块排名请求：上一轮未完成的板块优先，其余按类型内排名交替（行业第1、概念第1、行业第2……）
+3. 每个请求的超时不超过剩余预算；预算用完时停止发出新请求，已完成的部分照常发布
+4. 未完成的板块使用快照缓存（若未过期），并写入 store/fetch_queue.json，下一轮优先抓取
+
+每个板块成分股的来源记录在板块表的 stocks_source 列（live / retry / cache / deferred / failed），
+由 etl_daily 汇总为 daily.json 的 data_status.coverage
+"""
+import json
+import os
+import time
+from pathlib import Path
+
+# 实时抓取阶段的默认时间预算（秒），为后续阶段和下一次定时任务留出余量
+FETCH_BUDGET_SECONDS = 150
+
+# 单个请求的超时上限，以及预算将尽时仍值得发出请求的最短超时
+REQUEST_TIMEOUT = 10
+MIN_REQUEST_TIMEOUT = 1.0
+
+COVERAGE_COLUMN = 'stocks_source'
+
+
+class FetchBudget:
+    """从创建时开始计时的时间预算（seconds=None 表示不限时）"""
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.started = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        if self.seconds is None:
+            return float('inf')
+        return max(0.0, self.seconds - self.elapsed())
+
+    def expired(self):
+        """剩余时间不足以完成一个最短请求"""
+        return self.remaining() < MIN_REQUEST_TIMEOUT
+
+    def timeout(self, limit=REQUEST_TIMEOUT):
+        """下一个请求的超时：不超过剩余预算"""
+        return max(MIN_REQUEST_TIMEOUT, min(limit, self.remaining()))
+
+
+def load_queue(path):
+    """上一轮未完成的板块代码（按原优先级），不存在或损坏返回空列表"""
+    if not path or not Path(path).exists():
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return list(json.load(f).get('boards', []))
+    except (OSError, ValueError) as e:
+        print(f"⚠️  读取抓取队列失败: {e}")
+        return []
+
+
+def save_queue(path, board_codes):
+    """原子写入本轮未完成的板块（为空时写入空队列）"""
+    if not path:
+        return
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'boards': list(board_codes), 'saved_at': time.strftime('%Y-%m-%d %H:%M:%S')}, f,
+                  ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def prioritize(boards_df, queued=()):
+    """
+    成分股的请求顺序（板块代码列表）
+
+    上一轮未完成且仍在本轮列表中的板块优先，其余按类型内排名交替
+    （boards_df 中每种类型已按涨幅降序排列）
+    """
+    codes = boards_df['bk_code'].tolist()
+    if 'bk_type' in boards_df.columns:
+        rank = boards_df.groupby('bk_type', sort=False).cumcount().tolist()
+    else:
+        rank = list(range(len(codes)))
+    order = [code for _, _, code in sorted(zip(rank, range(len(codes)), codes))]
+    present = set(codes)
+    first = [c for c in dict.fromkeys(queued) if c in present]
+    taken = set(first)
+    return first + [c for c in order if c not in taken]
+
+
+def coverage(boards_df):
+    """
+    成分股覆盖情况
+
+    返回: {'boards': 板块数, 'live': n, 'retry': n, 'cache': n, 'deferred': [代码], 'failed': [代码]}，
+          板块表没有来源列（CSV/MOCK 模式或旧的原始数据）时返回 None
+    """
+    if boards_df is None or COVERAGE_COLUMN not in boards_df.columns:
+        return None
+    source = boards_df[COVERAGE_COLUMN].fillna('live')
+    result = {'boards': int(len(boards_df))}
+    for name in ('live', 'retry', 'cache'):
+        result[name] = int((source == name).sum())
+    for name in ('deferred', 'failed'):
+        result[name] = boards_df.loc[source == name, 'bk_code'].astype(str).tolist()
+    return result
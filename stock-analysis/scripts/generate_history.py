@@ -8,12 +8,14 @@ import os
 from datetime import date, timedelta
 from pathlib import Path
 from collections import defaultdict
+from index_registry import index_codes
 
 def load_archive(archive_dir, date_str):
-    """加载指定日期的存档数据"""
+    """加载指定日期的存档数据（单日文件优先，其次为月度包，见 archive_bundle.py）"""
     archive_file = Path(archive_dir) / f"{date_str}.json"
     if not archive_file.exists():
-        return None
+        from archive_bundle import load_bundled
+        return load_bundled(archive_dir, date_str)
 
     try:
         with open(archive_file, 'r', encoding='utf-8') as f:
@@ -22,6 +24,101 @@ def load_archive(archive_dir, date_str):
         print(f"⚠️  读取存档 {date_str} 失败: {e}")
         return None
 
+def list_archive_dates(archive_dir):
+    """存档目录中的所有交易日（单日文件 + 月度包索引，倒序，最新在前）"""
+    from archive_bundle import bundled_dates
+
+    archive_path = Path(archive_dir)
+    available = set(bundled_dates(archive_dir))
+
+    # 提取日期并过滤掉非日期格式的文件
+    for f in archive_path.glob("*.json"):
+        date_str = f.stem
+        try:
+            # 验证是否为有效的日期格式 YYYY-MM-DD
+            date.fromisoformat(date_str)
+            available.add(date_str)
+        except ValueError:
+            continue
+    return sorted(available, reverse=True)
+
+# 早期存档的节奏指数未按接口缩放（点位×100、涨跌幅为百分数）：
+# 点位超过该值，或没有点位且涨跌幅超过单日可能的幅度时视为旧格式
+LEGACY_INDEX_SCALE_CLOSE = 100000
+MAX_INDEX_DAILY_RET = 0.11
+
+
+def index_return(index_data):
+    """从存档的指数记录中取涨跌幅（小数），兼容旧存档的缩放问题"""
+    if not isinstance(index_data, dict) or index_data.get('ret') is None:
+        return None
+    ret = float(index_data['ret'])
+    close = float(index_data.get('close') or 0)
+    if close > LEGACY_INDEX_SCALE_CLOSE or (close == 0 and abs(ret) > MAX_INDEX_DAILY_RET):
+        ret /= 100.0
+    return ret
+
+
+def load_index_returns(archive_dir, dates=None, archives=None, store_dir=None):
+    """
+    读取存档中节奏指数的涨跌幅宽表
+
+    参数:
+        dates: 日期列表（默认全部存档）
+        archives: 已加载的 {date: data}，命中时不再读文件
+        store_dir: 数据存储目录，读取全部存档时从只读面板（panel.py）读取，不再逐个解析 JSON
+    返回:
+        DataFrame(index=date, columns=指数代码)
+    """
+    import pandas as pd
+
+    if store_dir is not None and dates is None:
+        from panel import open_panel
+        shared = open_panel(archive_dir, store_dir)
+        if shared is not None:
+            return shared.index_returns()
+
+    dates = sorted(dates if dates is not None else list_archive_dates(archive_dir))
+    archives = archives or {}
+    rows = {}
+    for date_str in dates:
+        data = archives.get(date_str) or load_archive(archive_dir, date_str)
+        if not data:
+            continue
+        indices = data.get('indices', {})
+        rows[date_str] = {code: index_return(indices.get(code)) for code in index_codes('indices')}
+    return pd.DataFrame.from_dict(rows, orient='index', dtype=float).sort_index()
+
+
+def generate_regime_history(archive_dir, archives=None, store_dir=None):
+    """
+    对全部存档一次向量化计算市场节奏序列
+
+    返回:
+        {"dates": [...], "spread": [...], "spread_ewm": [...], "vol": [...],
+         "threshold": [...], "breadth": [...], "risk_on": [...], "advice": [...]}
+    """
+    from regime import regime_series
+
+    ret_wide = load_index_returns(archive_dir, archives=archives, store_dir=store_dir)
+    if ret_wide.empty:
+        return None
+    series = regime_series(ret_wide)
+
+    def clean(values, digits=6):
+        return [None if v is None or v != v else round(float(v), digits) for v in values]
+
+    return {
+        'dates': series.index.tolist(),
+        'spread': clean(series['spread']),
+        'spread_ewm': clean(series['spread_ewm']),
+        'vol': clean(series['vol']),
+        'threshold': clean(series['threshold']),
+        'breadth': clean(series['breadth'], 4),
+        'risk_on': series['risk_on'].astype(bool).tolist(),
+        'advice': series['advice'].tolist(),
+    }
+
 def generate_main_indices_history(archives, dates):
     """
     生成主要指数的历史OHLC数据（从archive中读取）
@@ -41,7 +138,7 @@ def generate_main_indices_history(archives, dates):
     }
     """
     # 主要指数列表
-    main_index_codes = ['HS300', 'CSI500', 'CSI1000', 'CSI2000']
+    main_index_codes = index_codes('main')
 
     main_indices = {code: [] for code in main_index_codes}
 
@@ -96,7 +193,7 @@ def generate_market_indices_history(archives, dates):
     }
     """
     # 大盘指数列表
-    market_index_codes = ['SHCOMP', 'SZCOMP', 'CYBZ', 'KCB50', 'BJ50']
+    market_index_codes = index_codes('market')
 
     market_indices = {code: [] for code in market_index_codes}
 
@@ -131,204 +228,373 @@ def generate_market_indices_history(archives, dates):
     }
 
 
-def generate_main_indices_history_from_api(days=30):
+# K线输出字段（与 archive 生成的 OHLC 结构一致）
+KLINE_FIELDS = ['open', 'close', 'low', 'high', 'ret', 'volume']
+
+
+def fetch_index_klines(codes, days=30, max_workers=8):
     """
-    从东方财富API获取主要指数的真实历史K线数据
+    并发获取多个指数的K线数据
 
-    参数:
-        days: 获取最近N天的K线数据，默认30天
+    返回: {code: DataFrame 或 None}
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from eastmoney import fetch_index_kline
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(codes)))) as pool:
+        futures = {code: pool.submit(fetch_index_kline, code, days) for code in codes}
+        return {code: future.result() for code, future in futures.items()}
+
+
+def align_klines(klines, codes):
+    """
+    将多个指数的K线按日期并集对齐（一次外连接），直接输出每个指数的数组
 
     返回:
     {
-        "dates": ["2025-11-01", "2025-11-02", ...],
-        "main_indices": {
-            "HS300": [
-                {"open": 3200.5, "close": 3220.8, "low": 3195.2, "high": 3230.1, "ret": 0.006, "volume": 1800000},
-                ...
-            ],
-            "CSI500": [...],
-            "CSI1000": [...],
-            "CSI2000": [...]
-        }
+        "dates": [...],
+        "series": {code: [{"open": ..., "close": ..., ...} 或 None, ...]}
     }
+    没有任何有效数据时返回 None
     """
-    print(f"📊 从东方财富API获取主要指数历史K线数据（最近{days}天）...")
-    print("=" * 60)
-
-    try:
-        import sys
-        import os
-        # 添加scripts目录到路径
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        if script_dir not in sys.path:
-            sys.path.insert(0, script_dir)
-        from eastmoney import fetch_index_kline
-    except ImportError as e:
-        print(f"❌ 无法导入eastmoney模块: {e}")
-        return None
-
-    # 主要指数列表
-    main_index_codes = ['HS300', 'CSI500', 'CSI1000', 'CSI2000']
+    import pandas as pd
 
-    # 存储所有指数的K线数据
-    all_klines = {}
-    dates_set = set()
-
-    # 获取每个指数的K线数据
-    for code in main_index_codes:
-        df = fetch_index_kline(code, days=days)
+    frames = {}
+    for code in codes:
+        df = klines.get(code)
         if df is not None and not df.empty:
-            all_klines[code] = df
-            dates_set.update(df['date'].tolist())
-            print(f"  ✅ {code}: {len(df)} 条数据")
-        else:
-            print(f"  ⚠️  {code}: 获取失败")
-            all_klines[code] = None
+            frames[code] = (df.drop_duplicates('date', keep='last')
+                              .set_index('date')[KLINE_FIELDS]
+                              .astype(float))
 
-    if not dates_set:
-        print("❌ 没有获取到任何K线数据")
+    if not frames:
         return None
 
-    # 按日期排序
-    dates = sorted(list(dates_set))
-
-    # 组织数据结构
-    main_indices = {code: [] for code in main_index_codes}
-
-    for date_str in dates:
-        for code in main_index_codes:
-            if all_klines[code] is None:
-                main_indices[code].append(None)
-                continue
+    # 列为 (指数代码, 字段) 的宽表，索引为所有指数日期的并集
+    panel = pd.concat(frames, axis=1, join='outer').sort_index()
+    dates = panel.index.tolist()
 
-            # 查找该日期的数据
-            df = all_klines[code]
-            row = df[df['date'] == date_str]
-
-            if not row.empty:
-                data = row.iloc[0]
-                main_indices[code].append({
-                    'open': float(data['open']),
-                    'close': float(data['close']),
-                    'low': float(data['low']),
-                    'high': float(data['high']),
-                    'ret': float(data['ret']),
-                    'volume': float(data['volume'])
-                })
-            else:
-                main_indices[code].append(None)
+    series = {}
+    for code in codes:
+        if code not in frames:
+            series[code] = [None] * len(dates)
+            continue
+        block = panel[code]
+        records = block.to_dict('records')
+        missing = block.isna().any(axis=1).to_numpy()
+        series[code] = [None if miss else rec for rec, miss in zip(records, missing)]
 
-    print(f"\n✅ K线数据汇总:")
-    print(f"   日期范围: {dates[0]} ~ {dates[-1]}")
-    print(f"   总天数: {len(dates)}")
+    return {'dates': dates, 'series': series}
 
-    return {
-        'dates': dates,
-        'main_indices': main_indices
-    }
 
-def generate_market_indices_history_from_api(days=30):
+def generate_indices_history_from_api(days=30, groups=('main', 'market'), store_dir=None):
     """
-    从东方财富API获取大盘核心指数的真实历史K线数据
-    用于大盘看板展示（上证指数、深证成指、创业板指、科创50、北证50）
+    从东方财富API获取指数的真实历史K线数据（主要指数与大盘核心指数共用）
+    所有指数的K线并发获取，每个分组按自身日期并集对齐
 
     参数:
         days: 获取最近N天的K线数据，默认30天
+        groups: 指数注册表中的分组
+        store_dir: 给定时把获取到的K线合并进K线存储（技术指标使用更长的历史）
 
     返回:
     {
-        "dates": ["2025-10-12", "2025-10-13", ...],
-        "market_indices": {
-            "SHCOMP": [
-                {"open": 3200.5, "close": 3220.8, "low": 3195.2, "high": 3230.1, "ret": 0.006, "volume": 1800000},
+        "main": {
+            "dates": ["2025-11-01", "2025-11-02", ...],
+            "main_indices": {
+                "HS300": [
+                    {"open": 3200.5, "close": 3220.8, "low": 3195.2, "high": 3230.1, "ret": 0.006, "volume": 1800000},
+                    ...
+                ],
                 ...
-            ],
-            "SZCOMP": [...],
-            "CYBZ": [...],
-            "KCB50": [...],
-            "BJ50": [...]
+            }
+        },
+        "market": {
+            "dates": [...],
+            "market_indices": {"SHCOMP": [...], ...}
         }
     }
+    获取失败的分组值为 None
     """
-    print(f"📊 从东方财富API获取大盘核心指数历史K线数据（最近{days}天）...")
+    print(f"📊 从东方财富API并发获取指数历史K线数据（最近{days}天）...")
     print("=" * 60)
 
+    import sys
+    import os
+    # 添加scripts目录到路径
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)
+
+    group_codes = {group: index_codes(group) for group in groups}
+    all_codes = list(dict.fromkeys(code for codes in group_codes.values() for code in codes))
     try:
-        import sys
-        import os
-        # 添加scripts目录到路径
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        if script_dir not in sys.path:
-            sys.path.insert(0, script_dir)
-        from eastmoney import fetch_index_kline
+        klines = fetch_index_klines(all_codes, days=days)
     except ImportError as e:
         print(f"❌ 无法导入eastmoney模块: {e}")
-        return None
-
-    # 大盘核心指数列表
-    market_index_codes = ['SHCOMP', 'SZCOMP', 'CYBZ', 'KCB50', 'BJ50']
-
-    # 存储所有指数的K线数据
-    all_klines = {}
-    dates_set = set()
-
-    # 获取每个指数的K线数据
-    for code in market_index_codes:
-        df = fetch_index_kline(code, days=days)
+        return {group: None for group in groups}
+
+    store = None
+    if store_dir:
+        from kline_store import KlineStore, default_store_root
+        store = KlineStore(default_store_root(store_dir))
+    for code in all_codes:
+        df = klines[code]
         if df is not None and not df.empty:
-            all_klines[code] = df
-            dates_set.update(df['date'].tolist())
             print(f"  ✅ {code}: {len(df)} 条数据")
+            if store is not None:
+                store.write(code, df)
         else:
             print(f"  ⚠️  {code}: 获取失败")
-            all_klines[code] = None
 
-    if not dates_set:
-        print("❌ 没有获取到任何K线数据")
-        return None
+    result = {}
+    for group, codes in group_codes.items():
+        aligned = align_klines(klines, codes)
+        if aligned is None:
+            print(f"❌ {group}: 没有获取到任何K线数据")
+            result[group] = None
+            continue
 
-    # 按日期排序
-    dates = sorted(list(dates_set))
+        dates = aligned['dates']
+        print(f"\n✅ {group} K线数据汇总:")
+        print(f"   日期范围: {dates[0]} ~ {dates[-1]}")
+        print(f"   总天数: {len(dates)}")
+        result[group] = {'dates': dates, f'{group}_indices': aligned['series']}
 
-    # 组织数据结构
-    market_indices = {code: [] for code in market_index_codes}
+    return result
 
-    for date_str in dates:
-        for code in market_index_codes:
-            if all_klines[code] is None:
-                market_indices[code].append(None)
+def downsample_index_history(block, group_key):
+    """
+    指数K线块按距今远近降采样（最近为日线，更早为周线/月线），增加 periods 字段标记每根K线的粒度
+    不超过日线窗口或已降采样的块原样返回
+    """
+    import numpy as np
+    import pandas as pd
+    from downsample import FULL_RES_DAYS, lod_groups, resample_ohlc
+
+    dates = block.get('dates') or []
+    if 'periods' in block or len(dates) <= FULL_RES_DAYS:
+        return block
+    series = block[group_key]
+    codes = list(series)
+
+    def column(field):
+        return np.array([[rec.get(field, np.nan) if rec else np.nan for rec in series[code]] for code in codes],
+                        dtype=float).T.reshape(len(dates), len(codes))
+
+    group, periods = lod_groups(dates)
+    bars = {field: column(field) for field in ('open', 'high', 'low', 'close', 'volume')}
+    labels, agg = resample_ohlc(dates, bars, group)
+    # 区间涨跌幅按日涨跌幅复利
+    agg['ret'] = pd.DataFrame(1 + column('ret')).groupby(group).prod(min_count=1).to_numpy() - 1
+
+    out = {}
+    for c, code in enumerate(codes):
+        records = []
+        for g in range(len(labels)):
+            if agg['close'][g, c] != agg['close'][g, c]:
+                records.append(None)
                 continue
+            records.append({field: (None if agg[field][g, c] != agg[field][g, c] else float(agg[field][g, c]))
+                            for field in KLINE_FIELDS})
+        out[code] = records
+    print(f"📉 {group_key}: {len(dates)} 个交易日降采样为 {len(labels)} 根K线")
+    return dict(block, dates=labels, periods=periods, **{group_key: out})
 
-            # 查找该日期的数据
-            df = all_klines[code]
-            row = df[df['date'] == date_str]
 
-            if not row.empty:
-                data = row.iloc[0]
-                market_indices[code].append({
-                    'open': float(data['open']),
-                    'close': float(data['close']),
-                    'low': float(data['low']),
-                    'high': float(data['high']),
-                    'ret': float(data['ret']),
-                    'volume': float(data['volume'])
-                })
-            else:
-                market_indices[code].append(None)
+def downsample_regime(regime):
+    """节奏序列：最近部分保留原始点，更早部分按 spread_ewm 用 LTTB 选点（各字段取相同下标）"""
+    from downsample import lod_line_indices
 
-    print(f"\n✅ K线数据汇总:")
-    print(f"   日期范围: {dates[0]} ~ {dates[-1]}")
-    print(f"   总天数: {len(dates)}")
+    if not regime:
+        return regime
+    values = [v if v is not None else float('nan') for v in regime['spread_ewm']]
+    keep = lod_line_indices(values)
+    if len(keep) == len(values):
+        return regime
+    return {key: [seq[i] for i in keep] if isinstance(seq, list) else seq for key, seq in regime.items()}
 
-    return {
-        'dates': dates,
-        'market_indices': market_indices
+
+def apply_level_of_detail(history):
+    """把 history 中随历史变长的图表序列降采样，输出长度与历史长度无关"""
+    for key, group_key in (('main_indices_history', 'main_indices'), ('market_indices_history', 'market_indices')):
+        if history.get(key):
+            history[key] = downsample_index_history(history[key], group_key)
+    history['regime'] = downsample_regime(history.get('regime'))
+    return history
+
+
+# 板块K线图展示的交易日数（与页面一致）
+BOARD_KLINE_DAYS = 30
+
+# 指标输出的小数位
+INDICATOR_DIGITS = {'rsi': 2, 'dif': 3, 'dea': 3, 'macd': 3, 'vol_ma5': 0, 'vol_ma10': 0}
+
+
+def tracked_boards(history):
+    """页面可展开K线的板块 {code: name}（热门板块和最新一天的上榜板块）"""
+    boards = {}
+    for b in history.get('hot_boards', []):
+        boards[b['code']] = b['name']
+    for record in history.get('daily_records', [])[:1]:
+        for key in ('industry_boards', 'concept_boards'):
+            for b in record.get(key, []):
+                if b.get('code'):
+                    boards.setdefault(b['code'], b.get('name', ''))
+    return boards
+
+
+def load_store_bars(store_dir):
+    """K线存储中全部代码的 日期 × 代码 OHLCV 矩阵（供指标和相关性共用，只读取一次）"""
+    from indicators import load_bars
+    from kline_store import KlineStore, default_store_root
+
+    return load_bars(KlineStore(default_store_root(store_dir)))
+
+
+def attach_indicators(history, store_dir, board_days=BOARD_KLINE_DAYS, loaded=None):
+    """
+    用K线存储一次计算全部指数和板块的技术指标，写入 history（页面不再逐个请求和计算）：
+    - main_indices_history / market_indices_history 增加 indicators，按各自的日期对齐
+    - board_klines: 跟踪板块最近N个交易日的K线和指标
+
+    指标结果缓存在 store/indicators.npz，新增交易日时增量追加
+
+    参数:
+        loaded: load_store_bars 的结果（默认从K线存储读取）
+    """
+    import numpy as np
+    import pandas as pd
+    from indicators import compact, update_indicators
+
+    dates, codes, bars = loaded or load_store_bars(store_dir)
+    if not dates:
+        print("⚠️  K线存储为空，跳过技术指标")
+        return history
+    out = update_indicators(dates, codes, bars, Path(store_dir) / 'indicators.npz')
+    col = {code: i for i, code in enumerate(codes)}
+    pos = {d: i for i, d in enumerate(dates)}
+
+    def pick(values, rows, digits):
+        picked = np.where(rows >= 0, values[np.maximum(rows, 0)], np.nan)
+        return compact(picked, digits)
+
+    def indicator_block(code, rows):
+        c = col[code]
+        return {name: pick(out[name][:, c], rows, INDICATOR_DIGITS.get(name, 2)) for name in out}
+
+    for key, group in (('main_indices_history', 'main_indices'), ('market_indices_history', 'market_indices')):
+        block = history.get(key)
+        if not block:
+            continue
+        rows = np.array([pos.get(d, -1) for d in block['dates']])
+        block['indicators'] = {code: indicator_block(code, rows)
+                               for code in block.get(group, {}) if code in col}
+
+    # 板块：取跟踪板块有数据的最近N个交易日
+    boards = {code: name for code, name in tracked_boards(history).items() if code in col}
+    if boards:
+        ids = [col[code] for code in boards]
+        has_bar = np.isfinite(bars['close'][:, ids]).any(axis=1)
+        rows = np.flatnonzero(has_bar)[-board_days:]
+        prev_close = pd.DataFrame(bars['close']).ffill().shift().to_numpy(float)
+        board_klines = {'dates': [dates[t] for t in rows], 'boards': {}}
+        for code, name in boards.items():
+            c = col[code]
+            close = bars['close'][rows, c]
+            if not np.isfinite(close).any():
+                continue
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ret = close / prev_close[rows, c] - 1
+            board_klines['boards'][code] = {
+                'name': name,
+                'ohlc': [None if v is None else [o, v, l, h] for o, v, l, h in zip(
+                    compact(bars['open'][rows, c]), compact(close),
+                    compact(bars['low'][rows, c]), compact(bars['high'][rows, c]))],
+                'volume': compact(bars['volume'][rows, c], 0),
+                'ret': compact(ret, 4),
+                'indicators': indicator_block(code, rows),
+            }
+        history['board_klines'] = board_klines
+        print(f"✅ 板块K线: {len(board_klines['boards'])}/{len(tracked_boards(history))} 个板块，{len(rows)} 个交易日")
+    return history
+
+
+def history_board_names(history):
+    """history 中出现过的板块 {code: name}（热门板块和每日记录）"""
+    boards = {}
+    for b in history.get('hot_boards', []):
+        boards[b['code']] = b['name']
+    for record in history.get('daily_records', []):
+        for key in ('industry_boards', 'concept_boards'):
+            for b in record.get(key, []):
+                if b.get('code'):
+                    boards.setdefault(b['code'], b.get('name', ''))
+    return boards
+
+
+def attach_board_correlation(history, store_dir, window=None, loaded=None, top_k=20):
+    """
+    K线存储中全部板块的滚动相关矩阵，写入 history['board_correlation']：
+    - top_pairs: history 中出现过的板块之间相关系数最高的 top_k 对
+    - clusters: 相关系数 ≥ CLUSTER_CORR 连通的轮动簇，附簇内平均相关和最近5日平均收益
+
+    相关矩阵的成对累计量缓存在 store/board_corr.npz，新增交易日时增量更新
+    """
+    import numpy as np
+    from board_corr import CORR_WINDOW, clusters, top_pairs, update_correlation
+
+    dates, codes, bars = loaded or load_store_bars(store_dir)
+    ids = [i for i, code in enumerate(codes) if code.startswith('BK')]
+    if not dates or len(ids) < 2:
+        print("⚠️  K线存储中板块不足，跳过板块相关性")
+        return history
+    codes = [codes[i] for i in ids]
+    state = update_correlation(dates, codes, bars['close'][:, ids],
+                               Path(store_dir) / 'board_corr.npz', window or CORR_WINDOW)
+    corr = state.correlation()
+    col = {code: i for i, code in enumerate(codes)}
+    names = {code: name for code, name in history_board_names(history).items() if code in col}
+
+    recent = state.buffer[-5:]
+    out_clusters = []
+    for group in clusters(corr, codes, subset=names):
+        c = [col[code] for code in group]
+        sub = corr[np.ix_(c, c)][np.triu_indices(len(c), k=1)]
+        with np.errstate(invalid='ignore'):
+            ret = np.nanmean(np.nanmean(recent[:, c], axis=1)) if len(recent) else np.nan
+        out_clusters.append({
+            'boards': [{'code': code, 'name': names[code]} for code in group],
+            'avg_corr': round(float(np.nanmean(sub)), 3),
+            'ret_5d': None if ret != ret else round(float(ret) * 100, 2),
+        })
+
+    history['board_correlation'] = {
+        'window': state.window,
+        'as_of': state.dates[-1] if state.dates else None,
+        'boards': len(codes),
+        'top_pairs': [{'a': a, 'a_name': names[a], 'b': b, 'b_name': names[b], 'corr': round(v, 3)}
+                      for a, b, v in top_pairs(corr, codes, top_k, subset=names)],
+        'clusters': out_clusters,
     }
+    print(f"✅ 板块相关性: {len(names)} 个板块，{len(out_clusters)} 个轮动簇")
+    return history
 
 
-def generate_history(archive_dir, days=7):
+def attach_kline_analytics(history, store_dir, corr_window=None):
+    """读取一次K线存储，附加技术指标、板块K线和板块相关性"""
+    loaded = load_store_bars(store_dir)
+    attach_indicators(history, store_dir, loaded=loaded)
+    attach_board_correlation(history, store_dir, corr_window, loaded=loaded)
+    return history
+
+
+def generate_history(archive_dir, days=7, store_dir=None, corr_window=None, analytics=True):
     """
     生成最近N个交易日的历史趋势数据
+    窗口内的存档读取 JSON；给定 store_dir 时全部存档的节奏序列从只读面板读取，
+    并由K线存储附加技术指标、板块K线和板块相关性（attach_kline_analytics；
+    analytics=False 时由调用方在替换指数K线之后自行附加，避免计算两次）
 
     返回:
     {
@@ -348,7 +614,10 @@ def generate_history(archive_dir, days=7):
                 "name": "化学原料",
                 "trend": [0.027, 0.035, ...],  # 每日涨跌幅
                 "avg_score": 2.5,
-                "days_on_list": 5  # 连续上榜天数
+                "days_on_list": 5,  # 连续上榜天数
+                "appearances": 6,   # 窗口内上榜总天数
+                "current_streak": 5, "longest_streak": 8,
+                "first_seen": "2025-10-20", "last_seen": "2025-11-07"
             },
             ...
         ],
@@ -361,20 +630,8 @@ def generate_history(archive_dir, days=7):
     print(f"📊 生成最近 {days} 个交易日的历史趋势数据...")
     print("=" * 60)
 
-    # 获取存档目录中的所有可用日期（交易日）
-    archive_path = Path(archive_dir)
-    available_files = sorted(archive_path.glob("*.json"), reverse=True)  # 倒序排列
-
-    # 提取日期并过滤掉非日期格式的文件
-    all_dates = []
-    for f in available_files:
-        date_str = f.stem
-        try:
-            # 验证是否为有效的日期格式 YYYY-MM-DD
-            date.fromisoformat(date_str)
-            all_dates.append(date_str)
-        except ValueError:
-            continue
+    # 获取存档目录中的所有可用日期（交易日，倒序排列）
+    all_dates = list_archive_dates(archive_dir)
 
     # 取最近N个交易日
     dates = all_dates[:days]
@@ -400,7 +657,10 @@ def generate_history(archive_dir, days=7):
         print("\n❌ 无可用的历史数据")
         return None
 
-    # 提取市场趋势
+    # 市场节奏序列（全部存档一次向量化计算，只在 history['regime'] 中提供，用于展示节奏的连续变化）
+    regime = generate_regime_history(archive_dir, archives, store_dir)
+
+    # 提取市场趋势：使用存档记录的节奏，与 backtest.py / panel.py 读取的建议一致
     market_trend = []
     for date_str in dates:
         if date_str in archives:
@@ -409,39 +669,21 @@ def generate_history(archive_dir, days=7):
                 'date': date_str,
                 'advice': market.get('advice', 'NEUTRAL'),
                 'broad_strength': market.get('broad_strength', 0),
-                'risk_on': market.get('risk_on', False)
+                'risk_on': market.get('risk_on', False),
+                **{k: market[k] for k in ('spread_ewm', 'threshold') if k in market}
             })
 
-    # 提取指数趋势（支持5个新指数）
-    indices_trend = {
-        'CSI100': [],     # 中证100（超大盘）
-        'HS300': [],      # 沪深300（大盘）
-        'CSI500': [],     # 中证500（中盘）
-        'CSI1000': [],    # 中证1000（小盘）
-        'CSI2000': [],    # 中证2000（微盘）
-        'SHCOMP': [],     # 上证指数
-        # 保留旧的小写key用于兼容
-        'hs300': [],
-        'csi1000': [],
-        'shcomp': []
-    }
+    # 提取指数趋势（注册表中的节奏指数）
+    trend_codes = index_codes('indices')
+    # 保留旧的小写key用于兼容
+    legacy_codes = ['hs300', 'csi1000', 'shcomp']
+    indices_trend = {code: [] for code in trend_codes + legacy_codes}
 
     for date_str in dates:
         if date_str in archives:
             indices = archives[date_str].get('indices', {})
-
-            # 新的大写格式（优先使用）
-            indices_trend['CSI100'].append(indices.get('CSI100', {}).get('ret', None))
-            indices_trend['HS300'].append(indices.get('HS300', {}).get('ret', None))
-            indices_trend['CSI500'].append(indices.get('CSI500', {}).get('ret', None))
-            indices_trend['CSI1000'].append(indices.get('CSI1000', {}).get('ret', None))
-            indices_trend['CSI2000'].append(indices.get('CSI2000', {}).get('ret', None))
-            indices_trend['SHCOMP'].append(indices.get('SHCOMP', {}).get('ret', None))
-
-            # 旧的小写格式（向后兼容）
-            indices_trend['hs300'].append(indices.get('hs300', {}).get('ret', None))
-            indices_trend['csi1000'].append(indices.get('csi1000', {}).get('ret', None))
-            indices_trend['shcomp'].append(indices.get('shcomp', {}).get('ret', None))
+            for code in indices_trend:
+                indices_trend[code].append(indices.get(code, {}).get('ret', None))
         else:
             # 所有指数设为None
             for key in indices_trend.keys():
@@ -486,6 +728,10 @@ def generate_history(archive_dir, days=7):
             board_stats[code]['scores'].append(board.get('score', 0))
             board_stats[code]['dates'].append(date_str)
 
+    # 上榜位图索引：连续上榜天数、最长连续、首次/最近上榜
+    from appearance_index import load_appearance_index
+    appearance = load_appearance_index(archive_dir)
+
     # 计算热门板块（至少出现2天）
     hot_boards = []
     for code, stats in board_stats.items():
@@ -497,7 +743,12 @@ def generate_history(archive_dir, days=7):
                 'trend': stats['trend'],
                 'dates': stats['dates'],
                 'avg_score': round(avg_score, 2),
-                'days_on_list': len(stats['dates']),
+                'days_on_list': appearance.last_streak(code),  # 连续上榜天数
+                'appearances': len(stats['dates']),  # 窗口内上榜总天数
+                'current_streak': appearance.streak(code),
+                'longest_streak': appearance.longest_streak(code),
+                'first_seen': appearance.first_seen(code),
+                'last_seen': appearance.last_seen(code),
                 'avg_ret': round(sum(stats['trend']) / len(stats['trend']) * 100, 2)  # 平均涨幅(%)
             })
 
@@ -577,10 +828,11 @@ def generate_history(archive_dir, days=7):
     print(f"   热门板块: {len(hot_boards)} 个")
     print(f"   每日记录: {len(daily_records)} 天")
 
-    return {
+    history = {
         'dates': dates,
         'available_dates': list(archives.keys()),
         'market_trend': market_trend,
+        'regime': regime,  # 新增：全部存档的市场节奏序列
         'indices_trend': indices_trend,
         'main_indices_history': main_indices_history,  # 新增：主要指数历史OHLC数据
         'market_indices_history': market_indices_history,  # 新增：大盘指数历史OHLC数据
@@ -589,16 +841,23 @@ def generate_history(archive_dir, days=7):
         'daily_records': daily_records,  # 新增：每日详细数据
         'generated_at': date.today().isoformat()
     }
+    apply_level_of_detail(history)
+    if store_dir and analytics:
+        attach_kline_analytics(history, store_dir, corr_window)
+    return history
 
-def detect_new_boards(archive_dir, today_industry_boards=None, today_concept_boards=None, lookback_days=10):
+def detect_new_boards(archive_dir, today_industry_boards=None, today_concept_boards=None, lookback_days=10,
+                      today_date=None):
     """
     检测新上榜的板块（前N个交易日都未进入前10）
+    基于上榜位图索引，每个板块的判断为常数时间，不再逐个读取回溯期的存档
 
     参数:
         archive_dir: 存档目录
         today_industry_boards: 今天的行业板块列表（可选，如果提供则不从存档读取）
         today_concept_boards: 今天的概念板块列表（可选，如果提供则不从存档读取）
         lookback_days: 回溯天数，默认10个交易日
+        today_date: 今天的日期（默认系统日期，回放时由模拟时钟提供）
 
     返回:
         {
@@ -606,77 +865,28 @@ def detect_new_boards(archive_dir, today_industry_boards=None, today_concept_boa
             'concept': set(['BK0961', ...])     # 新上榜的概念板块代码
         }
     """
-    # 获取存档目录中的所有可用日期（交易日），按时间倒序
-    archive_path = Path(archive_dir)
-    available_files = sorted(archive_path.glob("*.json"), reverse=True)
+    from appearance_index import load_appearance_index
 
-    all_dates = []
-    for f in available_files:
-        date_str = f.stem
-        try:
-            date.fromisoformat(date_str)
-            all_dates.append(date_str)
-        except ValueError:
-            continue
+    index = load_appearance_index(archive_dir)
 
     # 获取今天的Top10板块（分类型）
-    today_industry = set()
-    today_concept = set()
-
     if today_industry_boards is not None and today_concept_boards is not None:
-        # 使用传入的今天的板块列表
+        # 使用传入的今天的板块列表（今天的数据还未存档或正在生成中，回溯期不含今天）
+        today_str = today_date or date.today().isoformat()
         today_industry = {b['code'] for b in today_industry_boards[:10]}
         today_concept = {b['code'] for b in today_concept_boards[:10]}
-    elif len(all_dates) > 0:
-        # 从存档中读取最新交易日的数据（用于向后兼容）
-        latest_date = all_dates[0]
-        today_data = load_archive(archive_dir, latest_date)
-        if not today_data:
-            return {'industry': set(), 'concept': set()}
-
-        if 'industry_boards' in today_data:
-            # 新格式
-            today_industry = {b['code'] for b in today_data.get('industry_boards', [])[:10]}
-            today_concept = {b['code'] for b in today_data.get('concept_boards', [])[:10]}
-        elif 'boards' in today_data:
-            # 旧格式兼容
-            for b in today_data.get('boards', [])[:10]:
-                if b.get('type') == 'concept':
-                    today_concept.add(b['code'])
-                else:
-                    today_industry.add(b['code'])
+    elif index.dates:
+        # 使用最新交易日的存档（用于向后兼容）
+        today_str = index.dates[-1]
+        t = index.pos[today_str]
+        today_industry = {c for c, e in index.boards['industry'].items() if e['bits'] >> t & 1}
+        today_concept = {c for c, e in index.boards['concept'].items() if e['bits'] >> t & 1}
     else:
         return {'industry': set(), 'concept': set()}
 
-    # 统计过去N个交易日出现在Top10的板块
-    historical_industry = set()
-    historical_concept = set()
-
-    # 取过去N个交易日（排除今天，从存档中的所有日期开始）
-    # 如果传入了today_boards，说明今天的数据还未存档或正在生成中
-    # 需要排除今天的日期（如果存在于存档中）
-    today_str = date.today().isoformat()
-    past_dates = [d for d in all_dates if d != today_str][:lookback_days]
-
-    for past_date_str in past_dates:
-        past_data = load_archive(archive_dir, past_date_str)
-
-        if past_data:
-            if 'industry_boards' in past_data:
-                # 新格式
-                historical_industry.update(b['code'] for b in past_data.get('industry_boards', [])[:10])
-                historical_concept.update(b['code'] for b in past_data.get('concept_boards', [])[:10])
-            elif 'boards' in past_data:
-                # 旧格式
-                for b in past_data.get('boards', [])[:10]:
-                    if b.get('type') == 'concept':
-                        historical_concept.add(b['code'])
-                    else:
-                        historical_industry.add(b['code'])
-
     # 找出新上榜的板块（今天在Top10，但过去N天都不在）
-    new_industry = today_industry - historical_industry
-    new_concept = today_concept - historical_concept
+    new_industry = index.new_boards('industry', today_industry, lookback_days, before=today_str)
+    new_concept = index.new_boards('concept', today_concept, lookback_days, before=today_str)
 
     if new_industry or new_concept:
         print(f"\n🆕 检测到新上榜板块（前{lookback_days}个交易日未进入前10）:")
@@ -704,32 +914,70 @@ def main():
     ap.add_argument('--out', default='site/data/history.json', help='输出文件')
     ap.add_argument('--use-api', action='store_true', help='使用东方财富API获取真实K线数据（而不是从archive读取）')
     ap.add_argument('--kline-days', type=int, default=30, help='获取K线数据的天数（当--use-api时使用）')
+    ap.add_argument('--store-dir', default=None, help='数据存储目录（只读面板，默认与存档目录同级的 store）')
+    ap.add_argument('--no-panel', action='store_true', help='不使用只读面板和K线存储，逐个读取存档 JSON')
+    ap.add_argument('--fetch-klines', action='store_true',
+                    help='把K线落后于上一交易日的页面展示板块加入回填队列（由 etl_daily 的回填预算抓取，每天一次）')
+    ap.add_argument('--corr-window', type=int, default=None, help='板块滚动相关性的窗口天数（默认20）')
     args = ap.parse_args()
 
-    history = generate_history(args.archive_dir, args.days)
+    store_dir = None if args.no_panel else (args.store_dir or str(Path(args.archive_dir).parent / 'store'))
+    # 技术指标和板块相关性在指数K线替换之后只计算一次
+    history = generate_history(args.archive_dir, args.days, store_dir, args.corr_window, analytics=False)
 
     if history:
+        # K线请求经镜像主机池对冲，主机延迟样本与 etl_daily 共用
+        stats_path = Path(store_dir) / 'host_stats.json' if store_dir else None
+        if stats_path and args.use_api:
+            from host_pool import load_stats
+            load_stats(stats_path)
+
         # 如果使用API获取K线数据，替换main_indices_history
         if args.use_api:
             print("\n" + "=" * 60)
             print("🔄 使用东方财富API获取真实K线数据...")
 
-            # 获取主要指数K线数据
-            main_indices_history_api = generate_main_indices_history_from_api(days=args.kline_days)
+            # 一次并发获取主要指数与大盘核心指数K线数据
+            api_history = generate_indices_history_from_api(days=args.kline_days, store_dir=store_dir)
+
+            main_indices_history_api = api_history.get('main')
             if main_indices_history_api:
                 history['main_indices_history'] = main_indices_history_api
                 print("✅ 成功替换主要指数为真实K线数据")
             else:
                 print("⚠️  主要指数API获取失败，使用archive数据")
 
-            # 获取大盘核心指数K线数据
-            market_indices_history_api = generate_market_indices_history_from_api(days=args.kline_days)
+            market_indices_history_api = api_history.get('market')
             if market_indices_history_api:
                 history['market_indices_history'] = market_indices_history_api
                 print("✅ 成功获取大盘指数真实K线数据")
             else:
                 print("⚠️  大盘指数API获取失败")
 
+        if stats_path and args.use_api:
+            from host_pool import report, save_stats
+            report()
+            save_stats(stats_path)
+
+        # 板块K线不在每5分钟的定时任务中串行抓取：落后的板块交给回填队列，
+        # 由 etl_daily 用抓取预算的剩余部分或收盘后的回填执行
+        if store_dir and args.fetch_klines:
+            from backfill_queue import PRIORITY, BackfillQueue, default_queue_path, enqueue_board_klines
+            codes = sorted(tracked_boards(history))
+            queue = BackfillQueue(default_queue_path(store_dir))
+            try:
+                count = enqueue_board_klines(queue, codes, store_dir, priority=PRIORITY['board_kline'] + 30,
+                                             days=BOARD_KLINE_DAYS * 4)
+            finally:
+                queue.close()
+            print(f"\n📥 {len(codes)} 个跟踪板块中 {count} 个K线落后，已加入回填队列")
+
+        # 指数K线被替换时重新降采样，再附加技术指标
+        if args.use_api:
+            apply_level_of_detail(history)
+        if store_dir:
+            attach_kline_analytics(history, store_dir, args.corr_window)
+
         save_history(history, args.out)
 
         print("\n" + "=" * 60)
@@ -742,7 +990,7 @@ def main():
             mih = history['main_indices_history']
             print(f"  日期范围: {mih['dates'][0]} ~ {mih['dates'][-1]}")
             print(f"  总天数: {len(mih['dates'])}")
-            for code in ['HS300', 'CSI500', 'CSI1000', 'CSI2000']:
+            for code in index_codes('main'):
                 if code in mih['main_indices']:
                     valid_count = sum(1 for x in mih['main_indices'][code] if x is not None)
                     print(f"  {code}: {valid_count}/{len(mih['dates'])} 条有效数据")
@@ -752,7 +1000,7 @@ def main():
             mih = history['market_indices_history']
             print(f"  日期范围: {mih['dates'][0]} ~ {mih['dates'][-1]}")
             print(f"  总天数: {len(mih['dates'])}")
-            for code in ['SHCOMP', 'SZCOMP', 'CYBZ', 'KCB50', 'BJ50']:
+            for code in index_codes('market'):
                 if code in mih['market_indices']:
                     valid_count = sum(1 for x in mih['market_indices'][code] if x is not None)
                     print(f"  {code}: {valid_count}/{len(mih['dates'])} 条有效数据")
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+东方财富镜像主机池（对冲请求）
+同一类接口可由多个主机提供（行情: push2 / push2delay；K线: push2his / push2delay / push2），
+单个主机偶发的长尾延迟会拖慢整次串行抓取。每类接口一个主机池：
+
+- 按观测到的延迟中位数给主机排序，请求先发往最快的主机
+- 该主机超过自身 p90 延迟仍未返回时，向下一个主机发出对冲请求，取最先返回的有效结果，
+  关闭另一个请求的连接；被取消的请求只知道延迟不小于已等待时长，按 max(已等待时长, 该主机 p90) 计入样本
+  （p90 未知时不计入），避免刚发出就被取消的对冲请求把备选主机的延迟估得过低
+- 连续请求失败（超时、连接错误、HTTP 错误）DEMOTE_FAILURES 次的主机降级 DEMOTE_SECONDS 秒，
+  延迟中位数超过最快主机 SLOW_FACTOR 倍的主机排在最后
+- 延迟样本可持久化（store/host_stats.json），跨次运行保留 p90 估计
+
+push2delay 的实时行情可能有延迟，只在主主机变慢或失败时作为对冲备选：
+每类接口的备选主机（不在 PRIMARY_HOSTS 中）只有在全部主主机降级时才排在第一
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+import requests
+
+# 各类接口的主机（按默认优先级）
+HOST_FAMILIES = {
+    'quote': ['push2.eastmoney.com', 'push2delay.eastmoney.com'],
+    'kline': ['push2his.eastmoney.com', 'push2delay.eastmoney.com', 'push2.eastmoney.com'],
+}
+
+# 各类接口可作为首选的主机；其余主机只作对冲备选
+PRIMARY_HOSTS = {
+    'quote': ['push2.eastmoney.com'],
+    'kline': ['push2his.eastmoney.com', 'push2.eastmoney.com'],
+}
+
+# 每个主机保留的延迟样本数；样本少于 MIN_SAMPLES 时使用默认对冲等待
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 10
+DEFAULT_HEDGE_DELAY = 1.0
+MIN_HEDGE_DELAY = 0.05
+
+DEMOTE_FAILURES = 2
+DEMOTE_SECONDS = 120
+SLOW_FACTOR = 3.0
+
+# 没有样本的主机按配置顺序给一个先验延迟
+PRIOR_LATENCY = 0.5
+
+
+class HostStats:
+    """单个主机的延迟样本和失败计数"""
+
+    def __init__(self, latencies=()):
+        self.latencies = deque(latencies, maxlen=LATENCY_WINDOW)
+        self.failures = 0
+        self.demoted_until = 0.0
+        self.requests = 0
+        self.wins = 0
+
+    def quantile(self, q):
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        return float(np.quantile(np.fromiter(self.latencies, float), q))
+
+
+class HostPool:
+    """一类接口的镜像主机池"""
+
+    def __init__(self, family, hosts, max_workers=16, primary=None):
+        self.family = family
+        self.hosts = list(hosts)
+        self.primary = set(self.hosts if primary is None else primary)
+        self.stats = {h: HostStats() for h in self.hosts}
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"hedge-{family}")
+
+    # ---------- 主机排序 ----------
+
+    def ranked(self):
+        """主机按 (是否降级, 是否备选主机, 是否明显偏慢, 延迟中位数) 排序"""
+        now = time.monotonic()
+        with self._lock:
+            p50 = {h: self.stats[h].quantile(0.5) for h in self.hosts}
+            measured = [v for v in p50.values() if v is not None]
+            best = min(measured) if measured else None
+
+            def key(item):
+                i, h = item
+                s = self.stats[h]
+                latency = p50[h] if p50[h] is not None else PRIOR_LATENCY * (i + 1)
+                slow = best is not None and p50[h] is not None and p50[h] > SLOW_FACTOR * best
+                return (s.demoted_until > now, h not in self.primary, slow, latency)
+
+            return [h for _, h in sorted(enumerate(self.hosts), key=key)]
+
+    def hedge_delay(self, host, timeout):
+        """主请求等待多久后发出对冲请求：该主机的 p90 延迟"""
+        with self._lock:
+            p90 = self.stats[host].quantile(0.9)
+        delay = DEFAULT_HEDGE_DELAY if p90 is None else p90
+        return min(max(delay, MIN_HEDGE_DELAY), timeout)
+
+    def _record(self, host, latency, ok, won=False):
+        with self._lock:
+            s = self.stats[host]
+            s.requests += 1
+            if latency is not None:
+                s.latencies.append(latency)
+            if ok:
+                s.failures = 0
+                s.wins += int(won)
+            else:
+                s.failures += 1
+                if s.failures >= DEMOTE_FAILURES:
+                    s.demoted_until = time.monotonic() + DEMOTE_SECONDS
+
+    # ---------- 请求 ----------
+
+    @staticmethod
+    def _attempt(session, host, path, params, headers, timeout):
+        started = time.monotonic()
+        response = session.get(f"https://{host}{path}", params=params, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        return response.json(), time.monotonic() - started
+
+    def get_json(self, path, params=None, headers=None, timeout=10, validate=None):
+        """
+        对冲请求：先发往排名第一的主机，超过其 p90 未返回时向下一个主机再发一次，取最先返回的有效结果
+        某个主机失败或返回无效结果时立即改发下一个主机
+
+        参数:
+            validate: 判断 JSON 是否有效的函数（默认只要求是对象）
+        返回: 解析后的 JSON；全部主机都没有有效结果时返回最后一个无效结果，都失败则抛出最后的异常
+        """
+        validate = validate or (lambda data: isinstance(data, dict))
+        pending = self.ranked()
+        futures, sessions, launched = {}, [], {}
+
+        def launch():
+            host = pending.pop(0)
+            session = requests.Session()
+            sessions.append(session)
+            future = self._executor.submit(self._attempt, session, host, path, params, headers, timeout)
+            futures[future] = host
+            launched[future] = time.monotonic()
+            return host
+
+        primary = launch()
+        wait_for = self.hedge_delay(primary, timeout)
+        fallback, last_error = None, None
+        try:
+            while futures:
+                done, _ = wait(futures, timeout=wait_for if pending else None, return_when=FIRST_COMPLETED)
+                if not done:
+                    # 在途请求都慢于 p90：向下一个主机发出对冲请求
+                    host = launch()
+                    with self._lock:
+                        self.hedges += 1
+                    wait_for = self.hedge_delay(host, timeout)
+                    continue
+                for future in done:
+                    host = futures.pop(future)
+                    try:
+                        data, latency = future.result()
+                    except Exception as e:
+                        self._record(host, None, ok=False)
+                        last_error = e
+                        continue
+                    # 无效结果（如代码不存在）不算主机故障，但继续尝试下一个主机
+                    self._record(host, latency, ok=True, won=validate(data))
+                    if validate(data):
+                        return data
+                    fallback = data
+                if not futures and pending:
+                    launch()
+        finally:
+            # 取消落后的请求：未开始的直接取消，进行中的关闭连接；
+            # 已等待时长只是延迟的下限，至少按该主机的 p90 计入样本
+            now = time.monotonic()
+            for future, host in futures.items():
+                future.cancel()
+                with self._lock:
+                    p90 = self.stats[host].quantile(0.9)
+                self._record(host, None if p90 is None else max(now - launched[future], p90), ok=True)
+            for session in sessions:
+                session.close()
+
+        if fallback is not None:
+            return fallback
+        raise last_error or requests.exceptions.RequestException(f"{self.family} 主机池没有可用主机")
+
+    # ---------- 统计 ----------
+
+    def summary(self):
+        with self._lock:
+            return {h: {'p50': s.quantile(0.5), 'p90': s.quantile(0.9), 'requests': s.requests,
+                        'wins': s.wins, 'failures': s.failures} for h, s in self.stats.items()}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_loaded = set()
+
+
+def pool(family):
+    """获取（必要时创建）一类接口的主机池"""
+    with _pools_lock:
+        if family not in _pools:
+            _pools[family] = HostPool(family, HOST_FAMILIES[family], primary=PRIMARY_HOSTS.get(family))
+        return _pools[family]
+
+
+def get_json(family, path, params=None, headers=None, timeout=10, validate=None):
+    """通过主机池发出对冲请求（见 HostPool.get_json）"""
+    return pool(family).get_json(path, params, headers, timeout, validate)
+
+
+def load_stats(path):
+    """加载持久化的延迟样本，不存在或损坏时忽略（同一进程内每个文件只加载一次）"""
+    path = Path(path)
+    if not path.exists() or path.resolve() in _loaded:
+        return
+    _loaded.add(path.resolve())
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  读取主机延迟统计失败: {e}")
+        return
+    for family, hosts in saved.items():
+        if family not in HOST_FAMILIES:
+            continue
+        p = pool(family)
+        with p._lock:
+            for host, latencies in hosts.items():
+                if host in p.stats:
+                    p.stats[host].latencies.extend(latencies)
+
+
+def save_stats(path):
+    """原子写入各主机最近的延迟样本"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _pools_lock:
+        pools = list(_pools.values())
+    data = {}
+    for p in pools:
+        with p._lock:
+            data[p.family] = {h: [round(x, 4) for x in s.latencies] for h, s in p.stats.items()}
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def report():
+    """打印各主机池的延迟和对冲统计"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for p in pools:
+        parts = []
+        for host, s in p.summary().items():
+            if not s['requests']:
+                continue
+            p50 = f"{s['p50'] * 1000:.0f}ms" if s['p50'] is not None else '-'
+            p90 = f"{s['p90'] * 1000:.0f}ms" if s['p90'] is not None else '-'
+            parts.append(f"{host.split('.')[0]} p50 {p50} p90 {p90} 胜出 {s['wins']}/{s['requests']}")
+        if parts:
+            print(f"  [主机池 {p.family}] 对冲 {p.hedges} 次；" + "；".join(parts))
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+指数注册表
+所有跟踪的指数在此登记一次：代码、中文名、东方财富 secid 和所属分组
+新增指数只需增加一条记录，行情抓取、K线抓取和历史生成都从这里读取
+
+分组:
+    indices  - 市场节奏判断用指数（daily.json 的 indices 字段）
+    main     - 主要指数K线看板（history.json 的 main_indices_history）
+    market   - 大盘核心指数看板（daily.json 的 market_indices 字段及 market_indices_history）
+"""
+
+INDEX_REGISTRY = [
+    # secid 格式: 市场代码.指数代码（1=上海, 0=深圳/北京, 2=中证）
+    {'code': 'CSI100',  'name': '中证100',  'secid': '1.000903', 'groups': ('indices',)},
+    {'code': 'HS300',   'name': '沪深300',  'secid': '1.000300', 'groups': ('indices', 'main')},
+    {'code': 'CSI500',  'name': '中证500',  'secid': '1.000905', 'groups': ('indices', 'main')},
+    {'code': 'CSI1000', 'name': '中证1000', 'secid': '1.000852', 'groups': ('indices', 'main')},
+    {'code': 'CSI2000', 'name': '中证2000', 'secid': '2.932000', 'groups': ('indices', 'main')},
+    {'code': 'SHCOMP',  'name': '上证指数', 'secid': '1.000001', 'groups': ('indices', 'market')},
+    {'code': 'SZCOMP',  'name': '深证成指', 'secid': '0.399001', 'groups': ('market',)},
+    {'code': 'CYBZ',    'name': '创业板指', 'secid': '0.399006', 'groups': ('market',)},
+    {'code': 'KCB50',   'name': '科创50',   'secid': '1.000688', 'groups': ('market',)},
+    {'code': 'BJ50',    'name': '北证50',   'secid': '0.899050', 'groups': ('market',)},
+]
+
+INDEX_BY_CODE = {entry['code']: entry for entry in INDEX_REGISTRY}
+
+# 东方财富行情代码（secid 去掉市场前缀）-> 我们的代码
+INDEX_BY_EM_CODE = {entry['secid'].split('.', 1)[1]: entry for entry in INDEX_REGISTRY}
+
+
+def index_codes(group):
+    """返回指定分组的指数代码（按注册顺序）"""
+    return [entry['code'] for entry in INDEX_REGISTRY if group in entry['groups']]
+
+
+def index_name(code):
+    """指数中文名称"""
+    entry = INDEX_BY_CODE.get(code)
+    return entry['name'] if entry else code
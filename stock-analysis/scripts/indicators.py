@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+技术指标引擎
+对 日期 × 代码 的K线矩阵一次性计算全部指数和板块的技术指标：
+    MA5/10/20/60、MACD(12,26,9)、RSI14、ATR14、布林带(20,2)、成交量 MA5/10
+
+- 全量计算按列向量化（滚动窗口 / 指数平滑均由 pandas 在整张宽表上完成）
+- 追加一根K线时只用保存的状态（最近窗口 + 各平滑值）更新最后一行，不重算历史
+- 状态和结果缓存在 store/indicators.npz，输入前缀未变时只追加新的交易日
+
+约定（与国内行情软件一致）：
+- EMA/平滑均值以第一条有效数据为初值，停牌（NaN）日沿用前值
+- RSI、ATR 使用 Wilder 平滑（alpha=1/N），有效数据不足 N 条时为 NaN
+- MACD 柱 = 2 × (DIF - DEA)；布林带标准差为总体标准差
+"""
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+INDICATOR_PARAMS = {
+    'ma': (5, 10, 20, 60),
+    'vol_ma': (5, 10),
+    'macd': (12, 26, 9),
+    'rsi': 14,
+    'atr': 14,
+    'boll': (20, 2),
+}
+
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+
+def _alpha_span(span):
+    return 2.0 / (span + 1)
+
+
+def _ewm(df, alpha):
+    """指数平滑（adjust=False，跳过 NaN 并沿用前值）"""
+    return df.ewm(alpha=alpha, adjust=False, ignore_na=True).mean()
+
+
+def _ewm_step(prev, x, alpha):
+    """指数平滑追加一步，与 _ewm 的约定一致"""
+    out = np.where(np.isnan(prev), x, (1 - alpha) * prev + alpha * x)
+    return np.where(np.isnan(x), prev, out)
+
+
+class IndicatorEngine:
+    """
+    一组代码的技术指标
+
+    compute(bars) 全量计算并记录状态；append(bar) 追加一个交易日
+    bars: {field: ndarray(日期, 代码)}；bar: {field: ndarray(代码)}
+    """
+
+    def __init__(self, params=None):
+        self.params = dict(INDICATOR_PARAMS, **(params or {}))
+        p = self.params
+        self.window = max(max(p['ma']), max(p['vol_ma']), p['boll'][0])
+        self.state = None
+
+    def names(self):
+        p = self.params
+        return ([f'ma{n}' for n in p['ma']] + ['dif', 'dea', 'macd', 'rsi', 'atr',
+                'boll_mid', 'boll_up', 'boll_low'] + [f'vol_ma{n}' for n in p['vol_ma']])
+
+    # ---------- 全量 ----------
+
+    def compute(self, bars):
+        p = self.params
+        close = pd.DataFrame(bars['close'], dtype=float)
+        volume = pd.DataFrame(bars['volume'], dtype=float)
+        high = pd.DataFrame(bars['high'], dtype=float)
+        low = pd.DataFrame(bars['low'], dtype=float)
+        out = {}
+
+        for n in p['ma']:
+            out[f'ma{n}'] = close.rolling(n).mean()
+        for n in p['vol_ma']:
+            out[f'vol_ma{n}'] = volume.rolling(n).mean()
+
+        fast, slow, signal = p['macd']
+        ema_fast = _ewm(close, _alpha_span(fast))
+        ema_slow = _ewm(close, _alpha_span(slow))
+        dif = ema_fast - ema_slow
+        dea = _ewm(dif, _alpha_span(signal))
+        out['dif'], out['dea'], out['macd'] = dif, dea, 2 * (dif - dea)
+
+        # 相对上一个有效收盘价的变化（停牌日为 NaN）
+        prev_close = close.ffill().shift()
+        delta = close - prev_close
+        gain = _ewm(delta.clip(lower=0), 1.0 / p['rsi'])
+        loss = _ewm((-delta).clip(lower=0), 1.0 / p['rsi'])
+        n_delta = delta.notna().cumsum()
+        out['rsi'] = self._rsi(gain, loss).where(n_delta >= p['rsi'])
+
+        tr = pd.DataFrame(np.fmax(high - low, np.fmax((high - prev_close).abs(), (low - prev_close).abs())))
+        tr = tr.where(close.notna())
+        atr = _ewm(tr, 1.0 / p['atr'])
+        n_tr = tr.notna().cumsum()
+        out['atr'] = atr.where(n_tr >= p['atr'])
+
+        n, k = p['boll']
+        mid = close.rolling(n).mean()
+        std = close.rolling(n).std(ddof=0)
+        out['boll_mid'], out['boll_up'], out['boll_low'] = mid, mid + k * std, mid - k * std
+
+        self.state = {
+            'close_tail': self._tail(close.to_numpy()),
+            'volume_tail': self._tail(volume.to_numpy()),
+            'last_close': close.ffill().iloc[-1].to_numpy() if len(close) else np.full(close.shape[1], np.nan),
+            'ema_fast': self._last(ema_fast), 'ema_slow': self._last(ema_slow), 'dea': self._last(dea),
+            'gain': self._last(gain), 'loss': self._last(loss), 'atr': self._last(atr),
+            'n_delta': self._last(n_delta, 0), 'n_tr': self._last(n_tr, 0),
+        }
+        return {name: out[name].to_numpy(float) for name in self.names()}
+
+    def _tail(self, values):
+        tail = np.full((self.window, values.shape[1]), np.nan)
+        if len(values):
+            rows = values[-self.window:]
+            tail[-len(rows):] = rows
+        return tail
+
+    @staticmethod
+    def _last(df, fill=np.nan):
+        return df.iloc[-1].to_numpy(float) if len(df) else np.full(df.shape[1], fill)
+
+    @staticmethod
+    def _rsi(gain, loss):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = 100 - 100 / (1 + gain / loss)
+        return rsi.where(loss != 0, 100.0).where(gain.notna() & loss.notna())
+
+    # ---------- 增量 ----------
+
+    def append(self, bar):
+        """追加一个交易日，返回 {指标: ndarray(代码)}"""
+        p, s = self.params, self.state
+        close, volume = np.asarray(bar['close'], float), np.asarray(bar['volume'], float)
+        high, low = np.asarray(bar['high'], float), np.asarray(bar['low'], float)
+        s['close_tail'] = np.vstack([s['close_tail'][1:], close])
+        s['volume_tail'] = np.vstack([s['volume_tail'][1:], volume])
+        out = {}
+
+        # 窗口内有 NaN 时结果为 NaN，与 rolling 一致
+        for n in p['ma']:
+            out[f'ma{n}'] = s['close_tail'][-n:].mean(axis=0)
+        for n in p['vol_ma']:
+            out[f'vol_ma{n}'] = s['volume_tail'][-n:].mean(axis=0)
+
+        fast, slow, signal = p['macd']
+        s['ema_fast'] = _ewm_step(s['ema_fast'], close, _alpha_span(fast))
+        s['ema_slow'] = _ewm_step(s['ema_slow'], close, _alpha_span(slow))
+        dif = s['ema_fast'] - s['ema_slow']
+        s['dea'] = _ewm_step(s['dea'], dif, _alpha_span(signal))
+        out['dif'], out['dea'], out['macd'] = dif, s['dea'], 2 * (dif - s['dea'])
+
+        prev_close = s['last_close']
+        delta = close - prev_close
+        s['gain'] = _ewm_step(s['gain'], np.where(np.isnan(delta), np.nan, np.maximum(delta, 0)), 1.0 / p['rsi'])
+        s['loss'] = _ewm_step(s['loss'], np.where(np.isnan(delta), np.nan, np.maximum(-delta, 0)), 1.0 / p['rsi'])
+        s['n_delta'] = s['n_delta'] + ~np.isnan(delta)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = np.where(s['loss'] != 0, 100 - 100 / (1 + s['gain'] / s['loss']), 100.0)
+        rsi = np.where(np.isnan(s['gain']) | np.isnan(s['loss']), np.nan, rsi)
+        out['rsi'] = np.where(s['n_delta'] >= p['rsi'], rsi, np.nan)
+
+        tr = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+        tr = np.where(np.isnan(close), np.nan, tr)
+        s['atr'] = _ewm_step(s['atr'], tr, 1.0 / p['atr'])
+        s['n_tr'] = s['n_tr'] + ~np.isnan(tr)
+        out['atr'] = np.where(s['n_tr'] >= p['atr'], s['atr'], np.nan)
+        s['last_close'] = np.where(np.isnan(close), prev_close, close)
+
+        n, k = p['boll']
+        window = s['close_tail'][-n:]
+        mid = window.mean(axis=0)
+        std = window.std(axis=0)
+        out['boll_mid'], out['boll_up'], out['boll_low'] = mid, mid + k * std, mid - k * std
+        return {name: out[name] for name in self.names()}
+
+
+# ---------- 缓存 ----------
+
+def _digest(bars, rows):
+    """前 rows 个交易日输入的哈希"""
+    h = hashlib.sha256()
+    for field in BAR_FIELDS:
+        h.update(np.ascontiguousarray(bars[field][:rows]).tobytes())
+    return h.hexdigest()[:16]
+
+
+def update_indicators(dates, codes, bars, cache_path=None, params=None):
+    """
+    计算 dates × codes 的全部指标，缓存可用时只追加新的交易日
+
+    缓存可用的条件：代码表和参数相同、缓存的日期是 dates 的前缀、且这部分输入未变
+    （盘中K线会被收盘数据覆盖，此时全量重算）
+
+    返回: {指标: ndarray(日期, 代码)}
+    """
+    engine = IndicatorEngine(params)
+    names = engine.names()
+    cached = None
+    if cache_path and Path(cache_path).exists():
+        try:
+            with np.load(cache_path, allow_pickle=False) as z:
+                cached = {key: z[key] for key in z.files}
+        except (OSError, ValueError) as e:
+            print(f"⚠️  指标缓存损坏，全量计算: {e}")
+
+    start = 0
+    if cached is not None:
+        old_dates = list(cached['dates'])
+        if (list(cached['codes']) == list(codes) and str(cached['params']) == repr(engine.params)
+                and 0 < len(old_dates) <= len(dates) and dates[:len(old_dates)] == old_dates
+                and str(cached['digest']) == _digest(bars, len(old_dates))):
+            start = len(old_dates)
+
+    if start:
+        engine.state = {key[len('state_'):]: cached[key] for key in cached if key.startswith('state_')}
+        out = {name: np.full((len(dates), len(codes)), np.nan) for name in names}
+        for name in names:
+            out[name][:start] = cached[f'out_{name}']
+        for t in range(start, len(dates)):
+            row = engine.append({field: bars[field][t] for field in BAR_FIELDS})
+            for name in names:
+                out[name][t] = row[name]
+        print(f"📈 技术指标: 增量追加 {len(dates) - start} 个交易日，{len(codes)} 个代码")
+    else:
+        out = engine.compute(bars)
+        print(f"📈 技术指标: 全量计算 {len(dates)} 个交易日，{len(codes)} 个代码")
+
+    if cache_path:
+        path = Path(cache_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        with open(tmp, 'wb') as f:
+            np.savez(f, dates=np.array(dates, dtype=str), codes=np.array(codes, dtype=str),
+                     params=np.array(repr(engine.params)), digest=np.array(_digest(bars, len(dates))),
+                     **{f'out_{name}': out[name] for name in names},
+                     **{f'state_{key}': value for key, value in engine.state.items()})
+        os.replace(tmp, path)
+    return out
+
+
+def load_bars(store, codes=None):
+    """
+    从K线存储读取 日期 × 代码 的 OHLCV 矩阵
+
+    返回: (dates, codes, {field: ndarray(日期, 代码)})
+    """
+    codes = store.codes() if codes is None else list(codes)
+    frames = {}
+    for code in codes:
+        df = store.read(code)
+        if df is not None and not df.empty:
+            frames[code] = df.drop_duplicates('date', keep='last').set_index('date')[list(BAR_FIELDS)].astype(float)
+    if not frames:
+        return [], [], {field: np.empty((0, 0)) for field in BAR_FIELDS}
+    wide = pd.concat(frames, axis=1).sort_index()
+    codes = list(frames)
+    bars = {field: wide.xs(field, axis=1, level=1).reindex(columns=codes).to_numpy(float) for field in BAR_FIELDS}
+    return wide.index.tolist(), codes, bars
+
+
+def compact(values, digits=2):
+    """数组 → JSON 列表（保留N位小数，NaN 为 None）"""
+    values = np.round(np.asarray(values, dtype=float), digits)
+    return [None if v != v else float(v) for v in values]
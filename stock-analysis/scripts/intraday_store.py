@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+盘中快照存储
+每5分钟一次的 ETL 会覆盖当天的存档，盘中板块排名、涨幅和指数点位的变化都丢失了。
+这里把每次快照追加到当天的日志 store/intraday/<date>.jsonl.gz：
+- 数值按整数缩放保存（涨幅/得分 ×1e4，点位/收盘价 ×100），代码表只在首次出现时记录一次，
+  排名由涨幅推出，不单独保存
+- 相对上一快照只记录变化的行，且只记录各字段的整数差值；
+  每 KEYFRAME_EVERY 次快照写一次完整快照，重建任意时刻时最多回放这么多条记录
+- 每条记录是一个独立的 gzip 成员，追加时不需要重写文件
+
+读取用 IntradayLog：snapshot(时刻) 重建某次快照，board_series / index_series 取单个板块/指数的盘中序列
+"""
+import gzip
+import json
+from pathlib import Path
+
+import pandas as pd
+
+# 板块和指数保存的字段及整数缩放倍数
+BOARD_FIELDS = {'ret': 10000, 'score': 10000, 'close': 100, 'up_count': 1}
+INDEX_FIELDS = {'close': 100, 'ret': 10000}
+
+KEYFRAME_EVERY = 24
+
+
+def default_intraday_root(store_dir):
+    return Path(store_dir) / 'intraday'
+
+
+def _scale(value, factor):
+    """数值 → 缩放后的整数，缺失为 None"""
+    if value is None or value != value:
+        return None
+    return int(round(float(value) * factor))
+
+
+def _unscale(values, fields):
+    return {f: (None if v is None else v / factor) for (f, factor), v in zip(fields.items(), values)}
+
+
+class _Table:
+    """按代码编号的行（整数元组），用于生成和回放差量"""
+
+    def __init__(self):
+        self.codes = []   # 编号 → 代码
+        self.pos = {}     # 代码 → 编号
+        self.meta = {}    # 编号 → 附加信息（板块名称和类型）
+        self.rows = {}    # 编号 → 当前行
+
+    def ensure(self, code):
+        if code not in self.pos:
+            self.pos[code] = len(self.codes)
+            self.codes.append(code)
+        return self.pos[code]
+
+    def delta(self, rows, keyframe):
+        """
+        当前行 {code: tuple} 相对已有行的差量（按列存放，同一字段的数值相邻，压缩率更高）
+
+        返回: {'d': [编号间隔, 字段1差值, ...], 's': [编号间隔, 字段1值, ...], 'x': [移除的编号]}
+        字段在前后两次都有值时记差值，否则（新行、变为缺失等）记绝对值；编号按升序、记与前一个编号的间隔
+        """
+        diff, absolute = [], []
+        current = {}
+        for code, row in rows.items():
+            i = self.ensure(code)
+            current[i] = row
+            old = self.rows.get(i)
+            if keyframe or old is None or any((a is None) != (b is None) for a, b in zip(old, row)):
+                absolute.append((i, row))
+            elif old != row:
+                diff.append((i, tuple(b - a if b is not None else 0 for a, b in zip(old, row))))
+        removed = sorted(i for i in self.rows if i not in current)
+        out = {}
+        if diff:
+            out['d'] = _columns(diff)
+        if absolute:
+            out['s'] = _columns(absolute)
+        if removed and not keyframe:
+            out['x'] = removed
+        return out
+
+    def apply(self, part, keyframe):
+        if keyframe:
+            self.rows = {}
+        for i in part.get('x', []):
+            self.rows.pop(i, None)
+        for i, values in _rows(part.get('s')):
+            self.rows[i] = values
+        for i, values in _rows(part.get('d')):
+            self.rows[i] = tuple(None if a is None else a + d for a, d in zip(self.rows[i], values))
+
+
+def _columns(rows):
+    """[(编号, 行), ...] → [编号间隔, 字段1, 字段2, ...]"""
+    rows.sort()
+    ids = [i for i, _ in rows]
+    gaps = [ids[0]] + [b - a for a, b in zip(ids, ids[1:])]
+    return [gaps] + [list(col) for col in zip(*(row for _, row in rows))]
+
+
+def _rows(columns):
+    """_columns 的逆变换"""
+    if not columns:
+        return []
+    ids, total = [], 0
+    for gap in columns[0]:
+        total += gap
+        ids.append(total)
+    return zip(ids, zip(*columns[1:]))
+
+
+class IntradayLog:
+    """一天的盘中快照日志（只读回放；append 追加新快照）"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.records = []
+        self.damaged = False
+        if self.path.exists():
+            self._read()
+
+    def _read(self):
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self.records.append(json.loads(line))
+        except (OSError, EOFError, ValueError) as e:
+            # 追加中断时最后一个成员不完整，之前的记录仍可用
+            print(f"⚠️  盘中日志 {self.path.name} 末尾损坏，读取到 {len(self.records)} 条快照: {e}")
+            self.damaged = True
+
+    def times(self):
+        """已记录的快照时刻"""
+        return [r['t'] for r in self.records]
+
+    def _replay(self, end, start=None):
+        """逐条回放到第 end 条记录（含），默认从之前最近的完整快照开始；每回放一条产出一次"""
+        if start is None:
+            start = end
+            while start > 0 and not self.records[start].get('k'):
+                start -= 1
+        boards, indices = _Table(), _Table()
+        # 代码表在整个日志中累积，需要从头读取
+        for n, r in enumerate(self.records[:end + 1]):
+            for code, name, board_type in r.get('n', []):
+                boards.meta[boards.ensure(code)] = (name, board_type)
+            for code in r.get('ni', []):
+                indices.ensure(code)
+            if n >= start:
+                boards.apply(r.get('b', {}), r.get('k'))
+                indices.apply(r.get('i', {}), r.get('k'))
+                yield r['t'], boards, indices
+
+    def _state(self, end):
+        *_, last = self._replay(end)
+        return last[1], last[2]
+
+    def _index_of(self, time_str):
+        if time_str is None:
+            return len(self.records) - 1
+        times = self.times()
+        # 取不晚于该时刻的最近一次快照
+        candidates = [i for i, t in enumerate(times) if t <= time_str]
+        if not candidates:
+            raise KeyError(f"{time_str} 之前没有快照")
+        return candidates[-1]
+
+    @staticmethod
+    def _board_frame(boards):
+        """板块表 → DataFrame（按代码），排名为类型内按涨幅降序"""
+        rows = {boards.codes[i]: {'name': boards.meta.get(i, ('', ''))[0], 'type': boards.meta.get(i, ('', ''))[1],
+                                  **_unscale(row, BOARD_FIELDS)} for i, row in sorted(boards.rows.items())}
+        df = pd.DataFrame.from_dict(rows, orient='index', columns=['name', 'type', *BOARD_FIELDS])
+        df['rank'] = df.groupby('type')['ret'].rank(ascending=False, method='first')
+        return df
+
+    def snapshot(self, time_str=None):
+        """
+        重建某一时刻（默认最新）的快照
+
+        返回: {'time', 'boards': DataFrame(按代码，含类型内排名 rank), 'indices': DataFrame(按代码)}
+        """
+        if not self.records:
+            return None
+        end = self._index_of(time_str)
+        boards, indices = self._state(end)
+        index_rows = {indices.codes[i]: _unscale(row, INDEX_FIELDS) for i, row in indices.rows.items()}
+        return {
+            'time': self.records[end]['t'],
+            'boards': self._board_frame(boards).sort_values(['type', 'rank']),
+            'indices': pd.DataFrame.from_dict(index_rows, orient='index', columns=list(INDEX_FIELDS)),
+        }
+
+    def board_series(self, code):
+        """板块的盘中序列 DataFrame(index=时刻, columns=rank/ret/score/close/up_count)"""
+        out = {}
+        for t, boards, _ in self._replay(len(self.records) - 1, start=0):
+            i = boards.pos.get(code)
+            if i is None or i not in boards.rows:
+                continue
+            row = _unscale(boards.rows[i], BOARD_FIELDS)
+            board_type = boards.meta.get(i, ('', ''))[1]
+            # 排名：同类型中涨幅更高的板块数 + 1（涨幅相同按代码编号）
+            ret = boards.rows[i][0]
+            ahead = sum(1 for j, other in boards.rows.items()
+                        if boards.meta.get(j, ('', ''))[1] == board_type and other[0] is not None and ret is not None
+                        and (other[0] > ret or (other[0] == ret and j < i)))
+            out[t] = {'rank': ahead + 1 if ret is not None else None, **row}
+        return pd.DataFrame.from_dict(out, orient='index', columns=['rank', *BOARD_FIELDS])
+
+    def index_series(self, code):
+        """指数的盘中序列 DataFrame(index=时刻, columns=close/ret)"""
+        out = {}
+        for t, _, indices in self._replay(len(self.records) - 1, start=0):
+            i = indices.pos.get(code)
+            if i is not None and i in indices.rows:
+                out[t] = _unscale(indices.rows[i], INDEX_FIELDS)
+        return pd.DataFrame.from_dict(out, orient='index', columns=list(INDEX_FIELDS))
+
+    def append(self, time_str, boards, indices, keyframe_every=KEYFRAME_EVERY):
+        """
+        追加一次快照
+
+        参数:
+            boards: {code: (name, type, {field: 数值})}
+            indices: {code: {field: 数值}}
+        返回: 是否写入（该时刻已记录时跳过）
+        """
+        if self.records and time_str <= self.records[-1]['t']:
+            print(f"⏭️  盘中快照 {time_str} 已记录，跳过")
+            return False
+
+        state_boards, state_indices = self._state(len(self.records) - 1) if self.records else (_Table(), _Table())
+        since_key = next((n for n, r in enumerate(reversed(self.records)) if r.get('k')), None)
+        keyframe = since_key is None or since_key + 1 >= keyframe_every
+
+        new_names = []
+        for code, (name, board_type, _) in boards.items():
+            i = state_boards.ensure(code)
+            if state_boards.meta.get(i) != (name, board_type):
+                new_names.append([code, name, board_type])
+        new_indices = [code for code in indices if code not in state_indices.pos]
+
+        record = {'t': time_str}
+        if keyframe:
+            record['k'] = 1
+        if new_names:
+            record['n'] = new_names
+        if new_indices:
+            record['ni'] = new_indices
+        # 先登记新代码，差量中的编号与回放时一致
+        for code in new_indices:
+            state_indices.ensure(code)
+        b = state_boards.delta({code: tuple(_scale(v.get(f), s) for f, s in BOARD_FIELDS.items())
+                                for code, (_, _, v) in boards.items()}, keyframe)
+        i = state_indices.delta({code: tuple(_scale(v.get(f), s) for f, s in INDEX_FIELDS.items())
+                                 for code, v in indices.items()}, keyframe)
+        if b:
+            record['b'] = b
+        if i:
+            record['i'] = i
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        if self.damaged:
+            # 末尾损坏时先用可读的记录重写文件
+            self._rewrite()
+        with open(self.path, 'ab') as f:
+            f.write(gzip.compress(payload, compresslevel=9, mtime=0))
+        self.records.append(record)
+        return True
+
+    def _rewrite(self):
+        import os
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp, 'wb') as f:
+            for r in self.records:
+                line = (json.dumps(r, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+                f.write(gzip.compress(line, compresslevel=9, mtime=0))
+        os.replace(tmp, self.path)
+        self.damaged = False
+
+
+def intraday_path(store_dir, date_str):
+    return default_intraday_root(store_dir) / f"{date_str}.jsonl.gz"
+
+
+def record_snapshot(store_dir, date_str, time_str, boards_df, indices, market_indices=None):
+    """
+    把 factors 阶段的结果追加为一次盘中快照
+
+    参数:
+        boards_df: 全部板块（bk_code/bk_name/bk_type/ret/score/close/up_count）；排名由读取时按类型内涨幅计算，不单独保存
+        indices / market_indices: {code: {'close', 'ret', ...}}（小写别名和非指数字段忽略）
+    """
+    boards = {}
+    if not boards_df.empty:
+        df = boards_df if 'bk_type' in boards_df.columns else boards_df.assign(bk_type='')
+        for row in df.itertuples(index=False):
+            values = {f: getattr(row, f, None) for f in BOARD_FIELDS}
+            boards[row.bk_code] = (row.bk_name, row.bk_type, values)
+    index_rows = {}
+    for block in (indices or {}), (market_indices or {}):
+        for code, item in block.items():
+            if isinstance(item, dict) and 'ret' in item and not (code.islower() and code.upper() in block):
+                index_rows[code] = item
+
+    log = IntradayLog(intraday_path(store_dir, date_str))
+    if log.append(time_str, boards, index_rows):
+        print(f"   🕒 盘中快照: {date_str} {time_str}，{len(boards)} 个板块，{len(index_rows)} 个指数"
+              f"（当天第 {len(log.records)} 次，{log.path.stat().st_size / 1024:.1f} KB）")
+    return log
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description='查看盘中快照')
+    ap.add_argument('--store-dir', default='site/data/store', help='数据存储目录')
+    ap.add_argument('--date', required=True, help='日期 YYYY-MM-DD')
+    ap.add_argument('--at', default=None, help='显示该时刻（HH:MM，默认最新）的快照')
+    ap.add_argument('--board', default=None, help='显示板块的盘中序列（板块代码）')
+    ap.add_argument('--index', default=None, help='显示指数的盘中序列（指数代码）')
+    ap.add_argument('--top', type=int, default=10, help='快照中每类显示前N个板块')
+    args = ap.parse_args()
+
+    log = IntradayLog(intraday_path(args.store_dir, args.date))
+    if not log.records:
+        print(f"❌ 没有 {args.date} 的盘中快照")
+        return
+    print(f"🕒 {args.date}: {len(log.records)} 次快照（{log.times()[0]} ~ {log.times()[-1]}），"
+          f"{log.path.stat().st_size / 1024:.1f} KB")
+    if args.board:
+        print(log.board_series(args.board).to_string())
+    elif args.index:
+        print(log.index_series(args.index).to_string())
+    else:
+        snap = log.snapshot(args.at)
+        print(f"\n📸 {snap['time']}")
+        for _, group in snap['boards'].groupby('type'):
+            print(group.head(args.top).to_string())
+        print(snap['indices'].to_string())
+
+
+if __name__ == '__main__':
+    main()
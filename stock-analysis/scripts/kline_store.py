@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+K线存储
+每个代码（板块 BKxxxx 或指数注册表代码）一个 CSV 文件，增量抓取后按日期合并去重：
+    data/store/klines/BK1031.csv
+    data/store/klines/HS300.csv
+列: date,open,high,low,close,volume,turnover,ret
+"""
+import os
+import time
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+KLINE_COLUMNS = ['date', 'open', 'high', 'low', 'close', 'volume', 'turnover', 'ret']
+
+
+def default_store_root(store_dir):
+    return Path(store_dir) / 'klines'
+
+
+class KlineStore:
+    """按代码分文件的日K线存储"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, code):
+        return self.root / f"{code}.csv"
+
+    def codes(self):
+        """已存储的全部代码"""
+        return sorted(p.stem for p in self.root.glob('*.csv'))
+
+    def read(self, code):
+        """读取单个代码的K线，不存在返回 None"""
+        path = self.path(code)
+        if not path.exists():
+            return None
+        return pd.read_csv(path, dtype={'date': str})
+
+    def write(self, code, df):
+        """与已有数据按日期合并（新数据覆盖旧数据）后原子写入"""
+        if df is None or df.empty:
+            return 0
+        df = df.reindex(columns=KLINE_COLUMNS)
+        old = self.read(code)
+        if old is not None:
+            df = pd.concat([old, df], ignore_index=True)
+        df = df.drop_duplicates('date', keep='last').sort_values('date')
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.path(code).with_suffix('.tmp')
+        df.to_csv(tmp, index=False)
+        os.replace(tmp, self.path(code))
+        return len(df)
+
+    def last_date(self, code):
+        df = self.read(code)
+        return df['date'].iloc[-1] if df is not None and not df.empty else None
+
+    def panel(self, codes=None, field='close'):
+        """
+        多个代码的某个字段宽表
+
+        返回: DataFrame(index=date, columns=code)
+        """
+        codes = self.codes() if codes is None else codes
+        series = {}
+        for code in codes:
+            df = self.read(code)
+            if df is not None and not df.empty:
+                series[code] = df.set_index('date')[field].astype(float)
+        if not series:
+            return pd.DataFrame()
+        return pd.concat(series, axis=1).sort_index()
+
+    def _missing_days(self, code, days):
+        """增量抓取需要的K线条数：已有数据时只补最近几天"""
+        last = self.last_date(code)
+        if last is None:
+            return days
+        gap = len(pd.bdate_range(last, date.today())) + 2
+        return min(days, max(gap, 5))
+
+    def update(self, codes, fetch, days=250, delay=0.3):
+        """
+        增量更新K线
+
+        参数:
+            fetch: fetch(code, days) -> DataFrame 或 None
+        返回:
+            成功更新的代码数量
+        """
+        updated = 0
+        for i, code in enumerate(codes):
+            if i > 0 and delay:
+                time.sleep(delay)
+            df = fetch(code, self._missing_days(code, days))
+            if df is not None and not df.empty:
+                self.write(code, df)
+                updated += 1
+        return updated
+
+    def update_boards(self, board_codes, days=250):
+        """增量更新板块K线（东方财富）"""
+        from eastmoney import fetch_board_kline
+        return self.update(board_codes, lambda code, n: fetch_board_kline(code, days=n), days)
+
+    def update_indices(self, index_codes, days=250):
+        """增量更新指数K线（东方财富）"""
+        from eastmoney import fetch_index_kline
+        return self.update(index_codes, lambda code, n: fetch_index_kline(code, days=n), days)
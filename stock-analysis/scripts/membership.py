@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+板块成分股缓存
+板块成分变化很少，按板块缓存成分股列表并每日刷新一次，
+配合全市场行情快照在本地关联，避免每次运行逐板块请求成分股
+
+缓存格式:
+{
+    "boards": {
+        "BK1031": {"date": "2025-11-20", "members": ["600438", "601012", ...]},
+        ...
+    }
+}
+"""
+import json
+import os
+import time
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+
+def load_membership(path):
+    """加载板块成分缓存，不存在时返回空表"""
+    if path and Path(path).exists():
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️  读取板块成分缓存失败: {e}")
+    return {'boards': {}}
+
+
+def save_membership(table, path):
+    """原子写入板块成分缓存"""
+    if not path:
+        return
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(table, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def stale_boards(table, board_codes, today=None):
+    """返回今天尚未刷新过成分的板块"""
+    today = today or date.today().isoformat()
+    boards = table.get('boards', {})
+    return [code for code in board_codes if boards.get(code, {}).get('date') != today]
+
+
+def refresh_membership(table, board_codes, fetch_members, today=None, delay=0.3):
+    """
+    刷新过期板块的成分股
+
+    参数:
+        fetch_members: fetch_members(board_code) -> 成分股代码列表 或 None（失败）
+    返回:
+        本次成功刷新的板块数量（失败的板块保留旧成分）
+    """
+    today = today or date.today().isoformat()
+    boards = table.setdefault('boards', {})
+    refreshed = 0
+
+    for i, code in enumerate(stale_boards(table, board_codes, today)):
+        if i > 0:
+            time.sleep(delay)
+        members = fetch_members(code)
+        if members is None:
+            continue
+        boards[code] = {'date': today, 'members': sorted(set(members))}
+        refreshed += 1
+
+    return refreshed
+
+
+def membership_frame(table, board_codes=None):
+    """
+    展开为 (bk_code, ts_code) 关系表
+
+    参数:
+        board_codes: 只展开指定板块（默认全部）
+    """
+    boards = table.get('boards', {})
+    codes = board_codes if board_codes is not None else list(boards)
+    rows = [(code, member) for code in codes for member in boards.get(code, {}).get('members', [])]
+    return pd.DataFrame(rows, columns=['bk_code', 'ts_code'])
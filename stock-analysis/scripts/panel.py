@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+只读面板
+把存档 JSON 和K线存储整理为定长类型的数组文件，分析工具直接内存映射读取，不再逐个解析 JSON：
+    store/panel/meta.json            日期表、板块代码表、板块名称表、指数代码表、数组形状、数据源指纹
+    store/panel/g<build>/score.bin   综合分          日期 × 板块  float64
+    store/panel/g<build>/rank.bin    当日排名        日期 × 板块  int16（0=未上榜）
+    store/panel/g<build>/close.bin   板块收盘价      K线日期 × 板块  float64
+    store/panel/g<build>/index_ret.bin  节奏指数涨跌幅  日期 × 指数  float64
+    ...
+
+- 面板是派生缓存：数据源指纹（存档/K线文件名、大小、修改时间）变化时重建，
+  未变化的存档日期直接从旧面板复制，只解析新增或改动的 JSON
+- 每次重建写入新的 g<build> 目录，最后原子替换 meta.json，已打开旧面板的进程不受影响
+- Panel 对象序列化时只传目录，子进程重新内存映射，不复制数据
+"""
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from archive_bundle import archive_entries
+from factors import STANCE_CUTOFFS
+from generate_history import index_return, load_archive
+from index_registry import index_codes
+from kline_store import KlineStore, default_store_root as default_kline_root
+
+PANEL_VERSION = 1
+
+STANCES = [label for _, label in STANCE_CUTOFFS] + ['AVOID']
+ADVICES = ['OFFENSE', 'NEUTRAL', 'DEFENSE']
+BOARD_TYPES = ['industry', 'concept']
+
+# 日期 × 板块 字段
+BOARD_FIELDS = {
+    'score': np.float64,
+    'ret': np.float64,
+    'pop': np.float64,
+    'dispersion': np.float64,
+    'pop_turnover': np.float64,
+    'up_count': np.float64,
+    'rank': np.int16,
+    'stance': np.int8,
+    'type': np.int8,
+    'name': np.int32,
+}
+BOARD_FILL = {'rank': 0, 'stance': -1, 'type': -1, 'name': -1}
+
+# 回测用到的指数K线（大盘/小盘）
+KLINE_INDICES = ['HS300', 'CSI1000']
+
+
+def default_panel_root(store_dir):
+    return Path(store_dir) / 'panel'
+
+
+def _fingerprint(paths):
+    return [[p.name, p.stat().st_size, p.stat().st_mtime_ns] for p in paths]
+
+
+def source_fingerprint(archive_dir, store_dir):
+    """存档（单日文件和月度包中的每一天）和K线文件的指纹"""
+    klines = default_kline_root(store_dir)
+    return {
+        'archive': archive_entries(archive_dir),
+        'klines': _fingerprint(sorted(klines.glob('*.csv'))) if klines.exists() else [],
+    }
+
+
+def _code(value, labels):
+    """标签 → 下标，未知为 -1"""
+    return labels.index(value) if value in labels else -1
+
+
+def _num(value):
+    """存档中的数值，缺失或无法解析为 NaN"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class Panel:
+    """内存映射的只读面板"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        with open(self.root / 'meta.json', 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.dates = self.meta['dates']
+        self.codes = self.meta['codes']
+        self.names = self.meta['names']
+        self.index_codes = self.meta['index_codes']
+        self.kline_dates = self.meta['kline_dates']
+        self.kline_indices = self.meta['kline_indices']
+        self.code_index = pd.Index(self.codes)
+        folder = self.root / f"g{self.meta['build']}"
+        self.arrays = {}
+        for name, (dtype, shape) in self.meta['arrays'].items():
+            if 0 in shape:
+                self.arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                self.arrays[name] = np.memmap(folder / f"{name}.bin", dtype=dtype, mode='r', shape=tuple(shape))
+
+    def __reduce__(self):
+        return Panel, (self.root,)
+
+    # ---------- 切片 ----------
+
+    def rows(self, start=None, end=None):
+        """日期范围 [start, end] 对应的行切片"""
+        lo = np.searchsorted(self.dates, start, 'left') if start else 0
+        hi = np.searchsorted(self.dates, end, 'right') if end else len(self.dates)
+        return slice(int(lo), int(hi))
+
+    def columns(self, codes):
+        """板块代码 → 列下标（未收录为 -1）"""
+        return self.code_index.get_indexer(list(codes))
+
+    def field(self, name, start=None, end=None, codes=None):
+        """
+        日期 × 板块 字段；不指定 codes 时返回内存映射的视图（不复制）
+        未收录的代码整列为缺失值
+        """
+        arr = self.arrays[name][self.rows(start, end)]
+        if codes is None:
+            return arr
+        ids = self.columns(codes)
+        out = np.full((len(arr), len(ids)), BOARD_FILL.get(name, np.nan), dtype=arr.dtype)
+        out[:, ids >= 0] = arr[:, ids[ids >= 0]]
+        return out
+
+    def frame(self, name, start=None, end=None, codes=None):
+        """字段宽表 DataFrame(index=date, columns=code)"""
+        rows = self.rows(start, end)
+        return pd.DataFrame(self.field(name, start, end, codes), index=self.dates[rows],
+                            columns=self.codes if codes is None else list(codes))
+
+    # ---------- 常用视图 ----------
+
+    def boards(self, start=None, end=None, include_backfill=False):
+        """
+        长表面板，与 backtest.load_panel 的结果一致：
+        DataFrame(date, type, code, name, rank, score, stance, ret, advice,
+                  pop, dispersion, pop_turnover, up_count)
+        """
+        rows = self.rows(start, end)
+        a = {name: self.arrays[name][rows] for name in BOARD_FIELDS}
+        keep = (a['rank'] > 0) & (a['stance'] >= 0) & np.isfinite(a['score'])
+        if not include_backfill:
+            keep &= ~self.arrays['backfill'][rows].astype(bool)[:, None]
+        t, c = np.nonzero(keep)
+        board_type = a['type'][t, c]
+        rank = a['rank'][t, c]
+        order = np.lexsort((rank, board_type, t))
+        t, c, board_type, rank = t[order], c[order], board_type[order], rank[order]
+
+        dates = np.asarray(self.dates[rows], dtype=object)
+        advice = self.arrays['advice'][rows][t]
+        panel = pd.DataFrame({
+            'date': dates[t],
+            'type': np.asarray(BOARD_TYPES, dtype=object)[board_type],
+            'code': np.asarray(self.codes, dtype=object)[c],
+            'name': np.asarray(self.names + [''], dtype=object)[a['name'][t, c]],
+            'rank': rank.astype(int),
+            'score': a['score'][t, c],
+            'stance': np.asarray(STANCES, dtype=object)[a['stance'][t, c]],
+            'ret': a['ret'][t, c],
+            'advice': np.where(advice >= 0, np.asarray(ADVICES, dtype=object)[advice.clip(0)], None),
+        })
+        for name in ('pop', 'dispersion', 'pop_turnover', 'up_count'):
+            panel[name] = a[name][t, c]
+        return panel
+
+    def close(self, codes=None):
+        """板块收盘价宽表，与 KlineStore.panel 一致（去掉没有K线的代码）"""
+        df = pd.DataFrame(np.asarray(self.arrays['close']), index=self.kline_dates, columns=self.codes)
+        if codes is not None:
+            df = df.reindex(columns=[c for c in codes if c in self.code_index])
+        return df.dropna(axis=1, how='all').dropna(axis=0, how='all')
+
+    def index_close(self, codes=KLINE_INDICES):
+        """指数收盘价宽表"""
+        df = pd.DataFrame(np.asarray(self.arrays['index_close']), index=self.kline_dates, columns=self.kline_indices)
+        return df.reindex(columns=[c for c in codes if c in df.columns]).dropna(axis=1, how='all').dropna(axis=0, how='all')
+
+    def index_returns(self, start=None, end=None):
+        """节奏指数涨跌幅宽表，与 generate_history.load_index_returns 一致"""
+        rows = self.rows(start, end)
+        return pd.DataFrame(np.asarray(self.arrays['index_ret'][rows]), index=self.dates[rows],
+                            columns=self.index_codes)
+
+
+# ---------- 构建 ----------
+
+def _read_day(data, arrays, t, code_pos, name_pos):
+    """把一天的存档写入第 t 行"""
+    if data.get('source') == 'history_backfill':
+        arrays['backfill'][t] = 1
+    advice = data.get('market', {}).get('advice', 'NEUTRAL')
+    arrays['advice'][t] = _code(advice, ADVICES)
+    indices = data.get('indices', {})
+    arrays['index_ret'][t] = [_num(index_return(indices.get(code))) for code in index_codes('indices')]
+
+    for type_id, board_type in enumerate(BOARD_TYPES):
+        for rank, b in enumerate(data.get(f'{board_type}_boards', []), 1):
+            code = b.get('code')
+            if not code:
+                continue
+            c = code_pos[code]
+            name = b.get('name', '')
+            arrays['name'][t, c] = name_pos.setdefault(name, len(name_pos))
+            arrays['rank'][t, c] = rank
+            arrays['type'][t, c] = type_id
+            arrays['stance'][t, c] = _code(b.get('stance'), STANCES)
+            for name in ('score', 'ret', 'pop', 'dispersion', 'pop_turnover', 'up_count'):
+                arrays[name][t, c] = _num(b.get(name))
+
+
+def _archive_codes(data):
+    return [b['code'] for t in BOARD_TYPES for b in data.get(f'{t}_boards', []) if b.get('code')]
+
+
+def build_panel(archive_dir, store_dir, force=False):
+    """
+    按需重建面板并返回 Panel
+
+    - 数据源指纹未变化时直接打开已有面板
+    - 存档文件未变化的日期从旧面板复制，只读取新增或改动的 JSON
+    - K线文件未变化时复制旧的收盘价数组
+    """
+    root = default_panel_root(store_dir)
+    fingerprint = source_fingerprint(archive_dir, store_dir)
+    old = None
+    if (root / 'meta.json').exists() and not force:
+        try:
+            old = Panel(root)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  面板损坏，重新构建: {e}")
+        if old is not None and old.meta.get('version') == PANEL_VERSION \
+                and old.meta.get('index_codes') == index_codes('indices'):
+            if old.meta.get('fingerprint') == fingerprint:
+                return old
+        else:
+            old = None
+
+    started = time.time()
+    dates = [entry[0][:-len('.json')] for entry in fingerprint['archive']]
+    old_rows = {}
+    if old is not None:
+        known = {tuple(e) for e in old.meta['fingerprint']['archive']}
+        old_pos = {d: i for i, d in enumerate(old.dates)}
+        old_rows = {d: old_pos[d] for d, e in zip(dates, fingerprint['archive'])
+                    if tuple(e) in known and d in old_pos}
+
+    # 读取变化的存档，代码表保持旧顺序并追加新代码
+    fresh = {}
+    for d in dates:
+        if d not in old_rows:
+            data = load_archive(archive_dir, d)
+            if data:
+                fresh[d] = data
+    # 无法读取的存档不进入面板（与逐个读取 JSON 时的行为一致）
+    dates = [d for d in dates if d in old_rows or d in fresh]
+    codes = list(old.codes) if old is not None else []
+    seen = set(codes)
+    for data in fresh.values():
+        for code in _archive_codes(data):
+            if code not in seen:
+                seen.add(code)
+                codes.append(code)
+    code_pos = {c: i for i, c in enumerate(codes)}
+    # 板块可能改名，名称按 日期 × 板块 记录在名称表中的编号
+    name_pos = {n: i for i, n in enumerate(old.names)} if old is not None else {}
+
+    n_days, n_codes, n_index = len(dates), len(codes), len(index_codes('indices'))
+    arrays = {name: np.full((n_days, n_codes), BOARD_FILL.get(name, np.nan), dtype=dtype)
+              for name, dtype in BOARD_FIELDS.items()}
+    arrays['advice'] = np.full(n_days, -1, dtype=np.int8)
+    arrays['backfill'] = np.zeros(n_days, dtype=np.uint8)
+    arrays['index_ret'] = np.full((n_days, n_index), np.nan)
+
+    if old_rows:
+        new_t = np.array([t for t, d in enumerate(dates) if d in old_rows])
+        old_t = np.array([old_rows[dates[t]] for t in new_t])
+        n_old = len(old.codes)
+        for name in BOARD_FIELDS:
+            arrays[name][new_t, :n_old] = old.arrays[name][old_t]
+        for name in ('advice', 'backfill', 'index_ret'):
+            arrays[name][new_t] = old.arrays[name][old_t]
+    for t, d in enumerate(dates):
+        if d in fresh:
+            _read_day(fresh[d], arrays, t, code_pos, name_pos)
+
+    # K线：文件未变化时沿用旧数组（新代码没有K线文件，补缺失列）
+    if old is not None and old.meta['fingerprint']['klines'] == fingerprint['klines']:
+        kline_dates, kline_indices = old.kline_dates, old.kline_indices
+        close = np.full((len(kline_dates), n_codes), np.nan)
+        close[:, :len(old.codes)] = old.arrays['close']
+        index_close = np.asarray(old.arrays['index_close'])
+    else:
+        store = KlineStore(default_kline_root(store_dir))
+        close_df = store.panel([c for c in codes if store.path(c).exists()])
+        index_df = store.panel([c for c in KLINE_INDICES if store.path(c).exists()])
+        kline_dates = sorted(set(close_df.index) | set(index_df.index))
+        kline_indices = list(index_df.columns)
+        close = close_df.reindex(index=kline_dates, columns=codes).to_numpy(float)
+        index_close = index_df.reindex(index=kline_dates).to_numpy(float).reshape(len(kline_dates), len(kline_indices))
+    arrays['close'] = close
+    arrays['index_close'] = index_close
+
+    panel = _write(root, arrays, {
+        'version': PANEL_VERSION, 'fingerprint': fingerprint,
+        'dates': dates, 'codes': codes, 'names': list(name_pos),
+        'index_codes': index_codes('indices'),
+        'kline_dates': kline_dates, 'kline_indices': kline_indices,
+    })
+    print(f"🧱 面板已更新: {n_days} 天 × {n_codes} 个板块，解析 {len(fresh)} 个存档，"
+          f"复用 {len(old_rows)} 天，用时 {time.time() - started:.1f}s")
+    return panel
+
+
+def _write(root, arrays, meta):
+    """写入新的 g<build> 目录，原子替换 meta.json 后清理旧目录"""
+    root.mkdir(parents=True, exist_ok=True)
+    build = f"{time.time_ns():x}"
+    folder = root / f"g{build}"
+    folder.mkdir()
+    layout = {}
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        layout[name] = [arr.dtype.str, list(arr.shape)]
+        arr.tofile(folder / f"{name}.bin")
+
+    tmp = root / 'meta.json.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(dict(meta, build=build, arrays=layout), f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, root / 'meta.json')
+
+    for other in root.glob('g*'):
+        if other.is_dir() and other != folder:
+            shutil.rmtree(other, ignore_errors=True)
+    return Panel(root)
+
+
+def open_panel(archive_dir, store_dir=None):
+    """打开（必要时先更新）面板，失败返回 None，调用方回退为逐个读取 JSON"""
+    store_dir = store_dir or Path(archive_dir).parent / 'store'
+    try:
+        return build_panel(archive_dir, store_dir)
+    except OSError as e:
+        print(f"⚠️  无法使用面板，改为读取存档 JSON: {e}")
+        return None
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description='由存档和K线存储构建只读面板')
+    ap.add_argument('--archive-dir', default='site/data/archive', help='存档目录')
+    ap.add_argument('--store-dir', default=None, help='数据存储目录（默认与存档目录同级的 store）')
+    ap.add_argument('--force', action='store_true', help='忽略指纹，完整重建')
+    args = ap.parse_args()
+
+    store_dir = args.store_dir or Path(args.archive_dir).parent / 'store'
+    panel = build_panel(args.archive_dir, store_dir, args.force)
+    size = sum(a.nbytes for a in panel.arrays.values()) / 1e6
+    print(f"📊 面板 {panel.root}: {len(panel.dates)} 天，{len(panel.codes)} 个板块，"
+          f"K线 {len(panel.kline_dates)} 天，共 {size:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+ETL 流水线 DAG（带磁盘缓存与过期阶段检测）
+
+每个阶段的输出按 (阶段名, 代码版本, 参数, 上游阶段键) 的哈希缓存到磁盘，
+重跑、回补和本地调试时只执行过期（stale）的阶段：
+    raw → frames → factors → daily → archive → history
+
+阶段是否过期只看本次的键：该键的缓存文件存在、且该键执行时记录的输出文件哈希
+（<阶段>/<键>.outputs.json）与当前文件一致时直接复用，因此回补 A → B → A 时第二次的 A 不会重算。
+manifest.json 记录每个阶段最近一次执行的键、参数和输出文件哈希，
+只用于 --explain 模式说明缓存未命中的原因（代码、参数或上游变化）。
+"""
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+from datetime import datetime
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+# 每个阶段保留的缓存文件数量（回补不同日期时可复用）
+KEEP_PER_STAGE = 20
+
+
+def stable_hash(obj):
+    """对可JSON序列化的对象计算稳定哈希（键排序）"""
+    payload = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def file_hash(path):
+    """计算文件内容哈希，文件不存在返回 None"""
+    path = Path(path)
+    if not path.exists():
+        return None
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def code_version(code):
+    """
+    计算阶段的代码版本
+    code 中的元素可以是 scripts 目录下的文件名，也可以是函数（取其源码）
+    """
+    parts = []
+    for item in code:
+        if callable(item):
+            parts.append(inspect.getsource(item))
+        else:
+            parts.append(file_hash(SCRIPT_DIR / item) or item)
+    return stable_hash(parts)
+
+
+class Stage:
+    """流水线中的一个阶段"""
+
+    def __init__(self, name, func, deps=(), params=None, code=(), outputs=()):
+        self.name = name
+        self.func = func              # func(*上游阶段输出) -> 本阶段输出
+        self.deps = list(deps)
+        self.params = params or {}    # 影响输出的参数（需可JSON序列化）
+        self.code = code_version(list(code) + [func])
+        self.outputs = [str(p) for p in outputs]  # 本阶段写出的文件
+
+    def key(self, dep_keys):
+        return stable_hash({
+            'stage': self.name,
+            'code': self.code,
+            'params': self.params,
+            'deps': [dep_keys[d] for d in self.deps],
+        })
+
+
+class Pipeline:
+    """按注册顺序（即拓扑顺序）执行的阶段 DAG"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.manifest_path = self.cache_dir / 'manifest.json'
+        self.stages = {}
+        self._values = {}
+        self._plan = None
+
+    def add(self, name, func, deps=(), params=None, code=(), outputs=()):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"阶段 {name} 依赖未注册的阶段 {dep}")
+        self.stages[name] = Stage(name, func, deps, params, code, outputs)
+        self._plan = None
+        return self.stages[name]
+
+    def _load_manifest(self):
+        if not self.manifest_path.exists():
+            return {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️  读取流水线清单失败: {e}")
+            return {}
+
+    def _save_manifest(self, manifest):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    def _cache_file(self, name, key):
+        return self.cache_dir / name / f"{key}.pkl"
+
+    def _outputs_file(self, name, key):
+        return self.cache_dir / name / f"{key}.outputs.json"
+
+    @staticmethod
+    def _miss_reason(stage, key, prev):
+        """缓存未命中的原因（与最近一次执行的清单记录比较）"""
+        if prev is None:
+            return "首次运行"
+        if prev.get('code') != stage.code:
+            return "代码版本变化"
+        if prev.get('params_hash') != stable_hash(stage.params):
+            old = prev.get('params', {})
+            changed = sorted(k for k in set(old) | set(stage.params)
+                             if old.get(k) != stage.params.get(k))
+            return f"参数变化: {', '.join(changed)}"
+        if prev.get('key') != key:
+            return "上游输出变化"
+        return "缓存缺失"
+
+    def _outputs_reason(self, stage, key):
+        """该键执行时写出的文件是否仍是当时的内容，不是时返回原因"""
+        if not stage.outputs:
+            return None
+        try:
+            with open(self._outputs_file(stage.name, key), 'r', encoding='utf-8') as f:
+                recorded = json.load(f)
+        except (OSError, ValueError):
+            return "输出记录缺失"
+        for path in stage.outputs:
+            current = file_hash(path)
+            if path not in recorded:
+                return f"输出记录缺失: {path}"
+            if current != recorded[path]:
+                return f"输出文件缺失: {path}" if current is None else f"输出文件被修改: {path}"
+        return None
+
+    def plan(self, force=()):
+        """
+        计算执行计划
+
+        返回: [{'stage', 'key', 'stale', 'reason'}, ...]（按执行顺序）
+        """
+        manifest = self._load_manifest()
+        keys, stale, result = {}, {}, []
+
+        for name, stage in self.stages.items():
+            key = stage.key(keys)
+            keys[name] = key
+            stale_deps = [d for d in stage.deps if stale[d]]
+
+            if name in force:
+                reason = "强制重跑"
+            elif not self._cache_file(name, key).exists():
+                reason = self._miss_reason(stage, key, manifest.get(name))
+            elif stale_deps:
+                reason = f"上游阶段需要重跑: {', '.join(stale_deps)}"
+            else:
+                reason = self._outputs_reason(stage, key)
+
+            stale[name] = reason is not None
+            result.append({'stage': name, 'key': key, 'stale': stale[name],
+                           'reason': reason or "缓存有效"})
+
+        self._plan = result
+        return result
+
+    def explain(self, force=()):
+        """打印各阶段是否会执行及原因"""
+        print("🧭 流水线执行计划:")
+        for item in self.plan(force):
+            flag = "▶️  执行" if item['stale'] else "⏭️  跳过"
+            print(f"  {flag} {item['stage']:<8} [{item['key']}] {item['reason']}")
+
+    def value(self, name):
+        """获取阶段输出（未执行的阶段从缓存加载）"""
+        if name not in self._values:
+            key = next(p['key'] for p in self._plan if p['stage'] == name)
+            with open(self._cache_file(name, key), 'rb') as f:
+                self._values[name] = pickle.load(f)
+        return self._values[name]
+
+    def run(self, force=()):
+        """执行所有过期阶段，返回执行计划（已执行的阶段附带耗时 seconds）"""
+        plan = self.plan(force)
+        manifest = self._load_manifest()
+
+        for item in plan:
+            name, key = item['stage'], item['key']
+            stage = self.stages[name]
+            if not item['stale']:
+                # 复用的缓存刷新修改时间，清理时按最近使用保留
+                os.utime(self._cache_file(name, key))
+                continue
+
+            print(f"\n▶️  阶段 {name}（{item['reason']}）")
+            started = time.perf_counter()
+            value = stage.func(*[self.value(d) for d in stage.deps])
+            self._values[name] = value
+
+            cache_file = self._cache_file(name, key)
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cache_file.with_suffix('.tmp')
+            with open(tmp, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache_file)
+            outputs = {p: file_hash(p) for p in stage.outputs}
+            outputs_file = self._outputs_file(name, key)
+            tmp = outputs_file.with_suffix('.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(outputs, f, ensure_ascii=False)
+            os.replace(tmp, outputs_file)
+            self._prune(name)
+            item['seconds'] = time.perf_counter() - started
+
+            manifest[name] = {
+                'key': key,
+                'code': stage.code,
+                'params': stage.params,
+                'params_hash': stable_hash(stage.params),
+                'outputs': outputs,
+                'finished_at': datetime.now().isoformat(timespec='seconds'),
+            }
+            # 每个阶段完成即落盘，失败重跑时已完成的阶段不再执行
+            self._save_manifest(manifest)
+
+        skipped = [p['stage'] for p in plan if not p['stale']]
+        if skipped:
+            print(f"\n⏭️  复用缓存阶段: {', '.join(skipped)}")
+        return plan
+
+    def _prune(self, name):
+        files = sorted((self.cache_dir / name).glob('*.pkl'),
+                       key=lambda p: p.stat().st_mtime, reverse=True)
+        for old in files[KEEP_PER_STAGE:]:
+            old.unlink()
+            old.with_suffix('.outputs.json').unlink(missing_ok=True)
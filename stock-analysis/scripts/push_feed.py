@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+盘中推送事件
+每次 ETL 算出新的 daily.json 后，与上一次推送的状态比较，只把变化的部分写成一条事件：
+    store/push/state.json       上一次推送的完整状态（板块、排名、指数、市场节奏）
+    store/push/events.jsonl     事件日志（每行一条，保留最近 MAX_EVENTS 条）
+
+事件格式:
+{
+    "seq": 128, "date": "2025-11-20", "slot": "2025-11-20 10:35", "kind": "delta",
+    "boards": {"BK1031": {...完整板块...}},     # 新上榜或内容变化的板块
+    "removed": ["BK0477"],                      # 跌出榜单的板块
+    "ranks": {"industry": ["BK1031", ...]},     # 顺序变化的榜单（完整代码顺序）
+    "indices": {"HS300": {...}},                # 变化的节奏指数行情
+    "market_indices": {"SHCOMP": {...}},        # 变化的大盘指数行情
+    "market": {...}, "data_status": {...}       # 有变化时才出现
+}
+新的交易日第一条事件为 kind="reset"（客户端重新加载 daily.json）
+
+query_server.py 的 /api/stream 读取事件日志，通过 server-sent events 推送给已连接的页面，
+页面不再各自轮询；上游接口只由 ETL 一个进程请求
+"""
+import json
+import os
+from pathlib import Path
+
+# 事件日志保留的条数（断线重连时可补发的范围，约两个交易日的5分钟快照）
+MAX_EVENTS = 500
+
+BOARD_LISTS = ('industry_boards', 'concept_boards')
+RANK_KEYS = {'industry_boards': 'industry', 'concept_boards': 'concept'}
+
+
+def default_push_root(store_dir):
+    return Path(store_dir) / 'push'
+
+
+def events_path(store_dir):
+    return default_push_root(store_dir) / 'events.jsonl'
+
+
+def push_state(daily):
+    """daily.json → 推送状态"""
+    return {
+        'date': daily.get('date'),
+        'market': daily.get('market', {}),
+        'data_status': daily.get('data_status'),
+        'boards': {b['code']: b for key in BOARD_LISTS for b in daily.get(key, []) if b.get('code')},
+        'ranks': {RANK_KEYS[key]: [b['code'] for b in daily.get(key, []) if b.get('code')] for key in BOARD_LISTS},
+        'indices': daily.get('indices', {}),
+        'market_indices': daily.get('market_indices', {}),
+    }
+
+
+def _changed(old, new):
+    """字典中新增或值变化的项"""
+    return {k: v for k, v in new.items() if old.get(k) != v}
+
+
+def diff_state(prev, cur):
+    """
+    两次推送状态的差异
+
+    返回: 事件内容（不含 seq/slot）；没有变化返回 None；prev 为空或跨日返回 reset 事件
+    """
+    if not prev or prev.get('date') != cur['date']:
+        return {'date': cur['date'], 'kind': 'reset'}
+
+    event = {'date': cur['date'], 'kind': 'delta'}
+    boards = _changed(prev['boards'], cur['boards'])
+    removed = sorted(set(prev['boards']) - set(cur['boards']))
+    ranks = _changed(prev['ranks'], cur['ranks'])
+    indices = _changed(prev['indices'], cur['indices'])
+    market_indices = _changed(prev['market_indices'], cur['market_indices'])
+    for name, value in (('boards', boards), ('removed', removed), ('ranks', ranks),
+                        ('indices', indices), ('market_indices', market_indices)):
+        if value:
+            event[name] = value
+    for name in ('market', 'data_status'):
+        if prev.get(name) != cur.get(name):
+            event[name] = cur.get(name)
+    return event if len(event) > 2 else None
+
+
+def _write_json(path, data):
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def read_events(path, after=0):
+    """事件日志中 seq > after 的事件"""
+    path = Path(path)
+    if not path.exists():
+        return []
+    events = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue  # 写入中断的半行
+            if event.get('seq', 0) > after:
+                events.append(event)
+    return events
+
+
+def publish(daily, store_dir, slot):
+    """
+    阶段 push：与上一次推送的状态比较，有变化时追加一条事件
+
+    返回: {'seq': 最新序号, 'kind': 事件类型或 None（无变化）, 'boards': 变化板块数}
+    """
+    root = default_push_root(store_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    state_path = root / 'state.json'
+    prev = None
+    if state_path.exists():
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                prev = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  读取推送状态失败，重新开始: {e}")
+
+    cur = push_state(json.loads(json.dumps(daily, ensure_ascii=False)))
+    path = events_path(store_dir)
+    events = read_events(path)
+    # 状态文件丢失时序号接着事件日志继续，已连接的页面不会错过事件
+    seq = max(prev.get('seq', 0) if prev else 0, events[-1]['seq'] if events else 0)
+    event = diff_state(prev, cur)
+    if event is not None:
+        seq += 1
+        event = dict(seq=seq, slot=slot, **event)
+        if len(events) >= MAX_EVENTS:
+            # 超出保留条数时整体重写（原子替换），否则直接追加一行
+            kept = events[-(MAX_EVENTS - 1):] + [event]
+            tmp = path.with_name(f".{path.name}.tmp")
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(e, ensure_ascii=False, separators=(',', ':')) + '\n' for e in kept)
+            os.replace(tmp, path)
+        else:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n')
+        print(f"📣 推送事件 #{seq}（{event['kind']}）：板块 {len(event.get('boards', {}))} 个变化，"
+              f"{len(event.get('removed', []))} 个跌出，指数 {len(event.get('indices', {})) + len(event.get('market_indices', {}))} 个变化")
+    _write_json(state_path, dict(cur, seq=seq))
+    return {'seq': seq, 'kind': event['kind'] if event else None, 'boards': len(event.get('boards', {})) if event else 0}
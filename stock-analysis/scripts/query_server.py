@@ -0,0 +1,600 @@
+# -*- coding: utf-8 -*-
+"""
+本地查询服务
+在存档、只读面板和K线存储之上提供按条件查询的 JSON 接口，页面和研究脚本不必下载整份 JSON 或逐个解析存档：
+
+    GET /api/dates                          存档中的交易日
+    GET /api/boards?from=&to=&type=&top=    日期范围内每天的上榜板块
+    GET /api/boards/<code>?from=&to=        单个板块的排名/得分/涨跌幅序列（附K线）
+    GET /api/hot?from=&to=&type=&limit=     热门板块排行（上榜天数、平均得分、平均涨跌幅、最佳排名）
+    GET /api/indices                        指数注册表（是否有K线）
+    GET /api/indices/<code>?from=&to=       指数K线 OHLC 切片
+    GET /api/stream                         盘中推送（server-sent events，见 push_feed.py）
+
+其余路径按静态文件提供（--site-dir 下的 index.html、app.js、data/daily.json、data/history.json……），
+可直接替代 python -m http.server
+
+- 所有响应带 ETag 和 Last-Modified，If-None-Match / If-Modified-Since 命中时返回 304
+- 查询接口的 ETag 由数据源指纹（存档、月度包、K线文件）和查询条件计算，数据源变化时面板按需增量重建
+- 最近的查询结果保存在内存 LRU 缓存中（按数据源版本失效）
+- /api/stream 监视 ETL 写出的推送事件日志，把变化的板块、排名和指数行情推送给所有已连接的页面；
+  断线重连时按 Last-Event-ID 补发，超出保留范围时发送 reset 让页面重新加载 daily.json
+
+示例:
+    python query_server.py --site-dir stock-analysis --port 8000
+    curl 'http://localhost:8000/api/boards/BK1031?from=2025-11-01'
+"""
+import json
+import mimetypes
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import date
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+
+from index_registry import INDEX_REGISTRY, INDEX_BY_CODE
+from kline_store import KlineStore, default_store_root as default_kline_root
+from panel import BOARD_TYPES, STANCES, open_panel, source_fingerprint
+from pipeline import stable_hash
+from push_feed import MAX_EVENTS, events_path, read_events
+
+# 内存缓存的查询结果数
+CACHE_SIZE = 256
+
+# 数据源指纹的复查间隔（秒）：间隔内的请求沿用上一次的版本
+VERSION_TTL = 2.0
+
+# /api/hot 未指定起始日期时的天数，以及 /api/boards 单次返回的最多天数
+HOT_DEFAULT_DAYS = 7
+MAX_RANGE_DAYS = 500
+
+# 推送：事件日志的检查间隔、心跳间隔（保持连接不被代理断开）和客户端重连等待
+STREAM_POLL_SECONDS = 0.5
+HEARTBEAT_SECONDS = 15
+RETRY_MS = 5000
+
+
+class QueryError(Exception):
+    """请求参数错误或资源不存在（status 为 HTTP 状态码）"""
+
+    def __init__(self, message, status=HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+class LRUCache:
+    """线程安全的 LRU 缓存"""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+def _clean(values, digits=4):
+    """数组 → JSON 列表（NaN 为 null）"""
+    return [None if v is None or (isinstance(v, float) and not np.isfinite(v)) else
+            round(float(v), digits) if isinstance(v, (float, np.floating)) else v
+            for v in np.asarray(values, dtype=object).tolist()]
+
+
+def _date_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise QueryError(f"参数 {name} 应为 YYYY-MM-DD: {value}")
+
+
+def _int_param(params, name, default, low=1, high=1000):
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise QueryError(f"参数 {name} 应为整数: {value}")
+    return min(max(value, low), high)
+
+
+def _type_param(params):
+    board_type = params.get('type')
+    if board_type and board_type not in BOARD_TYPES:
+        raise QueryError(f"参数 type 应为 {' / '.join(BOARD_TYPES)}: {board_type}")
+    return board_type
+
+
+class QueryService:
+    """查询接口（与 HTTP 无关，研究脚本也可直接调用 query）"""
+
+    def __init__(self, archive_dir, store_dir, cache_size=CACHE_SIZE):
+        self.archive_dir = Path(archive_dir)
+        self.store_dir = Path(store_dir)
+        self.cache = LRUCache(cache_size)
+        self.klines = KlineStore(default_kline_root(store_dir))
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._version = None
+        self._modified = 0.0
+        self._panel = None
+        self._panel_version = None
+
+    # ---------- 数据源版本 ----------
+
+    def _source_mtime(self):
+        paths = list(self.archive_dir.glob('*.json')) + list(self.archive_dir.glob('bundles/*'))
+        root = default_kline_root(self.store_dir)
+        if root.exists():
+            paths += list(root.glob('*.csv'))
+        return max((p.stat().st_mtime for p in paths), default=0.0)
+
+    def version(self):
+        """(数据源版本, 最后修改时间)，VERSION_TTL 内复用"""
+        with self._lock:
+            if self._version is None or time.monotonic() - self._checked > VERSION_TTL:
+                self._version = stable_hash(source_fingerprint(self.archive_dir, self.store_dir))
+                self._modified = self._source_mtime()
+                self._checked = time.monotonic()
+            return self._version, self._modified
+
+    def panel(self):
+        """当前数据源版本的面板（数据源变化时增量重建）"""
+        version, _ = self.version()
+        with self._lock:
+            if self._panel is None or self._panel_version != version:
+                panel = open_panel(self.archive_dir, self.store_dir)
+                if panel is None:
+                    raise QueryError("面板不可用", HTTPStatus.SERVICE_UNAVAILABLE)
+                self._panel, self._panel_version = panel, version
+            return self._panel
+
+    # ---------- 查询 ----------
+
+    def query(self, route, params):
+        """
+        执行查询
+
+        返回: (JSON 字节, ETag, 最后修改时间)；相同数据源版本和条件的结果来自 LRU 缓存
+        """
+        version, modified = self.version()
+        key = (version, route, tuple(sorted(params.items())))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        parts = [p for p in route.split('/') if p]
+        if parts == ['dates']:
+            result = self.dates()
+        elif parts == ['boards']:
+            result = self.boards(params)
+        elif len(parts) == 2 and parts[0] == 'boards':
+            result = self.board_series(parts[1], params)
+        elif parts == ['hot']:
+            result = self.hot(params)
+        elif parts == ['indices']:
+            result = self.indices()
+        elif len(parts) == 2 and parts[0] == 'indices':
+            result = self.index_ohlc(parts[1], params)
+        else:
+            raise QueryError(f"未知接口: /api/{route}", HTTPStatus.NOT_FOUND)
+
+        body = json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        entry = (body, f'"{stable_hash([version, route, key[2]])}"', modified)
+        self.cache.put(key, entry)
+        return entry
+
+    def _range(self, params):
+        start, end = _date_param(params, 'from'), _date_param(params, 'to')
+        if start and end and start > end:
+            raise QueryError("from 晚于 to")
+        return start, end
+
+    def dates(self):
+        dates = list(self.panel().dates)
+        return {'dates': dates, 'count': len(dates)}
+
+    def boards(self, params):
+        """日期范围内每天的上榜板块（按类型、排名）"""
+        start, end = self._range(params)
+        board_type = _type_param(params)
+        top = _int_param(params, 'top', 10, high=100)
+        panel = self.panel()
+        rows = panel.rows(start, end)
+        if rows.stop - rows.start > MAX_RANGE_DAYS:
+            raise QueryError(f"日期范围超过 {MAX_RANGE_DAYS} 个交易日")
+
+        df = panel.boards(start, end, include_backfill=params.get('backfill') == '1')
+        if board_type:
+            df = df[df['type'] == board_type]
+        df = df[df['rank'] <= top]
+        days = []
+        for d, group in df.groupby('date', sort=True):
+            days.append({
+                'date': d,
+                'advice': group['advice'].iloc[0],
+                'boards': [{'code': r.code, 'name': r.name, 'type': r.type, 'rank': int(r.rank),
+                            'score': _clean([r.score])[0], 'ret': _clean([r.ret], 6)[0], 'stance': r.stance}
+                           for r in group.itertuples(index=False)],
+            })
+        return {'from': start, 'to': end, 'type': board_type, 'top': top, 'days': days}
+
+    def board_series(self, code, params):
+        """单个板块在日期范围内的排名、得分、涨跌幅和评级序列，附同一范围的K线"""
+        start, end = self._range(params)
+        panel = self.panel()
+        col = int(panel.columns([code])[0])
+        kline = self._kline(code, start, end)
+        if col < 0 and kline is None:
+            raise QueryError(f"未收录的板块: {code}", HTTPStatus.NOT_FOUND)
+
+        result = {'code': code, 'name': None, 'type': None, 'dates': [], 'kline': kline}
+        if col >= 0:
+            rows = panel.rows(start, end)
+            rank = panel.arrays['rank'][rows, col]
+            listed = rank > 0
+            names = panel.arrays['name'][rows, col][listed]
+            types = panel.arrays['type'][rows, col][listed]
+            stance = panel.arrays['stance'][rows, col][listed]
+            if listed.any():
+                result['name'] = panel.names[int(names[-1])] if names[-1] >= 0 else None
+                result['type'] = BOARD_TYPES[int(types[-1])] if types[-1] >= 0 else None
+            result.update(
+                dates=list(np.asarray(panel.dates[rows], dtype=object)[listed]),
+                rank=rank[listed].astype(int).tolist(),
+                score=_clean(panel.arrays['score'][rows, col][listed]),
+                ret=_clean(panel.arrays['ret'][rows, col][listed], 6),
+                stance=[STANCES[s] if s >= 0 else None for s in stance.tolist()],
+            )
+        return result
+
+    def hot(self, params):
+        """热门板块排行：按上榜天数、平均得分排序（默认最近 HOT_DEFAULT_DAYS 个交易日）"""
+        start, end = self._range(params)
+        board_type = _type_param(params)
+        limit = _int_param(params, 'limit', 20, high=200)
+        panel = self.panel()
+        if start is None:
+            dates = panel.dates[panel.rows(None, end)]
+            start = dates[-HOT_DEFAULT_DAYS] if len(dates) >= HOT_DEFAULT_DAYS else (dates[0] if len(dates) else None)
+
+        df = panel.boards(start, end)
+        if board_type:
+            df = df[df['type'] == board_type]
+        if df.empty:
+            return {'from': start, 'to': end, 'type': board_type, 'boards': []}
+        stats = (df.groupby('code', sort=False)
+                   .agg(name=('name', 'last'), type=('type', 'last'), days_on_list=('date', 'nunique'),
+                        avg_score=('score', 'mean'), avg_ret=('ret', 'mean'), best_rank=('rank', 'min'),
+                        last_date=('date', 'max'))
+                   .sort_values(['days_on_list', 'avg_score'], ascending=False, kind='mergesort')
+                   .head(limit))
+        return {
+            'from': start, 'to': end or df['date'].max(), 'type': board_type,
+            'boards': [{'code': code, 'name': r.name, 'type': r.type, 'days_on_list': int(r.days_on_list),
+                        'avg_score': _clean([r.avg_score])[0], 'avg_ret': _clean([r.avg_ret], 6)[0],
+                        'best_rank': int(r.best_rank), 'last_date': r.last_date}
+                       for code, r in zip(stats.index, stats.itertuples(index=False))],
+        }
+
+    def indices(self):
+        return {'indices': [{'code': e['code'], 'name': e['name'], 'groups': list(e['groups']),
+                             'kline': self.klines.path(e['code']).exists()} for e in INDEX_REGISTRY]}
+
+    def index_ohlc(self, code, params):
+        """指数K线 OHLC 切片"""
+        if code not in INDEX_BY_CODE:
+            raise QueryError(f"未登记的指数: {code}", HTTPStatus.NOT_FOUND)
+        start, end = self._range(params)
+        kline = self._kline(code, start, end)
+        if kline is None:
+            raise QueryError(f"指数 {code} 没有K线数据", HTTPStatus.NOT_FOUND)
+        return dict(code=code, name=INDEX_BY_CODE[code]['name'], **kline)
+
+    def _kline(self, code, start, end):
+        """K线存储中 [start, end] 的 OHLC 列，没有K线返回 None"""
+        df = self.klines.read(code) if '/' not in code else None
+        if df is None or df.empty:
+            return None
+        if start:
+            df = df[df['date'] >= start]
+        if end:
+            df = df[df['date'] <= end]
+        return {
+            'dates': df['date'].tolist(),
+            **{field: _clean(df[field].to_numpy(float), 6 if field == 'ret' else 4)
+               for field in ('open', 'high', 'low', 'close', 'volume', 'ret')},
+        }
+
+
+class PushHub:
+    """监视推送事件日志，把新事件广播给 /api/stream 的订阅者"""
+
+    def __init__(self, path, poll=STREAM_POLL_SECONDS):
+        self.path = Path(path)
+        self.poll = poll
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.last_seq = 0
+        self._signature = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name='push-hub', daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        """事件日志有变化时读取新事件并广播"""
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return
+        signature = (st.st_size, st.st_mtime_ns)
+        if signature == self._signature:
+            return
+        self._signature = signature
+        events = read_events(self.path)
+        if events and events[-1]['seq'] < self.last_seq:
+            # 事件日志被重建（序号回退）：从头开始
+            with self._lock:
+                self.events.clear()
+                self.last_seq = 0
+        new = [e for e in events if e['seq'] > self.last_seq]
+        if not new:
+            return
+        with self._lock:
+            self.events.extend(new)
+            self.last_seq = new[-1]['seq']
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            for event in new:
+                q.put(event)
+
+    def _run(self):
+        while not self._stop.wait(self.poll):
+            try:
+                self.refresh()
+            except (OSError, ValueError) as e:
+                print(f"⚠️  读取推送事件失败: {e}")
+
+    def subscribe(self, last_id=None):
+        """
+        订阅新事件
+
+        参数:
+            last_id: 客户端收到的最后一个事件序号（Last-Event-ID）
+        返回: (队列, 需要补发的事件, 是否需要 reset)；last_id 早于保留范围时需要 reset
+        """
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers.add(q)
+            if last_id is None or last_id >= self.last_seq:
+                return q, [], False
+            if not self.events or self.events[0]['seq'] > last_id + 1:
+                return q, [], True
+            return q, [e for e in self.events if e['seq'] > last_id], False
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    @property
+    def clients(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def stop(self):
+        self._stop.set()
+
+
+def _sse(event):
+    """事件 → SSE 帧（event 名为事件类型，id 为序号）"""
+    data = json.dumps(event, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event['seq']}\nevent: {event['kind']}\ndata: {data}\n\n".encode('utf-8')
+
+
+# ---------- HTTP ----------
+
+def _not_modified(headers, etag, modified):
+    """条件请求是否命中：If-None-Match 优先，其次 If-Modified-Since（秒级）"""
+    match = headers.get('If-None-Match')
+    if match:
+        return etag in [tag.strip() for tag in match.split(',')] or match.strip() == '*'
+    since = headers.get('If-Modified-Since')
+    if since and modified:
+        try:
+            return int(modified) <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """/api/* 转给 QueryService，其余路径按 site_dir 下的静态文件提供"""
+
+    service = None
+    hub = None
+    site_dir = None
+    quiet = False
+    server_version = 'StockQuery/1.0'
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        try:
+            if path == '/api/stream':
+                self._stream(head)
+            elif path.startswith('/api/'):
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                body, etag, modified = self.service.query(path[len('/api/'):], params)
+                self._respond(body, 'application/json; charset=utf-8', etag, modified, head)
+            else:
+                self._static(path, head)
+        except QueryError as e:
+            self._error(e.status, str(e), head)
+        except Exception as e:
+            self._error(HTTPStatus.INTERNAL_SERVER_ERROR, f"{type(e).__name__}: {e}", head)
+
+    def _stream(self, head=False):
+        """server-sent events：先按 Last-Event-ID 补发，之后推送新事件，空闲时发送心跳"""
+        try:
+            last_id = int(self.headers.get('Last-Event-ID', ''))
+        except ValueError:
+            last_id = None
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.end_headers()
+        if head:
+            return
+
+        q, backlog, reset = self.hub.subscribe(last_id)
+        try:
+            self.wfile.write(f"retry: {RETRY_MS}\n\n".encode('utf-8'))
+            if reset:
+                self.wfile.write(_sse({'seq': self.hub.last_seq, 'kind': 'reset'}))
+            for event in backlog:
+                self.wfile.write(_sse(event))
+            self.wfile.flush()
+            while not self.hub.stopped:
+                try:
+                    event = q.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    self.wfile.write(b": ping\n\n")
+                else:
+                    self.wfile.write(_sse(event))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.hub.unsubscribe(q)
+
+    def _static(self, path, head):
+        root = Path(self.site_dir).resolve()
+        target = (root / path.lstrip('/')).resolve()
+        if target.is_dir():
+            target = target / 'index.html'
+        if root not in target.parents and target != root or not target.is_file():
+            raise QueryError(f"文件不存在: {path}", HTTPStatus.NOT_FOUND)
+        st = target.stat()
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+        content_type = mimetypes.guess_type(target.name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/json', 'application/javascript'):
+            content_type += '; charset=utf-8'
+        if _not_modified(self.headers, etag, st.st_mtime):
+            self._respond(None, content_type, etag, st.st_mtime, head)
+            return
+        self._respond(target.read_bytes(), content_type, etag, st.st_mtime, head)
+
+    def _respond(self, body, content_type, etag, modified, head=False):
+        """发送响应；条件请求命中或 body 为 None 时返回 304"""
+        if body is None or _not_modified(self.headers, etag, modified):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        if modified:
+            self.send_header('Last-Modified', formatdate(modified, usegmt=True))
+        # 允许浏览器缓存，但每次使用前向服务器确认（配合 ETag 返回 304）
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _error(self, status, message, head=False):
+        body = json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(site_dir, archive_dir=None, store_dir=None, host='127.0.0.1', port=8000, quiet=False,
+                cache_size=CACHE_SIZE):
+    """
+    创建查询服务（未启动）
+
+    参数:
+        site_dir: 静态文件根目录（含 index.html 和 data/）
+        archive_dir, store_dir: 默认为 site_dir/data/archive 和 site_dir/data/store
+    """
+    data_dir = Path(site_dir) / 'data'
+    store_dir = store_dir or data_dir / 'store'
+    service = QueryService(archive_dir or data_dir / 'archive', store_dir, cache_size)
+    hub = PushHub(events_path(store_dir))
+    handler = type('Handler', (QueryHandler,), {'service': service, 'hub': hub, 'site_dir': str(site_dir),
+                                                'quiet': quiet})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description='本地查询服务：存档/历史数据的条件查询接口和静态文件（支持 ETag/304）')
+    ap.add_argument('--site-dir', default='site', help='静态文件根目录（含 index.html 和 data/）')
+    ap.add_argument('--archive-dir', default=None, help='存档目录（默认 <site-dir>/data/archive）')
+    ap.add_argument('--store-dir', default=None, help='数据存储目录（默认 <site-dir>/data/store）')
+    ap.add_argument('--host', default='127.0.0.1', help='监听地址')
+    ap.add_argument('--port', type=int, default=8000, help='端口')
+    ap.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='内存缓存的查询结果数')
+    ap.add_argument('--quiet', action='store_true', help='不打印访问日志')
+    args = ap.parse_args()
+
+    server = make_server(args.site_dir, args.archive_dir, args.store_dir, args.host, args.port, args.quiet,
+                         args.cache_size)
+    print(f"🌐 查询服务: http://{args.host}:{args.port}/  （静态文件 {args.site_dir}，接口 /api/，推送 /api/stream）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 已停止")
+    finally:
+        server.RequestHandlerClass.hub.stop()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
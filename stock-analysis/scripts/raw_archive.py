@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+原始数据存档
+每个交易日抓取的原始数据（板块、个股、指数、大盘指数）与派生的 archive/<date>.json 一起保存，
+供 reprocess.py 在公式变化后重算历史：
+    archive/raw/2025-11-20/boards.csv.gz
+    archive/raw/2025-11-20/stocks.csv.gz
+    archive/raw/2025-11-20/indices.csv.gz
+    archive/raw/2025-11-20/market_indices.csv.gz
+
+输入哈希按解压后的 CSV 内容计算（gzip 头不含时间戳，内容不变则文件不变）
+
+交易时间内每5分钟的快照先写入暂存目录 store/raw_pending/<date>/（不提交到仓库），
+收盘后由 promote_pending 移入存档，每个交易日的原始数据只进入仓库一次
+"""
+import gzip
+import hashlib
+import os
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+RAW_FRAMES = ('boards', 'stocks', 'indices', 'market_indices')
+
+# 代码类列按字符串读取，避免 '000001' 之类被解析为整数
+TEXT_COLUMNS = {'date': str, 'bk_code': str, 'ts_code': str, 'index_code': str}
+
+
+def raw_dir(archive_dir, date_str):
+    return Path(archive_dir) / 'raw' / date_str
+
+
+def pending_dir(store_dir, date_str):
+    return Path(store_dir) / 'raw_pending' / date_str
+
+
+def list_raw_dates(archive_dir):
+    """有完整原始数据的交易日（升序）"""
+    root = Path(archive_dir) / 'raw'
+    if not root.exists():
+        return []
+    dates = []
+    for d in sorted(root.iterdir()):
+        try:
+            date.fromisoformat(d.name)
+        except ValueError:
+            continue
+        if all((d / f"{name}.csv.gz").exists() for name in RAW_FRAMES):
+            dates.append(d.name)
+    return dates
+
+
+def save_frames(raw, folder):
+    """把四个原始 DataFrame 原子写入 folder/<name>.csv.gz"""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    for name, df in zip(RAW_FRAMES, raw):
+        path = folder / f"{name}.csv.gz"
+        tmp = folder / f".{name}.csv.gz.tmp"
+        df = df if df is not None else pd.DataFrame()
+        df.to_csv(tmp, index=False, compression={'method': 'gzip', 'mtime': 0})
+        os.replace(tmp, path)
+
+
+def load_frames(folder):
+    """读取 folder 下的四个原始 DataFrame，缺失返回 None"""
+    folder = Path(folder)
+    frames = []
+    for name in RAW_FRAMES:
+        path = folder / f"{name}.csv.gz"
+        if not path.exists():
+            return None
+        try:
+            frames.append(pd.read_csv(path, dtype=TEXT_COLUMNS))
+        except pd.errors.EmptyDataError:
+            frames.append(pd.DataFrame())
+    return tuple(frames)
+
+
+def frames_hash(folder):
+    """原始数据内容哈希，缺失返回 None"""
+    folder = Path(folder)
+    h = hashlib.sha256()
+    for name in RAW_FRAMES:
+        path = folder / f"{name}.csv.gz"
+        if not path.exists():
+            return None
+        with gzip.open(path, 'rb') as f:
+            h.update(name.encode('utf-8'))
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def save_raw(raw, archive_dir, date_str, store_dir=None):
+    """
+    保存原始数据（每个文件原子写入）
+
+    参数:
+        raw: (boards, stocks, indices, market_indices) 四个 DataFrame
+        store_dir: 给出时写入暂存目录（盘中快照），收盘后由 promote_pending 移入存档
+    返回:
+        输入哈希（与移入存档后的哈希相同）
+    """
+    folder = pending_dir(store_dir, date_str) if store_dir else raw_dir(archive_dir, date_str)
+    save_frames(raw, folder)
+    return frames_hash(folder)
+
+
+def promote_pending(store_dir, archive_dir, through):
+    """
+    把暂存的原始数据中日期不晚于 through 的移入存档（已收盘的交易日）
+
+    返回: 移入的日期列表
+    """
+    root = Path(store_dir) / 'raw_pending'
+    if not root.exists():
+        return []
+    promoted = []
+    for d in sorted(root.iterdir()):
+        try:
+            date.fromisoformat(d.name)
+        except ValueError:
+            continue
+        if d.name > through or not all((d / f"{name}.csv.gz").exists() for name in RAW_FRAMES):
+            continue
+        target = raw_dir(archive_dir, d.name)
+        target.mkdir(parents=True, exist_ok=True)
+        for name in RAW_FRAMES:
+            os.replace(d / f"{name}.csv.gz", target / f"{name}.csv.gz")
+        for leftover in d.iterdir():
+            leftover.unlink()
+        d.rmdir()
+        promoted.append(d.name)
+    return promoted
+
+
+def load_raw(archive_dir, date_str):
+    """读取原始数据，缺失返回 None"""
+    return load_frames(raw_dir(archive_dir, date_str))
+
+
+def raw_input_hash(archive_dir, date_str):
+    """原始数据内容哈希，缺失返回 None"""
+    return frames_hash(raw_dir(archive_dir, date_str))
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+市场节奏引擎
+- 大小盘强弱差 spread = 沪深300涨幅 - 中证1000涨幅
+- spread 的 EWMA 平滑，用滚动波动率缩放的阈值判断 OFFENSE/DEFENSE/NEUTRAL
+- risk_on 广度：沪深300/中证1000/上证指数中上涨的比例
+
+regime_series() 一次向量化计算整段历史；
+RegimeState 保存少量状态（EWMA 值和滚动窗口），每个新快照 O(1) 更新，结果与整段计算一致
+"""
+import json
+import os
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+REGIME_PARAMS = {
+    'ewm_span': 5,          # spread 的 EWMA 跨度（交易日）
+    'vol_window': 20,       # 滚动波动率窗口（交易日）
+    'vol_k': 0.5,           # 阈值 = vol_k × 滚动波动率
+    'min_threshold': 0.002, # 阈值下限（即原固定阈值）
+}
+
+# 计算 risk_on 广度的指数
+BREADTH_CODES = ['HS300', 'CSI1000', 'SHCOMP']
+
+
+def classify(value, threshold):
+    """按阈值判断市场节奏：大盘明显强 → DEFENSE，小盘明显强 → OFFENSE"""
+    if value > threshold:
+        return "DEFENSE"
+    if value < -threshold:
+        return "OFFENSE"
+    return "NEUTRAL"
+
+
+def regime_series(ret_wide: pd.DataFrame, params=None):
+    """
+    一次向量化计算整段历史的市场节奏
+
+    参数:
+        ret_wide: 索引为日期、列为指数代码的涨跌幅（小数）宽表
+    返回:
+        DataFrame(index=date): spread, spread_ewm, vol, threshold, breadth, risk_on, advice
+    """
+    p = dict(REGIME_PARAMS, **(params or {}))
+    ret_wide = ret_wide.sort_index()
+    cols = ret_wide.reindex(columns=sorted(set(BREADTH_CODES) | {'HS300', 'CSI1000'}))
+
+    spread = cols['HS300'] - cols['CSI1000']
+    valid = spread.dropna()
+
+    ewm = valid.ewm(span=p['ewm_span'], adjust=False).mean()
+    vol = valid.rolling(p['vol_window'], min_periods=2).std(ddof=0)
+    threshold = np.maximum(p['min_threshold'], (p['vol_k'] * vol).fillna(0.0))
+
+    breadth_block = cols[BREADTH_CODES]
+    breadth = (breadth_block > 0).sum(axis=1) / len(BREADTH_CODES)
+    complete = breadth_block.notna().all(axis=1)
+
+    out = pd.DataFrame(index=ret_wide.index)
+    out['spread'] = spread
+    out['spread_ewm'] = ewm.reindex(out.index)
+    out['vol'] = vol.reindex(out.index)
+    out['threshold'] = threshold.reindex(out.index)
+    out['breadth'] = breadth.where(complete)
+    out['risk_on'] = complete & (breadth >= 2 / 3)
+
+    advice = np.where(out['spread_ewm'] > out['threshold'], "DEFENSE",
+                      np.where(out['spread_ewm'] < -out['threshold'], "OFFENSE", "NEUTRAL"))
+    out['advice'] = np.where(out['spread_ewm'].notna(), advice, "NEUTRAL")
+    return out
+
+
+class RegimeState:
+    """
+    市场节奏的增量状态
+    同一日期重复更新（盘中多次快照）时先回退到该日之前的状态，保证幂等
+    """
+
+    def __init__(self, params=None):
+        self.params = dict(REGIME_PARAMS, **(params or {}))
+        self.date = None
+        self.ewm = None
+        self.window = deque(maxlen=self.params['vol_window'])
+        self.prev = None  # 最近一次更新之前的状态（用于同日重复更新）
+
+    def _snapshot(self):
+        return {'date': self.date, 'ewm': self.ewm, 'window': list(self.window)}
+
+    def _restore(self, snap):
+        self.date, self.ewm = snap['date'], snap['ewm']
+        self.window = deque(snap['window'], maxlen=self.params['vol_window'])
+
+    def update(self, date_str, rets):
+        """
+        用一个新快照更新状态（O(1)）
+
+        参数:
+            rets: {指数代码: 涨跌幅}
+        返回:
+            {spread, spread_ewm, vol, threshold, breadth, risk_on, advice}
+        """
+        if self.date is not None and date_str == self.date and self.prev is not None:
+            self._restore(self.prev)
+        elif self.date is not None and date_str < self.date:
+            raise ValueError(f"节奏状态已更新到 {self.date}，不能回退到 {date_str}")
+
+        p = self.params
+        hs300, csi1000 = rets.get('HS300'), rets.get('CSI1000')
+        spread = None
+        if hs300 is not None and csi1000 is not None and np.isfinite(hs300) and np.isfinite(csi1000):
+            spread = float(hs300 - csi1000)
+            self.prev = self._snapshot()
+            alpha = 2.0 / (p['ewm_span'] + 1)
+            self.ewm = spread if self.ewm is None else alpha * spread + (1 - alpha) * self.ewm
+            self.window.append(spread)
+            self.date = date_str
+
+        vol = float(np.std(self.window)) if len(self.window) >= 2 else None
+        threshold = max(p['min_threshold'], p['vol_k'] * vol) if vol is not None else p['min_threshold']
+
+        values = [rets.get(code) for code in BREADTH_CODES]
+        complete = all(v is not None and np.isfinite(v) for v in values)
+        breadth = sum(v > 0 for v in values) / len(values) if complete else None
+
+        return {
+            'spread': spread,
+            'spread_ewm': self.ewm if spread is not None else None,
+            'vol': vol,
+            'threshold': threshold,
+            'breadth': breadth,
+            'risk_on': bool(complete and breadth >= 2 / 3),
+            'advice': classify(self.ewm, threshold) if spread is not None else "NEUTRAL",
+        }
+
+    @classmethod
+    def from_series(cls, ret_wide, params=None):
+        """由整段历史初始化状态（冷启动），最后一天通过 update 应用以便同日重复更新"""
+        state = cls(params)
+        ret_wide = ret_wide.sort_index()
+        series = regime_series(ret_wide, state.params)
+        spread = series['spread'].dropna()
+        if spread.empty:
+            return state
+
+        head = spread.index[:-1]
+        if len(head):
+            state.date = str(head[-1])
+            state.ewm = float(series.loc[head[-1], 'spread_ewm'])
+            state.window.extend(spread.loc[head].tail(state.params['vol_window']).astype(float).tolist())
+
+        last = spread.index[-1]
+        state.update(str(last), ret_wide.loc[last].dropna().to_dict())
+        return state
+
+    def to_dict(self):
+        return {'params': self.params, 'state': self._snapshot(), 'prev': self.prev}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data.get('params'))
+        state._restore(data['state'])
+        state.prev = data.get('prev')
+        return state
+
+    @classmethod
+    def load(cls, path):
+        """加载状态文件，不存在返回 None"""
+        if not path or not Path(path).exists():
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls.from_dict(json.load(f))
+        except Exception as e:
+            print(f"⚠️  读取节奏状态失败: {e}")
+            return None
+
+    def save(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
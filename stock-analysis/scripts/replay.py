@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+快照回放
+把录制的原始快照按时间顺序逐个送入完整的 etl_daily 流水线（raw → ... → history），
+用于复现盘中某一时段的输出变化、检验公式修改对盘中信号的影响，并兼作吞吐基准：
+
+- 快照来源：etl_daily.py --record-dir 录制的盘中快照（<dir>/<date>/<HHMM>/），
+  或存档的每日原始数据（archive/raw/<date>/，视为当日 15:00 的快照）
+- 每个周期把 etl_daily 的模拟时钟设为快照时刻，is_trading_day / is_trading_time、
+  快照时段、当天日期都按模拟时钟判断
+- --speed 0 时尽可能快地回放；--speed N 时按 N 倍速等待快照间隔（午休、隔夜按 MAX_GAP_SECONDS 计）
+- 所有输出写入独立的工作目录（daily.json、archive/、store/、流水线缓存），不影响线上数据
+- 每个周期报告耗时、执行的阶段、市场节奏、新上榜板块数和 Top 板块变化，最后汇总延迟分位数和吞吐
+
+示例:
+    python etl_daily.py --mode EASTMONEY --record-dir site/data/recordings
+    python replay.py --source site/data/recordings --work-dir /tmp/replay --seed-archive site/data/archive
+"""
+import contextlib
+import io
+import json
+import re
+import shutil
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import etl_daily
+from raw_archive import RAW_FRAMES
+
+BEIJING_TZ = timezone(timedelta(hours=8))
+
+# 存档原始数据没有时刻，视为收盘快照
+DAILY_SNAPSHOT_TIME = (15, 0)
+
+# 按倍速回放时，快照间隔超过该值（午休、隔夜）按该值等待
+MAX_GAP_SECONDS = 300
+
+
+def snapshot_time(folder):
+    """快照目录对应的北京时间，无法识别返回 None"""
+    folder = Path(folder)
+    try:
+        if re.fullmatch(r'\d{4}', folder.name):
+            day = date.fromisoformat(folder.parent.name)
+            hour, minute = int(folder.name[:2]), int(folder.name[2:])
+        else:
+            day = date.fromisoformat(folder.name)
+            hour, minute = DAILY_SNAPSHOT_TIME
+        return datetime(day.year, day.month, day.day, hour, minute, tzinfo=BEIJING_TZ)
+    except ValueError:
+        return None
+
+
+def discover_snapshots(sources, start=None, end=None):
+    """
+    在来源目录中查找完整的原始快照（四个 csv.gz 齐全）
+
+    参数:
+        start, end: 日期范围 YYYY-MM-DD（含两端）
+    返回: [(datetime, folder), ...]，按时间升序，同一时刻只保留第一个来源
+    """
+    found = {}
+    for source in sources:
+        for marker in sorted(Path(source).rglob(f"{RAW_FRAMES[0]}.csv.gz")):
+            folder = marker.parent
+            if not all((folder / f"{name}.csv.gz").exists() for name in RAW_FRAMES):
+                continue
+            ts = snapshot_time(folder)
+            if ts is None:
+                continue
+            day = ts.date().isoformat()
+            if (start and day < start) or (end and day > end):
+                continue
+            found.setdefault(ts, folder)
+    return sorted(found.items())
+
+
+def seed_archive(source_dir, archive_dir, before):
+    """把来源存档中早于 before 的交易日写入工作目录（新上榜检测、历史和市场节奏需要的上下文）"""
+    from generate_history import list_archive_dates, load_archive
+
+    count = 0
+    for date_str in list_archive_dates(source_dir):
+        if date_str >= before:
+            continue
+        data = load_archive(source_dir, date_str)
+        if data:
+            etl_daily.write_archive(data, archive_dir)
+            count += 1
+    return count
+
+
+def etl_args(work_dir, snapshot, enable_history=False, history_days=7, params=None):
+    """回放周期的 etl_daily 参数（所有输出都在工作目录内）"""
+    work = Path(work_dir)
+    argv = ["--mode", "REPLAY", "--replay-snapshot", str(snapshot),
+            "--out", str(work / "daily.json"), "--archive-dir", str(work / "archive"),
+            "--store-dir", str(work / "store"), "--cache-dir", str(work / "cache"),
+            "--history-days", str(history_days)]
+    if enable_history:
+        argv.append("--enable-history")
+    if params:
+        argv += ["--params", params]
+    return etl_daily.build_parser().parse_args(argv)
+
+
+def top_boards(daily):
+    """daily.json 中的行业 + 概念 Top 板块"""
+    return [b for key in ("industry_boards", "concept_boards") for b in daily.get(key, [])]
+
+
+def run_cycle(args, ts, check_trading=True, quiet=True):
+    """
+    以快照时刻为模拟时钟执行一次流水线
+
+    返回: 周期记录，非交易时间的快照返回 None
+    """
+    etl_daily.SIM_NOW = ts
+    try:
+        if check_trading and not etl_daily.is_trading_day():
+            return None
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out) if quiet else contextlib.nullcontext():
+                started = time.perf_counter()
+                pipeline = etl_daily.build_pipeline(args)
+                plan = pipeline.run()
+                seconds = time.perf_counter() - started
+                daily = pipeline.value("daily")
+        except Exception:
+            # 静默模式下失败时输出被吞掉的日志
+            print(out.getvalue())
+            raise
+    finally:
+        etl_daily.SIM_NOW = None
+
+    return {
+        "time": ts.strftime("%Y-%m-%d %H:%M"),
+        "seconds": seconds,
+        "stages": {p["stage"]: round(p["seconds"], 4) for p in plan if p["stale"]},
+        "advice": daily["market"]["advice"],
+        "new_boards": sum(1 for b in top_boards(daily) if b.get("is_new")),
+        "top": [b["code"] for b in top_boards(daily)],
+    }
+
+
+def replay(snapshots, work_dir, speed=0.0, enable_history=False, history_days=7, params=None,
+           check_trading=True, quiet=True):
+    """
+    按顺序回放快照
+
+    参数:
+        speed: 0=尽可能快；N=按 N 倍速等待快照之间的间隔
+    返回: 周期记录列表（含 churn：与上一周期相比新进入 Top 板块的数量）
+    """
+    cycles = []
+    prev_ts, prev_top, prev_advice = None, None, None
+    for ts, folder in snapshots:
+        if speed > 0 and prev_ts is not None:
+            gap = min((ts - prev_ts).total_seconds(), MAX_GAP_SECONDS)
+            time.sleep(max(gap, 0) / speed)
+        prev_ts = ts
+
+        args = etl_args(work_dir, folder, enable_history, history_days, params)
+        cycle = run_cycle(args, ts, check_trading, quiet)
+        if cycle is None:
+            print(f"⏭️  {ts:%Y-%m-%d %H:%M} 非交易时间，跳过")
+            continue
+        cycle["churn"] = len(set(cycle["top"]) - set(prev_top)) if prev_top is not None else 0
+        cycle["advice_changed"] = prev_advice is not None and cycle["advice"] != prev_advice
+        prev_top, prev_advice = cycle["top"], cycle["advice"]
+        cycles.append(cycle)
+
+        stages = ", ".join(f"{k} {v * 1000:.0f}ms" for k, v in cycle["stages"].items()) or "全部复用缓存"
+        flag = " 🔄" if cycle["advice_changed"] else ""
+        print(f"⏱️  {cycle['time']}  {cycle['seconds'] * 1000:7.0f}ms  {cycle['advice']:<8}{flag} "
+              f"新上榜 {cycle['new_boards']:>2}  Top变化 {cycle['churn']:>2}  [{stages}]")
+    return cycles
+
+
+def summarize(cycles):
+    """延迟分位数与吞吐"""
+    import numpy as np
+
+    if not cycles:
+        return {}
+    lat = np.array([c["seconds"] for c in cycles])
+    stage_totals = {}
+    for c in cycles:
+        for name, sec in c["stages"].items():
+            stage_totals[name] = stage_totals.get(name, 0.0) + sec
+    return {
+        "cycles": len(cycles),
+        "total_seconds": round(float(lat.sum()), 4),
+        "mean_ms": round(float(lat.mean()) * 1000, 1),
+        "p50_ms": round(float(np.percentile(lat, 50)) * 1000, 1),
+        "p95_ms": round(float(np.percentile(lat, 95)) * 1000, 1),
+        "max_ms": round(float(lat.max()) * 1000, 1),
+        "throughput": round(len(cycles) / float(lat.sum()), 2) if lat.sum() > 0 else None,
+        "stage_mean_ms": {k: round(v / len(cycles) * 1000, 1) for k, v in stage_totals.items()},
+        "advice_changes": sum(1 for c in cycles if c["advice_changed"]),
+    }
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description='按模拟时钟回放录制的原始快照，驱动完整的 ETL 流水线')
+    ap.add_argument('--source', action='append', required=True,
+                    help='快照来源目录（--record-dir 录制目录或 archive/raw，可重复）')
+    ap.add_argument('--work-dir', default='.replay', help='回放工作目录（daily.json、存档、存储、缓存）')
+    ap.add_argument('--seed-archive', default=None, help='用该存档中早于首个快照的交易日初始化工作目录')
+    ap.add_argument('--from', dest='start', default=None, help='起始日期 YYYY-MM-DD')
+    ap.add_argument('--to', dest='end', default=None, help='结束日期 YYYY-MM-DD')
+    ap.add_argument('--speed', type=float, default=0, help='回放倍速（0=尽可能快）')
+    ap.add_argument('--enable-history', action='store_true', help='每个周期同时生成 history.json')
+    ap.add_argument('--history-days', type=int, default=7, help='历史数据天数')
+    ap.add_argument('--params', default=None, help='评分参数文件（与 etl_daily.py --params 相同）')
+    ap.add_argument('--skip-trading-day-check', action='store_true', help='不按模拟时钟跳过非交易时间的快照')
+    ap.add_argument('--keep', action='store_true', help='保留工作目录中已有的数据（默认清空后回放）')
+    ap.add_argument('--report', default=None, help='把周期记录和汇总写入 JSON 文件')
+    ap.add_argument('--verbose', action='store_true', help='显示流水线各阶段的输出')
+    args = ap.parse_args()
+
+    snapshots = discover_snapshots(args.source, args.start, args.end)
+    if not snapshots:
+        print("❌ 未找到可回放的原始快照")
+        return
+    print(f"🎬 回放 {len(snapshots)} 个快照: {snapshots[0][0]:%Y-%m-%d %H:%M} → {snapshots[-1][0]:%Y-%m-%d %H:%M}"
+          f"（{'尽可能快' if args.speed <= 0 else f'{args.speed:g} 倍速'}）")
+
+    work = Path(args.work_dir)
+    if work.exists() and not args.keep:
+        shutil.rmtree(work)
+    work.mkdir(parents=True, exist_ok=True)
+    if args.seed_archive:
+        count = seed_archive(args.seed_archive, work / "archive", snapshots[0][0].date().isoformat())
+        print(f"📁 初始化存档: {count} 个交易日")
+
+    cycles = replay(snapshots, work, args.speed, args.enable_history, args.history_days, args.params,
+                    check_trading=not args.skip_trading_day_check, quiet=not args.verbose)
+    summary = summarize(cycles)
+    if not summary:
+        print("⚠️  没有在交易时间内的快照")
+        return
+
+    print("\n" + "=" * 60)
+    print(f"✅ 回放完成: {summary['cycles']} 个周期，共 {summary['total_seconds']:.2f}s，"
+          f"吞吐 {summary['throughput']} 周期/秒")
+    print(f"   延迟: 平均 {summary['mean_ms']}ms  p50 {summary['p50_ms']}ms  "
+          f"p95 {summary['p95_ms']}ms  最大 {summary['max_ms']}ms")
+    print("   阶段平均耗时: " + ", ".join(f"{k} {v}ms" for k, v in summary['stage_mean_ms'].items()))
+    print(f"   市场节奏切换: {summary['advice_changes']} 次")
+    print("=" * 60)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({"summary": summary, "cycles": cycles}, f, ensure_ascii=False, indent=2)
+        print(f"📝 报告: {args.report}")
+
+
+if __name__ == '__main__':
+    main()
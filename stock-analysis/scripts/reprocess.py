@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+存档重算
+修改 board_metrics / core_stocks 等公式后，用存档的原始数据（archive/raw/<date>/）重新计算每天的因子，
+原子覆盖 archive/<date>.json，使整段历史使用同一版本的公式
+
+- 每天在进程池中独立重算（板块/个股因子只依赖当天原始数据）
+- 个股时序特征（N日涨幅、连续涨停、换手率分位）从个股存储按日期只读查询
+- 市场节奏依赖历史序列，先由全部存档一次向量化计算，再写入对应日期
+- 存档 meta 中的公式版本和输入哈希都未变化的日期跳过
+- 没有原始数据的旧存档无法重算，保持原样
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from etl_daily import (compute_factors, daily_payload, data_status, factor_version, load_params,
+                       normalize_frames, process_boards, write_archive)
+from generate_history import load_archive, load_index_returns
+from raw_archive import list_raw_dates, load_raw, raw_input_hash
+from stock_store import stock_features
+
+
+def plan(archive_dir, version, force=False):
+    """
+    需要重算的日期
+
+    返回: [(date, input_hash, 原因), ...]
+    """
+    tasks = []
+    for date_str in list_raw_dates(archive_dir):
+        input_hash = raw_input_hash(archive_dir, date_str)
+        meta = (load_archive(archive_dir, date_str) or {}).get('meta', {})
+        if force:
+            reason = '强制重算'
+        elif not meta:
+            reason = '存档缺少版本信息'
+        elif meta.get('factor_version') != version:
+            reason = '公式版本变化'
+        elif meta.get('input_hash') != input_hash:
+            reason = '原始数据变化'
+        else:
+            continue
+        tasks.append((date_str, input_hash, reason))
+    return tasks
+
+
+def regime_rows(archive_dir, regime_params=None, store_dir=None):
+    """全部存档的节奏序列，返回 {date: {advice, risk_on, spread_ewm, threshold}}"""
+    from regime import regime_series
+
+    ret_wide = load_index_returns(archive_dir, store_dir=store_dir)
+    if ret_wide.empty:
+        return {}
+    series = regime_series(ret_wide, regime_params)
+    rows = {}
+    for date_str, row in series.iterrows():
+        if row['spread_ewm'] != row['spread_ewm']:
+            continue
+        rows[date_str] = {
+            'advice': row['advice'],
+            'risk_on': bool(row['risk_on']),
+            'spread_ewm': float(row['spread_ewm']),
+            'threshold': float(row['threshold']),
+        }
+    return rows
+
+
+def reprocess_day(task):
+    """
+    重算一天并原子写入存档（在子进程中运行）
+
+    参数:
+        task: (archive_dir, store_dir, date_str, input_hash, params, version, regime_row)
+    返回:
+        (date_str, 是否成功, 信息)
+    """
+    archive_dir, store_dir, date_str, input_hash, params, version, regime_row = task
+    try:
+        raw = load_raw(archive_dir, date_str)
+        if raw is None:
+            return date_str, False, '原始数据缺失'
+
+        frames = normalize_frames(raw)
+        features = stock_features(frames['stocks'], store_dir, date_str) if store_dir else None
+        factors = compute_factors(frames, params=params, features=features)
+        indices = factors['indices']
+        if regime_row:
+            indices.update(regime_row)
+
+        # 新上榜标记依赖当时的历史，沿用原存档中的标记
+        old = load_archive(archive_dir, date_str) or {}
+        new_boards = {
+            t: {b['code'] for b in old.get(f'{t}_boards', []) if b.get('is_new')}
+            for t in ('industry', 'concept')
+        }
+        industry = process_boards(factors['boards'], factors['stocks'], 'industry', new_boards, top_n=10)
+        concept = process_boards(factors['boards'], factors['stocks'], 'concept', new_boards, top_n=10)
+
+        data = daily_payload(date_str, industry, concept, indices, factors['market_indices'], data_status(raw))
+        data['meta'] = {'factor_version': version, 'input_hash': input_hash}
+        write_archive(data, archive_dir)
+        return date_str, True, f"{len(industry)} 个行业板块, {len(concept)} 个概念板块"
+    except Exception as e:
+        return date_str, False, str(e)
+
+
+def reprocess(archive_dir, params=None, force=False, workers=None, dry_run=False, store_dir=None):
+    """
+    重算过期的存档
+
+    返回: {'updated': [...], 'failed': [...], 'skipped': 跳过的天数}
+    """
+    version = factor_version(params)
+    tasks = plan(archive_dir, version, force)
+    total = len(list_raw_dates(archive_dir))
+    print(f"🧭 公式版本 {version}: {total} 天有原始数据，需要重算 {len(tasks)} 天")
+    for date_str, _, reason in tasks:
+        print(f"  ▶️  {date_str}  {reason}")
+
+    result = {'updated': [], 'failed': [], 'skipped': total - len(tasks)}
+    if dry_run or not tasks:
+        return result
+
+    regimes = regime_rows(archive_dir, (params or {}).get('regime'), store_dir)
+    jobs = [(archive_dir, store_dir, d, h, params, version, regimes.get(d)) for d, h, _ in tasks]
+
+    if workers == 1:
+        outputs = map(reprocess_day, jobs)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        outputs = pool.map(reprocess_day, jobs)
+
+    try:
+        for date_str, ok, message in outputs:
+            if ok:
+                result['updated'].append(date_str)
+                print(f"  ✅ {date_str}: {message}")
+            else:
+                result['failed'].append(date_str)
+                print(f"  ❌ {date_str}: {message}")
+    finally:
+        if workers != 1:
+            pool.shutdown()
+    return result
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description='用存档的原始数据重算历史因子')
+    ap.add_argument('--archive-dir', default='site/data/archive', help='存档目录')
+    ap.add_argument('--store-dir', default=None, help='数据存储目录（个股时序特征，默认与存档目录同级的 store）')
+    ap.add_argument('--params', default=None, help='评分参数文件（与 etl_daily.py --params 相同）')
+    ap.add_argument('--workers', type=int, default=None, help='进程数（默认CPU核数，1=不使用进程池）')
+    ap.add_argument('--force', action='store_true', help='忽略版本信息，重算全部有原始数据的日期')
+    ap.add_argument('--dry-run', action='store_true', help='只显示需要重算的日期')
+    args = ap.parse_args()
+
+    store_dir = args.store_dir or str(Path(args.archive_dir).parent / 'store')
+    result = reprocess(args.archive_dir, load_params(args.params), args.force,
+                       args.workers or os.cpu_count(), args.dry_run, store_dir)
+    if not args.dry_run:
+        print(f"\n✅ 重算 {len(result['updated'])} 天，失败 {len(result['failed'])} 天，跳过 {result['skipped']} 天")
+        if result['updated']:
+            print("💡 存档已更新，可重新运行 generate_history.py 生成 history.json")
+
+
+if __name__ == '__main__':
+    main()
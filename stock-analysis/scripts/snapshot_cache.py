@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+接口快照缓存（last-good）
+每个东方财富接口（以及逐板块的成分股请求）最近一次成功的结果连同时间戳保存在 store/snapshots/：
+    store/snapshots/boards_industry.json.gz
+    store/snapshots/boards_concept.json.gz
+    store/snapshots/board_stocks.json.gz   # 按板块代码分条，每条单独记录时间
+    store/snapshots/index_quotes.json.gz
+
+请求失败时，在 max_age 秒内的缓存结果代替实时数据（降级模式），
+并在返回的 DataFrame 上写入 stale_sec 列（数据距今秒数），由 etl_daily 汇总为 daily.json 的 data_status；
+超过 max_age 或没有缓存时返回 None，绝不以模拟数据代替
+"""
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+# 降级模式允许使用的最旧快照（秒）
+MAX_STALE_SECONDS = 1800
+
+STALE_COLUMN = 'stale_sec'
+
+
+class SnapshotCache:
+    """按 (接口, 子键) 保存最近一次成功结果；写入在 save() 时按接口原子落盘"""
+
+    def __init__(self, cache_dir, max_age=MAX_STALE_SECONDS):
+        self.cache_dir = Path(cache_dir)
+        self.max_age = max_age
+        self._entries = {}
+        self._dirty = set()
+        self.stale = {}  # {(接口, 子键): 使用的缓存距今秒数}
+
+    def _path(self, endpoint):
+        return self.cache_dir / f"{endpoint}.json.gz"
+
+    def _load(self, endpoint):
+        if endpoint not in self._entries:
+            entries = {}
+            path = self._path(endpoint)
+            if path.exists():
+                try:
+                    with gzip.open(path, 'rt', encoding='utf-8') as f:
+                        entries = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"⚠️  读取快照缓存 {endpoint} 失败: {e}")
+            self._entries[endpoint] = entries
+        return self._entries[endpoint]
+
+    def put(self, endpoint, df, key=''):
+        """记录一次成功结果"""
+        df = df.drop(columns=STALE_COLUMN, errors='ignore')
+        self._load(endpoint)[key] = {
+            'saved_at': time.time(),
+            'records': json.loads(df.to_json(orient='records', force_ascii=False)),
+            'columns': list(df.columns),
+        }
+        self._dirty.add(endpoint)
+
+    def get(self, endpoint, key=''):
+        """
+        取 max_age 内的缓存结果
+
+        返回: (DataFrame（含 stale_sec 列）, 距今秒数)；缓存过期返回 (None, 距今秒数)，没有缓存返回 (None, None)
+        """
+        entry = self._load(endpoint).get(key)
+        if not entry:
+            return None, None
+        age = time.time() - entry['saved_at']
+        if age > self.max_age:
+            return None, age
+        df = pd.DataFrame(entry['records'], columns=entry['columns'])
+        df[STALE_COLUMN] = int(age)
+        self.stale[(endpoint, key)] = int(age)
+        return df, age
+
+    def fetch(self, endpoint, func, key='', label=None):
+        """
+        实时请求，成功时写入缓存；失败（None 或空表）时降级使用缓存
+
+        返回: DataFrame，实时和缓存都不可用返回 None
+        """
+        df = func()
+        if df is not None and not df.empty:
+            self.put(endpoint, df, key)
+            return df
+        cached, age = self.get(endpoint, key)
+        label = label or endpoint
+        if cached is not None:
+            saved = datetime.fromtimestamp(time.time() - age).strftime('%H:%M:%S')
+            print(f"  [{label}] ♻️  请求失败，使用 {saved} 的缓存快照（{age / 60:.1f} 分钟前）")
+        elif age is not None:
+            print(f"  [{label}] ❌ 请求失败，缓存快照已过期（{age / 60:.1f} 分钟前，上限 {self.max_age / 60:.0f} 分钟）")
+        return cached
+
+    def save(self):
+        """把有更新的接口原子写回磁盘"""
+        if not self._dirty:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for endpoint in sorted(self._dirty):
+            path = self._path(endpoint)
+            tmp = path.with_name(f".{path.name}.tmp")
+            with gzip.GzipFile(tmp, 'wb', mtime=0) as f:
+                f.write(json.dumps(self._entries[endpoint], ensure_ascii=False).encode('utf-8'))
+            os.replace(tmp, path)
+        self._dirty.clear()
+
+
+def frame_staleness(df, key=None):
+    """
+    DataFrame 中降级使用的缓存数据的最大距今秒数
+
+    参数:
+        key: 提供时按该列分组，返回 {key值: 秒数}
+    返回: 秒数（没有陈旧数据为 None）或 {key值: 秒数}
+    """
+    if df is None or STALE_COLUMN not in df.columns:
+        return {} if key else None
+    stale = df[df[STALE_COLUMN].notna()]
+    if key:
+        if key not in stale.columns:
+            return {}
+        return {str(k): int(v) for k, v in stale.groupby(key)[STALE_COLUMN].max().items()}
+    return int(stale[STALE_COLUMN].max()) if not stale.empty else None
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
-from datetime import date, timedelta
+from datetime import timedelta
 
 def load_mock():
-    d = date.today().isoformat()
+    from eastmoney import beijing_today
+    d = beijing_today()
     # —— 模拟板块
     bk = pd.DataFrame([
         ["BK001","半导体", 103,100, 12e9, 120, 8],
@@ -50,22 +51,25 @@ def load_csv(board_csv, stock_csv, index_csv):
     market_idx = pd.DataFrame()
     return bk, stk, idx, market_idx
 
-def load_api(api_key:str=""):
+def load_api(api_key:str="", cache_dir=None, max_stale=None, budget_seconds=None, queue_path=None):
     """
     从东方财富获取真实行情数据
+    失败时直接抛出异常（接口级降级由快照缓存处理，见 snapshot_cache.py），不以模拟数据代替
     """
-    try:
-        from eastmoney import load_eastmoney_data
-        return load_eastmoney_data(top_boards=20, stocks_per_board=10)
-    except Exception as e:
-        print(f"⚠️  东方财富数据获取失败: {e}")
-        print("⚠️  回退到 Mock 数据")
-        return load_mock()
+    from eastmoney import load_eastmoney_data
+    return load_eastmoney_data(top_boards=20, stocks_per_board=10, cache_dir=cache_dir, max_stale=max_stale,
+                               budget_seconds=budget_seconds, queue_path=queue_path)
 
-def load_eastmoney(top_boards=20, stocks_per_board=10):
+def load_eastmoney(top_boards=20, stocks_per_board=10, stock_mode='board', membership_path=None,
+                   cache_dir=None, max_stale=None, budget_seconds=None, queue_path=None, defer_membership=False):
     """
     直接从东方财富获取数据（推荐）
+    stock_mode: 'board'=逐板块请求成分股, 'market'=全市场行情 + 板块成分缓存
+    cache_dir: 接口快照缓存目录，接口失败时降级使用 max_stale 秒内的缓存（见 snapshot_cache.py）
+    budget_seconds: 抓取时间预算，到期时发布已完成的部分，未完成的板块写入 queue_path 下一轮优先（见 fetch_scheduler.py）
+    defer_membership: market 模式下过期的板块成分交给回填队列刷新（见 backfill_queue.py）
     返回: (boards_df, stocks_df, indices_df, market_indices_df)
     """
     from eastmoney import load_eastmoney_data
-    return load_eastmoney_data(top_boards, stocks_per_board)
+    return load_eastmoney_data(top_boards, stocks_per_board, stock_mode, membership_path, cache_dir, max_stale,
+                               budget_seconds, queue_path, defer_membership)
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+个股日线存储
+每个字段一个内存映射数组（个股编号 × 交易日），每天由行情快照追加一列：
+    store/stocks/meta.json          代码表、交易日表、容量、各股首次收录的交易日下标
+    store/stocks/close.bin          收盘价            float32
+    store/stocks/cum_log.bin        累计对数收益      float32（从本段连续收录的第一天起累计）
+    store/stocks/run_len.bin        连续收录天数      int16
+    store/stocks/lu_streak.bin      连续涨停天数      int16（-1=缺失日之后一直涨停，天数未知）
+    store/stocks/turnover_ratio.bin 换手率            float32
+    store/stocks/turnover_pct.bin   换手率在近N日中的分位  float32
+
+派生字段在写入当天时算好，查询“N日涨幅 / 连续涨停 / 换手率分位”都是按下标直接取值
+快照只包含热门板块的前N只个股，个股某天不在快照中视为缺失（各字段为 NaN/-1），不按0收益延续：
+N日涨幅要求最近N个交易日都有收录，窗口内有缺失时为 NaN；
+首次收录之后出现缺失日时，此后的连续涨停天数未知（直到某天未涨停），为 NaN
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 2
+
+FIELDS = {
+    'close': np.float32,
+    'cum_log': np.float32,
+    'run_len': np.int16,
+    'lu_streak': np.int16,
+    'turnover_ratio': np.float32,
+    'turnover_pct': np.float32,
+}
+
+# 缺失值：浮点字段为 NaN，连续收录为 0，连续涨停为 -1（未知）
+FILL = {'close': np.nan, 'cum_log': np.nan, 'run_len': 0, 'lu_streak': -1,
+        'turnover_ratio': np.nan, 'turnover_pct': np.nan}
+
+INITIAL_CAPACITY = (1024, 64)  # (个股, 交易日)
+
+# 换手率分位的回看窗口（交易日）
+TURNOVER_WINDOW = 60
+
+
+def default_store_root(store_dir):
+    return Path(store_dir) / 'stocks'
+
+
+def store_files(store_dir):
+    """存储的全部文件（流水线 factors 阶段声明的输出）"""
+    root = default_store_root(store_dir)
+    return [root / 'meta.json'] + [root / f"{field}.bin" for field in FIELDS]
+
+
+def limit_ratio(codes, names=None):
+    """
+    涨跌停幅度：创业板/科创板 20%，北交所 30%，ST 5%，其余 10%
+    """
+    codes = pd.Series(codes, dtype=str).reset_index(drop=True)
+    ratio = np.full(len(codes), 0.10)
+    ratio[codes.str.startswith(('300', '301', '688', '689')).to_numpy()] = 0.20
+    ratio[codes.str.startswith(('8', '4', '92')).to_numpy()] = 0.30
+    if names is not None:
+        is_st = pd.Series(names, dtype=str).reset_index(drop=True).str.contains('ST', na=False).to_numpy()
+        ratio[is_st] = 0.05
+    return ratio
+
+
+def is_limit_up(codes, names, close, prev_close):
+    """收盘价达到涨停价（按分四舍五入）"""
+    limit_price = np.round(np.asarray(prev_close, dtype=float) * (1 + limit_ratio(codes, names)), 2)
+    close = np.asarray(close, dtype=float)
+    return np.isfinite(close) & (close > 0) & (close >= limit_price - 0.005)
+
+
+class StockStore:
+    """个股 × 交易日的内存映射存储"""
+
+    def __init__(self, root, mode='r+'):
+        self.root = Path(root)
+        self.mode = mode
+        self.codes, self.dates, self.capacity = [], [], INITIAL_CAPACITY
+        self.first = []
+        meta = self.root / 'meta.json'
+        if meta.exists():
+            with open(meta, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == STORE_VERSION:
+                self.codes, self.dates, self.first = data['codes'], data['dates'], data['first']
+                self.capacity = tuple(data['capacity'])
+        self.code_index = pd.Index(self.codes)
+        self.date_pos = {d: i for i, d in enumerate(self.dates)}
+        self.arrays = {}
+        if self.dates:
+            self._open()
+
+    # ---------- 文件 ----------
+
+    def _path(self, field):
+        return self.root / f"{field}.bin"
+
+    def _open(self):
+        mode = 'r' if self.mode == 'r' else 'r+'
+        self.arrays = {f: np.memmap(self._path(f), dtype=dt, mode=mode, shape=self.capacity)
+                       for f, dt in FIELDS.items()}
+
+    def _allocate(self, capacity):
+        """按新容量重建数组文件（保留已有数据），新增部分填充缺失值"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        old = self.arrays
+        n_stocks, n_days = len(self.codes), len(self.dates)
+        for field, dtype in FIELDS.items():
+            tmp = self.root / f".{field}.bin.tmp"
+            arr = np.memmap(tmp, dtype=dtype, mode='w+', shape=capacity)
+            arr[:] = FILL[field]
+            if field in old:
+                arr[:n_stocks, :n_days] = old[field][:n_stocks, :n_days]
+            arr.flush()
+            del arr
+            os.replace(tmp, self._path(field))
+        self.arrays = {}
+        self.capacity = capacity
+        self._open()
+
+    def _ensure_capacity(self, n_stocks, n_days):
+        cap_s, cap_d = self.capacity
+        if self.arrays and n_stocks <= cap_s and n_days <= cap_d:
+            return
+        while n_stocks > cap_s:
+            cap_s *= 2
+        while n_days > cap_d:
+            cap_d *= 2
+        self._allocate((cap_s, cap_d))
+
+    def save(self):
+        """刷新数组并原子写入元数据"""
+        for arr in self.arrays.values():
+            arr.flush()
+        tmp = self.root / 'meta.json.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': STORE_VERSION, 'capacity': list(self.capacity),
+                       'dates': self.dates, 'codes': self.codes, 'first': self.first}, f, separators=(',', ':'))
+        os.replace(tmp, self.root / 'meta.json')
+
+    # ---------- 写入 ----------
+
+    def record_day(self, date_str, stocks):
+        """
+        写入一个交易日的个股快照（同一天重复写入时覆盖该日）
+
+        参数:
+            stocks: DataFrame(ts_code, name, close, prev_close, turnover_ratio)，可含重复代码
+        返回:
+            True=已写入; False=日期早于最新交易日（不支持回补）
+        """
+        if self.dates and date_str < self.dates[-1]:
+            return False
+
+        stocks = stocks.drop_duplicates('ts_code')
+        new_codes = [c for c in pd.unique(stocks['ts_code']) if c not in self.code_index]
+        rerecord = bool(self.dates) and date_str == self.dates[-1]
+        n_days = len(self.dates) + (0 if rerecord else 1)
+        self._ensure_capacity(len(self.codes) + len(new_codes), n_days)
+
+        if not rerecord:
+            self.dates.append(date_str)
+            self.date_pos[date_str] = len(self.dates) - 1
+        t = self.date_pos[date_str]
+        if new_codes:
+            self.codes.extend(new_codes)
+            self.first.extend([t] * len(new_codes))
+            self.code_index = pd.Index(self.codes)
+        a = self.arrays
+
+        # 先按“全部缺失”初始化当天，再写入快照中的个股
+        for field in FIELDS:
+            a[field][:, t] = FILL[field]
+
+        ids = self.code_index.get_indexer(stocks['ts_code'])
+        close = stocks['close'].to_numpy(float)
+        prev_close = stocks['prev_close'].to_numpy(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_ret = np.log(close / prev_close)
+        log_ret = np.where(np.isfinite(log_ret), log_ret, 0.0)
+        limit_up = is_limit_up(stocks['ts_code'], stocks.get('name'), close, prev_close)
+
+        # 前一交易日未收录的个股从当天重新开始累计；当天首次收录的个股连续涨停从0开始计
+        if t > 0:
+            prev_run = a['run_len'][ids, t - 1]
+            prev_cum = np.where(prev_run > 0, a['cum_log'][ids, t - 1], 0.0)
+            prev_streak = np.where(np.asarray(self.first)[ids] >= t, 0, a['lu_streak'][ids, t - 1])
+        else:
+            prev_run = np.zeros(len(ids), dtype=np.int16)
+            prev_cum = np.zeros(len(ids))
+            prev_streak = np.zeros(len(ids), dtype=np.int16)
+        a['close'][ids, t] = close
+        a['cum_log'][ids, t] = prev_cum + log_ret
+        a['run_len'][ids, t] = np.minimum(prev_run.astype(int) + 1, np.iinfo(np.int16).max)
+        a['lu_streak'][ids, t] = np.where(limit_up, np.where(prev_streak >= 0, prev_streak + 1, -1), 0)
+
+        turnover = stocks['turnover_ratio'].to_numpy(float) if 'turnover_ratio' in stocks else np.full(len(ids), np.nan)
+        a['turnover_ratio'][ids, t] = turnover
+        a['turnover_pct'][ids, t] = self._window_percentile(ids, t, turnover)
+
+        self.save()
+        return True
+
+    def _window_percentile(self, ids, t, values):
+        """当天换手率在该股近 TURNOVER_WINDOW 个交易日（含当天）中的分位（0~1）"""
+        window = np.asarray(self.arrays['turnover_ratio'][ids, max(0, t - TURNOVER_WINDOW + 1):t + 1], dtype=float)
+        x = values[:, None]
+        valid = np.isfinite(window)
+        below = ((window < x) & valid).sum(axis=1)
+        equal = ((window == x) & valid).sum(axis=1)
+        count = valid.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct = (below + 0.5 * equal) / count
+        return np.where(np.isfinite(values) & (count > 0), pct, np.nan)
+
+    # ---------- 查询 ----------
+
+    def position(self, as_of=None):
+        """交易日下标（默认最新），不存在返回 None"""
+        if not self.dates:
+            return None
+        return self.date_pos.get(as_of) if as_of else len(self.dates) - 1
+
+    def features(self, codes, as_of=None, horizons=(5, 20)):
+        """
+        个股时序特征
+
+        返回:
+            DataFrame(ts_code, ret_{n}d..., lu_streak, turnover_pct)；
+            未收录的个股、最近n天有缺失的 ret_{n}d、缺失日之后天数未知的 lu_streak 为 NaN
+        """
+        codes = list(codes)
+        out = pd.DataFrame({'ts_code': codes})
+        t = self.position(as_of)
+        ids = self.code_index.get_indexer(codes) if t is not None else np.full(len(codes), -1)
+        known = ids >= 0
+        k = ids[known]
+
+        run = self.arrays['run_len'][k, t].astype(int) if t is not None else np.zeros(0, dtype=int)
+        for n in horizons:
+            col = np.full(len(codes), np.nan)
+            if t is not None and known.any():
+                # 连续收录恰好 n 天时起点为本段开始（累计值为0），超过 n 天时取 n 天前的累计值
+                start = np.where(run > n, self.arrays['cum_log'][k, max(t - n, 0)], 0.0)
+                ret = np.expm1(self.arrays['cum_log'][k, t] - start)
+                col[known] = np.where((run >= n) & np.isfinite(self.arrays['close'][k, t]), ret, np.nan)
+            out[f'ret_{n}d'] = col
+
+        streak = np.full(len(codes), np.nan)
+        pct = np.full(len(codes), np.nan)
+        if t is not None and known.any():
+            s = self.arrays['lu_streak'][k, t].astype(float)
+            streak[known] = np.where(s >= 0, s, np.nan)
+            pct[known] = self.arrays['turnover_pct'][k, t]
+        out['lu_streak'] = streak
+        out['turnover_pct'] = pct
+        return out
+
+
+def update_stock_store(stocks, store_dir, date_str):
+    """用当天快照更新个股存储，返回快照中个股的时序特征"""
+    store = StockStore(default_store_root(store_dir))
+    if not store.record_day(date_str, stocks):
+        print(f"⚠️  个股存储已记录到 {store.dates[-1]}，跳过 {date_str}")
+    return store.features(pd.unique(stocks['ts_code']), as_of=date_str)
+
+
+def stock_features(stocks, store_dir, date_str):
+    """只读查询某天的个股时序特征（用于重算历史），存储不存在时返回 None"""
+    root = default_store_root(store_dir)
+    if not (root / 'meta.json').exists():
+        return None
+    store = StockStore(root, mode='r')
+    if store.position(date_str) is None:
+        return None
+    return store.features(pd.unique(stocks['ts_code']), as_of=date_str)
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+评分参数扫描
+在历史数据上评估一组参数网格，输出表现最好的配置：
+- 板块评分权重（factors.SCORE_PARAMS）：用存档中的评分分量按新权重重算综合分，
+  以未来N日收益的截面秩相关（IC）和多空收益评估
+- 市场节奏参数（regime.REGIME_PARAMS）：按新参数重算历史节奏建议，
+  以未来N日 大盘-小盘 收益差的方向命中率和平均收益评估
+
+面板从内存映射的只读面板（panel.py）读取，整理出的评估数组放入共享内存，
+进程池中的每个进程按名称挂载，任务只传参数字典
+
+旧存档没有 pop_turnover/up_count 分量时沿用存档中的 pop，此时 pop_up_weight 对这些日期不起作用
+
+z-score 与 factors.board_metrics 一样按交易日计算（行业和概念板块一起标准化），IC 和多空收益按 (日期, 类型) 截面评估。
+近似：实时 ETL 在当次抓取的全部板块上标准化，存档只保存每类的前 N 个上榜板块，
+因此扫描中的 z-score 是在这个子集上计算的，最优权重与生产环境中的最优权重可能略有差异
+"""
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from factors import SCORE_PARAMS, CORE_PARAMS, STANCE_CUTOFFS, composite_score, pop_score
+from regime import REGIME_PARAMS, regime_series
+
+DEFAULT_GRID = {
+    'pop_up_weight': [0.0, 0.25, 0.5, 0.75, 1.0],
+    'dispersion_weight': [0.0, 0.25, 0.5, 0.75, 1.0],
+    'min_threshold': [0.001, 0.002, 0.003, 0.005],
+    'vol_k': [0.0, 0.5, 1.0],
+}
+
+# 计算截面 IC 所需的最少板块数 / 节奏参数有效所需的最少信号数
+MIN_CROSS_SECTION = 3
+MIN_SIGNALS = 5
+
+# “看多”评级的综合分下限（BUY 及以上）
+LONG_CUTOFF = dict((label, cutoff) for cutoff, label in STANCE_CUTOFFS)['BUY']
+
+
+class SharedPanel:
+    """
+    把一组 NumPy 数组放进同一块共享内存
+    spec 只包含共享内存名称和每个数组的偏移/形状/类型，子进程据此挂载为只读视图
+    """
+
+    def __init__(self, arrays, meta=None):
+        layout, offset = {}, 0
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            layout[name] = (offset, arr.shape, arr.dtype.str)
+            offset += (arr.nbytes + 7) // 8 * 8
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 8))
+        for name, arr in arrays.items():
+            off, shape, dtype = layout[name]
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=off)[...] = arr
+        self.spec = {'name': self.shm.name, 'layout': layout, 'meta': meta or {}}
+
+    @staticmethod
+    def attach(spec):
+        """挂载共享面板，返回 (SharedMemory, {name: ndarray}, meta)"""
+        shm = shared_memory.SharedMemory(name=spec['name'])
+        arrays = {}
+        for name, (off, shape, dtype) in spec['layout'].items():
+            arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=off)
+            arr.flags.writeable = False
+            arrays[name] = arr
+        return shm, arrays, spec['meta']
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+# ---------- 面板构建（主进程） ----------
+
+def index_forward_spread(rets, horizon):
+    """
+    未来N日 大盘(沪深300) - 小盘(中证1000) 累计收益差，窗口为 t+1..t+N
+
+    参数:
+        rets: ndarray(days, 2)，两列分别为沪深300、中证1000的日涨跌幅
+    """
+    out = np.full(len(rets), np.nan)
+    if horizon < len(rets):
+        growth = np.lib.stride_tricks.sliding_window_view(1 + rets[1:], horizon, axis=0).prod(axis=-1)
+        out[:len(growth)] = growth[:, 0] - growth[:, 1]
+    return out
+
+
+def build_arrays(panel, close, index_rets, horizons):
+    """
+    把面板整理为共享内存中的数组
+
+    参数:
+        panel: backtest.load_panel() 的结果
+        close: 板块收盘价宽表（K线存储）
+        index_rets: 存档的指数涨跌幅宽表（load_index_returns）
+    """
+    from backtest import forward_returns, lookup
+
+    panel = panel.sort_values(['date', 'type']).reset_index(drop=True)
+    section = panel.groupby(['date', 'type'], sort=True).ngroup().to_numpy(np.int64)
+    # 综合分的标准化截面：同一交易日的行业和概念板块一起（与 factors.board_metrics 一致）
+    zsection = panel.groupby('date', sort=True).ngroup().to_numpy(np.int64)
+    arrays = {
+        'section': section,
+        'zsection': zsection,
+        'ret': panel['ret'].to_numpy(float),
+        'pop': panel['pop'].to_numpy(float),
+        'dispersion': panel['dispersion'].to_numpy(float),
+        'pop_turnover': panel['pop_turnover'].to_numpy(float),
+        'up_count': panel['up_count'].to_numpy(float),
+    }
+    arrays['has_components'] = np.isfinite(arrays['pop_turnover']) & np.isfinite(arrays['up_count'])
+
+    # 综合分是否有效与权重无关，未来收益的秩也与参数无关：预先算好放入共享内存
+    valid = np.isfinite(arrays['ret']) & np.isfinite(arrays['dispersion']) \
+          & (arrays['has_components'] | np.isfinite(arrays['pop']))
+    for n in horizons:
+        fwd = lookup(forward_returns(close, n), close, panel['date'], panel['code'])
+        arrays[f'fwd_{n}'] = fwd
+        arrays[f'mask_{n}'] = valid & np.isfinite(fwd)
+        arrays[f'fwd_rank_{n}'] = section_ranks(fwd, section, [arrays[f'mask_{n}']])[0]
+
+    columns = list(index_rets.columns)
+    arrays['index_rets'] = index_rets.to_numpy(float)
+    pair = index_rets.reindex(columns=['HS300', 'CSI1000']).to_numpy(float)
+    for n in horizons:
+        arrays[f'spread_fwd_{n}'] = index_forward_spread(pair, n)
+
+    meta = {'n_sections': int(section.max()) + 1 if len(section) else 0,
+            'n_zsections': int(zsection.max()) + 1 if len(zsection) else 0,
+            'index_columns': columns, 'horizons': list(horizons)}
+    return arrays, meta
+
+
+# ---------- 评估（子进程） ----------
+
+_SHM = None
+_ARRAYS = None
+_META = None
+
+
+def _attach(spec):
+    global _SHM, _ARRAYS, _META
+    _SHM, _ARRAYS, _META = SharedPanel.attach(spec)
+
+
+def grouped_zscore(x, section, n_sections):
+    """按截面编号分组的 z-score（忽略 NaN，与 factors.zscore 相同的 ddof=0 和 1e-9）"""
+    x = np.asarray(x, dtype=float)
+    ok = np.isfinite(x)
+    cnt = np.bincount(section[ok], minlength=n_sections)
+    s1 = np.bincount(section[ok], weights=x[ok], minlength=n_sections)
+    s2 = np.bincount(section[ok], weights=x[ok] ** 2, minlength=n_sections)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = s1 / cnt
+        std = np.sqrt(np.maximum(s2 / cnt - mean ** 2, 0.0))
+    return (x - mean[section]) / (std[section] + 1e-9)
+
+
+def section_ranks(values, section, masks):
+    """
+    截面内的序号秩（1..n）：一次排序，按多个 mask 分别计数
+    section 需已升序；每个 mask 返回一个数组，mask 外为 NaN
+    """
+    order = np.lexsort((values, section))
+    sec = section[order]
+    start = np.searchsorted(sec, sec, side='left')
+    ranks = []
+    for mask in masks:
+        m = mask[order]
+        seen = np.cumsum(m)
+        before = np.where(start > 0, seen[start - 1], 0)
+        r = np.full(len(values), np.nan)
+        r[order[m]] = (seen - before)[m]
+        ranks.append(r)
+    return ranks
+
+
+def _section_mean(x, section, mask, n_sections):
+    cnt = np.bincount(section[mask], minlength=n_sections)
+    total = np.bincount(section[mask], weights=x[mask], minlength=n_sections)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return total / cnt, cnt
+
+
+def _summary(values):
+    values = values[np.isfinite(values)]
+    if len(values) < 2:
+        return None, None, len(values)
+    mean, std = float(values.mean()), float(values.std(ddof=1))
+    return mean, (mean / std * np.sqrt(len(values)) if std > 0 else None), len(values)
+
+
+def evaluate_score(params):
+    """按一组评分权重重算综合分，评估每个持有期的 IC 与多空收益"""
+    a, n_sec = _ARRAYS, _META['n_sections']
+    section = a['section']
+
+    def z(x):
+        return grouped_zscore(x, a['zsection'], _META['n_zsections'])
+
+    pop = np.where(a['has_components'], pop_score(a['pop_turnover'], a['up_count'], params, z=z), a['pop'])
+    score = composite_score(a['ret'], pop, a['dispersion'], params, z=z)
+
+    horizons = _META['horizons']
+    score_ranks = section_ranks(score, section, [a[f'mask_{n}'] for n in horizons])
+
+    result = {}
+    for n, rs in zip(horizons, score_ranks):
+        fwd, mask, rf = a[f'fwd_{n}'], a[f'mask_{n}'], a[f'fwd_rank_{n}']
+
+        mean_rs, cnt = _section_mean(rs, section, mask, n_sec)
+        mean_rf, _ = _section_mean(rf, section, mask, n_sec)
+        ds = np.where(mask, rs - mean_rs[section], 0.0)
+        df = np.where(mask, rf - mean_rf[section], 0.0)
+        cov = np.bincount(section, weights=ds * df, minlength=n_sec)
+        vs = np.bincount(section, weights=ds ** 2, minlength=n_sec)
+        vf = np.bincount(section, weights=df ** 2, minlength=n_sec)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ic = np.where((cnt >= MIN_CROSS_SECTION) & (vs > 0) & (vf > 0), cov / np.sqrt(vs * vf), np.nan)
+
+        top = rs > (cnt[section] / 2.0)
+        ls_score = _section_mean(fwd, section, mask & top, n_sec)[0] \
+            - _section_mean(fwd, section, mask & ~top, n_sec)[0]
+        bull = score > LONG_CUTOFF
+        ls_stance = _section_mean(fwd, section, mask & bull, n_sec)[0] \
+            - _section_mean(fwd, section, mask & ~bull, n_sec)[0]
+
+        ic_mean, ic_t, sections = _summary(ic)
+        result[n] = {'ic': ic_mean, 'ic_t': ic_t, 'sections': sections,
+                     'ls_score': _summary(ls_score)[0], 'ls_stance': _summary(ls_stance)[0]}
+    return result
+
+
+def evaluate_regime(params):
+    """按一组节奏参数重算历史建议，评估方向命中率和按建议方向的平均收益差"""
+    a = _ARRAYS
+    ret_wide = pd.DataFrame(a['index_rets'], columns=_META['index_columns'])
+    advice = regime_series(ret_wide, params)['advice'].to_numpy()
+    sign = np.where(advice == 'DEFENSE', 1.0, np.where(advice == 'OFFENSE', -1.0, 0.0))
+
+    result = {}
+    for n in _META['horizons']:
+        spread = a[f'spread_fwd_{n}']
+        ok = (sign != 0) & np.isfinite(spread)
+        signed = sign[ok] * spread[ok]
+        result[n] = {
+            'signals': int(ok.sum()),
+            'hit_rate': float((signed > 0).mean()) if ok.any() else None,
+            'edge': float(signed.mean()) if ok.any() else None,
+        }
+    return result
+
+
+def _evaluate(task):
+    kind, params = task
+    func = evaluate_score if kind == 'score' else evaluate_regime
+    return kind, params, func(params)
+
+
+# ---------- 网格与结果 ----------
+
+def parse_grid(items):
+    """解析 --grid key=v1,v2,...，覆盖默认网格中的对应项"""
+    grid = dict(DEFAULT_GRID)
+    for item in items or []:
+        key, _, values = item.partition('=')
+        key = key.strip()
+        if key in CORE_PARAMS:
+            raise ValueError(f"{key}: 个股核心度权重需要个股未来收益，暂不支持扫描")
+        if key not in SCORE_PARAMS and key not in REGIME_PARAMS:
+            raise ValueError(f"未知参数: {key}")
+        cast = int if key == 'ewm_span' or key == 'vol_window' else float
+        grid[key] = [cast(v) for v in values.split(',') if v.strip()]
+    return grid
+
+
+def expand(grid, keys):
+    """指定参数的笛卡尔积"""
+    keys = [k for k in keys if k in grid]
+    return [dict(zip(keys, combo)) for combo in itertools.product(*(grid[k] for k in keys))]
+
+
+def rank_results(results, horizon, kind):
+    """按主持有期排序：评分按平均 IC，节奏按平均收益差（信号数不足的排在最后）"""
+    def key(r):
+        m = r['metrics'][horizon]
+        if kind == 'score':
+            return m['ic'] if m['ic'] is not None else -np.inf
+        return m['edge'] if m['edge'] is not None and m['signals'] >= MIN_SIGNALS else -np.inf
+    return sorted(results, key=key, reverse=True)
+
+
+def run_sweep(arrays, meta, grid, workers=None):
+    """
+    在进程池中评估全部参数组合（面板通过共享内存传递）
+
+    返回: {'score': [{'params', 'metrics'}, ...], 'regime': [...]}
+    """
+    tasks = [('score', p) for p in expand(grid, SCORE_PARAMS)] \
+          + [('regime', p) for p in expand(grid, REGIME_PARAMS)]
+
+    panel = SharedPanel(arrays, meta)
+    try:
+        if workers == 1:
+            _attach(panel.spec)
+            outputs = [_evaluate(t) for t in tasks]
+        else:
+            chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 4))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                     initargs=(panel.spec,)) as pool:
+                outputs = list(pool.map(_evaluate, tasks, chunksize=chunksize))
+    finally:
+        panel.close()
+
+    results = {'score': [], 'regime': []}
+    for kind, params, metrics in outputs:
+        results[kind].append({'params': params, 'metrics': metrics})
+    return results
+
+
+def _jsonable(value):
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def save_report(report, output_path):
+    """原子写入扫描结果"""
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    tmp = f"{output_path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(_jsonable(report), f, ensure_ascii=False, indent=2)
+    os.replace(tmp, output_path)
+
+
+def main():
+    import argparse
+    import time
+    from backtest import load_panel
+    from generate_history import load_index_returns
+    from kline_store import KlineStore, default_store_root
+    from panel import open_panel
+
+    ap = argparse.ArgumentParser(description='评分参数扫描')
+    ap.add_argument('--archive-dir', default='site/data/archive', help='存档目录')
+    ap.add_argument('--store-dir', default=None, help='数据存储目录（默认与存档目录同级的 store）')
+    ap.add_argument('--horizons', default='1,3,5', help='未来收益天数，逗号分隔，第一个用于排序')
+    ap.add_argument('--grid', action='append', default=[],
+                    help='参数网格，如 --grid dispersion_weight=0,0.5,1（可重复）')
+    ap.add_argument('--workers', type=int, default=None, help='进程数（默认CPU核数，1=不使用进程池）')
+    ap.add_argument('--top', type=int, default=5, help='显示前N个配置')
+    ap.add_argument('--out', default=None, help='输出 JSON 路径（best 部分可直接作为 etl_daily.py --params）')
+    ap.add_argument('--no-panel', action='store_true', help='不使用只读面板，逐个读取存档 JSON')
+    args = ap.parse_args()
+
+    horizons = [int(h) for h in args.horizons.split(',') if h.strip()]
+    grid = parse_grid(args.grid)
+    store_dir = args.store_dir or Path(args.archive_dir).parent / 'store'
+
+    shared = None if args.no_panel else open_panel(args.archive_dir, store_dir)
+    if shared is not None:
+        panel = shared.boards()
+        close = shared.close(sorted(panel['code'].unique()))
+        index_rets = shared.index_returns()
+    else:
+        panel = load_panel(args.archive_dir)
+        close = KlineStore(default_store_root(store_dir)).panel(sorted(panel['code'].unique()))
+        index_rets = load_index_returns(args.archive_dir)
+    if panel.empty or close.empty:
+        print("❌ 缺少存档面板或板块K线，可先运行 backtest.py --fetch 更新K线存储")
+        return
+
+    arrays, meta = build_arrays(panel, close, index_rets, horizons)
+    print(f"📊 面板: {len(panel)} 条记录，{meta['n_sections']} 个截面；"
+          f"指数 {len(index_rets)} 天；共享内存 {sum(a.nbytes for a in arrays.values()) / 1e6:.1f} MB")
+
+    start = time.time()
+    results = run_sweep(arrays, meta, grid, args.workers)
+    n_tasks = len(results['score']) + len(results['regime'])
+    print(f"⚡ 评估 {n_tasks} 组参数，用时 {time.time() - start:.1f}s")
+
+    h = horizons[0]
+    score_ranked = rank_results(results['score'], h, 'score')
+    regime_ranked = rank_results(results['regime'], h, 'regime')
+
+    def fmt(v, pct=False):
+        if v is None:
+            return '-'
+        return f"{v * 100:+.2f}%" if pct else f"{v:+.3f}"
+
+    print(f"\n🏆 板块评分（按未来 {h} 日平均 IC 排序）:")
+    for r in score_ranked[:args.top]:
+        m = r['metrics'][h]
+        print(f"  {r['params']}  IC {fmt(m['ic'])}  t={fmt(m['ic_t'])}"
+              f"  多空[score] {fmt(m['ls_score'], True)}  多空[stance] {fmt(m['ls_stance'], True)}")
+
+    print(f"\n🏆 市场节奏（按未来 {h} 日 大盘-小盘 方向收益排序）:")
+    for r in regime_ranked[:args.top]:
+        m = r['metrics'][h]
+        hit = '-' if m['hit_rate'] is None else f"{m['hit_rate'] * 100:.0f}%"
+        print(f"  {r['params']}  信号 {m['signals']}  命中率 {hit}  平均收益差 {fmt(m['edge'], True)}")
+
+    if args.out:
+        best = {}
+        if score_ranked:
+            best['score'] = dict(SCORE_PARAMS, **score_ranked[0]['params'])
+        if regime_ranked:
+            best['regime'] = dict(REGIME_PARAMS, **regime_ranked[0]['params'])
+        save_report({'horizons': horizons, 'rank_horizon': h, 'grid': grid, 'best': best,
+                     'score': score_ranked, 'regime': regime_ranked}, args.out)
+        print(f"\n✅ 扫描结果已保存: {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-验证history.json数据完整性
+验证数据完整性
+- history.json：指数K线数据的结构
+- 存档（archive/<date>.json 和月度包中的每一天）和 daily.json：按版本化的结构定义和跨字段约束逐个校验
+  （字段类型、日期与文件名一致、板块代码不重复、板块按涨幅排序、评级与得分一致、
+   指数OHLC区间、回填占位数据），相邻存档之间再校验指数涨跌幅与收盘价是否一致
+- 逐文件校验在进程池中并行，结果按文件内容哈希缓存，只重新校验新增或变化的文件
 """
 import json
+import math
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
 from pathlib import Path
+from index_registry import index_codes
 
 def verify_history_data(history_file):
     """验证历史数据文件"""
@@ -54,7 +64,7 @@ def verify_history_data(history_file):
         return False
 
     market_indices = mih['market_indices']
-    expected_indices = ['SHCOMP', 'SZCOMP', 'CYBZ', 'KCB50', 'BJ50']
+    expected_indices = index_codes('market')
 
     for index_code in expected_indices:
         if index_code not in market_indices:
@@ -103,7 +113,7 @@ def verify_history_data(history_file):
         return False
 
     main_indices = main_ih['main_indices']
-    expected_main_indices = ['HS300', 'CSI500', 'CSI1000', 'CSI2000']
+    expected_main_indices = index_codes('main')
 
     for index_code in expected_main_indices:
         if index_code not in main_indices:
@@ -147,11 +157,383 @@ def verify_history_data(history_file):
 
     return True
 
-if __name__ == '__main__':
-    history_file = 'data/history.json'
+# ---------- 存档校验 ----------
+
+# 存档结构定义；修改规则时提升 version，旧的缓存结果随之失效
+ARCHIVE_SCHEMA = {
+    'version': 2,
+    'required': {'date': str, 'market': dict, 'industry_boards': list, 'concept_boards': list, 'indices': dict},
+    'optional': {'market_indices': dict, 'source': str, 'meta': dict, 'disclaimer': str,
+                 'data_status': dict},
+    'market': {'risk_on': bool, 'broad_strength': (int, float), 'advice': str},
+    'board': {'code': str, 'name': str, 'type': str, 'ret': (int, float), 'score': (int, float),
+              'stance': str, 'is_new': bool, 'core_stocks': list},
+    'core_stock': {'code': str, 'name': str, 'ret': (int, float), 'core': (int, float)},
+}
+BACKFILL_SOURCE = 'history_backfill'
+
+# 相邻存档间隔不超过该天数时视为连续交易日，校验涨跌幅与收盘价
+MAX_ADJACENT_GAP_DAYS = 4
+# 收盘价推算的涨跌幅与记录值的容差（记录值保留4位小数）
+RET_CLOSE_TOL = 0.002
+
+
+def _typed(value, types):
+    """类型检查（bool 不算数值）"""
+    if isinstance(value, bool) and bool not in (types if isinstance(types, tuple) else (types,)):
+        return False
+    return isinstance(value, types)
+
+
+def _is_stub(boards):
+    """回填占位：没有个股，ret 由 score/100 伪造"""
+    scored = [b for b in boards if isinstance(b.get('score'), (int, float)) and b.get('score')]
+    return bool(scored) and all(
+        not b.get('core_stocks') and isinstance(b.get('ret'), (int, float))
+        and abs(b['ret'] - b['score'] / 100) < 1e-9 for b in scored)
+
+
+def check_archive(data, expected_date=None):
+    """
+    按 ARCHIVE_SCHEMA 校验一天的存档 / daily.json
+
+    返回:
+        {'format': 'current'/'legacy'/'backfill', 'errors': [...], 'warnings': [...],
+         'summary': {'date', 'indices': {key: [close, ret]}}}（summary 供跨文件校验）
+    """
+    from factors import stance
+    from generate_history import LEGACY_INDEX_SCALE_CLOSE, index_return
+    from panel import ADVICES, STANCES
+
+    errors, warnings = [], []
+    schema = ARCHIVE_SCHEMA
+    if not isinstance(data, dict):
+        return {'format': None, 'errors': ['顶层不是对象'], 'warnings': [], 'summary': None}
+
+    for key, types in schema['required'].items():
+        if key not in data:
+            errors.append(f"缺少字段 {key}")
+        elif not _typed(data[key], types):
+            errors.append(f"{key} 类型错误")
+    for key, types in schema['optional'].items():
+        if key in data and not _typed(data[key], types):
+            errors.append(f"{key} 类型错误")
+    if errors:
+        return {'format': None, 'errors': errors, 'warnings': warnings, 'summary': None}
 
-    if len(sys.argv) > 1:
-        history_file = sys.argv[1]
+    try:
+        date.fromisoformat(data['date'])
+    except ValueError:
+        errors.append(f"日期格式错误: {data['date']}")
+    if expected_date and data['date'] != expected_date:
+        errors.append(f"日期 {data['date']} 与文件名 {expected_date} 不一致")
+
+    market = data['market']
+    for key, types in schema['market'].items():
+        if not _typed(market.get(key), types):
+            errors.append(f"market.{key} 缺失或类型错误")
+    if market.get('advice') not in ADVICES:
+        errors.append(f"market.advice 取值错误: {market.get('advice')}")
+
+    # 接口失败时降级使用的缓存快照（见 snapshot_cache.py）
+    status = data.get('data_status')
+    if status is not None:
+        if not _typed(status.get('max_age_sec'), (int, float)):
+            errors.append("data_status.max_age_sec 缺失或类型错误")
+        elif status.get('stale'):
+            stale_boards = len(status.get('board_stocks') or {})
+            warnings.append(f"部分数据为 {status['max_age_sec'] / 60:.0f} 分钟前的缓存快照"
+                            f"（{', '.join(status.get('sources') or {}) or '无接口级'}，{stale_boards} 个板块的成分股）")
+        cov = status.get('coverage')
+        if isinstance(cov, dict):
+            missing = len(cov.get('deferred') or []) + len(cov.get('failed') or [])
+            warnings.append(f"成分股覆盖不完整：{cov.get('boards')} 个板块中实时 {cov.get('live', 0) + cov.get('retry', 0)} 个，"
+                            f"缓存 {cov.get('cache', 0)} 个，缺失 {missing} 个")
+
+    # 板块（回填占位数据的评级按得分正负生成，不校验与得分的一致性）
+    stub = _is_stub([b for b in data['industry_boards'] + data['concept_boards'] if isinstance(b, dict)])
+    seen = {}
+    for list_key, board_type in (('industry_boards', 'industry'), ('concept_boards', 'concept')):
+        boards = data[list_key]
+        for i, b in enumerate(boards):
+            where = f"{list_key}[{i}]"
+            if not isinstance(b, dict):
+                errors.append(f"{where} 不是对象")
+                continue
+            bad = [k for k, types in schema['board'].items() if not _typed(b.get(k), types)]
+            if bad:
+                errors.append(f"{where} 字段缺失或类型错误: {bad}")
+                continue
+            where = f"{where} {b['code']}"
+            if b['code'] in seen:
+                errors.append(f"{where} 代码重复（另见 {seen[b['code']]}）")
+            seen[b['code']] = where
+            if b['type'] != board_type:
+                errors.append(f"{where} type={b['type']} 与所在列表不符")
+            if not math.isfinite(b['ret']):
+                errors.append(f"{where} ret 不是有限数值")
+            if b['stance'] not in STANCES:
+                errors.append(f"{where} stance 取值错误: {b['stance']}")
+            elif not stub and b['stance'] != stance(b['score']):
+                errors.append(f"{where} stance={b['stance']} 与得分 {b['score']} 不符")
+            stocks = b['core_stocks']
+            if any(not isinstance(s, dict) or any(not _typed(s.get(k), t) for k, t in schema['core_stock'].items())
+                   for s in stocks):
+                errors.append(f"{where} core_stocks 字段缺失或类型错误")
+            else:
+                codes = [s['code'] for s in stocks]
+                if len(codes) != len(set(codes)):
+                    errors.append(f"{where} core_stocks 代码重复")
+                cores = [s['core'] for s in stocks]
+                if cores != sorted(cores, reverse=True):
+                    errors.append(f"{where} core_stocks 未按核心度排序")
+        # 排名即列表顺序：按涨幅降序
+        rets = [b['ret'] for b in boards if isinstance(b, dict) and _typed(b.get('ret'), (int, float))]
+        if rets != sorted(rets, reverse=True):
+            errors.append(f"{list_key} 未按涨幅降序排列")
+
+    fmt = 'current' if 'market_indices' in data else 'legacy'
+    if stub:
+        fmt = 'backfill'
+        if data.get('source') == BACKFILL_SOURCE:
+            warnings.append("回填占位数据：ret 为 score/100，不是真实涨跌幅")
+        else:
+            errors.append(f"回填占位数据（ret 为 score/100）缺少 source={BACKFILL_SOURCE} 标记，会被当作真实数据使用")
+
+    # 指数
+    summary = {'date': data['date'], 'indices': {}}
+    for block in ('indices', 'market_indices'):
+        for code, item in (data.get(block) or {}).items():
+            where = f"{block}.{code}"
+            if not isinstance(item, dict) or not _typed(item.get('ret'), (int, float)):
+                errors.append(f"{where} 缺少 ret")
+                continue
+            ohlc = [item.get(k) for k in ('open', 'high', 'low', 'close')]
+            if all(_typed(v, (int, float)) and v > 0 for v in ohlc):
+                o, h, l, c = ohlc
+                if not l <= min(o, c) <= max(o, c) <= h:
+                    errors.append(f"{where} OHLC 区间错误: 开{o} 高{h} 低{l} 收{c}")
+                if block == 'indices' and c > LEGACY_INDEX_SCALE_CLOSE:
+                    c /= 100.0  # 旧存档点位×100
+                if code.islower() and code.upper() in data[block]:
+                    continue  # 兼容旧代码的小写别名，与大写键相同
+                summary['indices'][where] = [c, index_return(item)]
+    return {'format': fmt, 'errors': errors, 'warnings': warnings, 'summary': summary}
+
+
+def _split_bundled(path):
+    """月度包中的一天以 <包路径>#<日期> 表示，返回 (存档目录, 日期)，普通文件返回 None"""
+    if '#' not in path:
+        return None
+    bundle, date_str = path.rsplit('#', 1)
+    return str(Path(bundle).parent.parent), date_str
+
+
+def source_hash(path):
+    """文件内容哈希；月度包中的一天取索引中记录的内容哈希"""
+    from pipeline import file_hash
+
+    bundled = _split_bundled(path)
+    if bundled is None:
+        return file_hash(path)
+    from archive_bundle import load_index
+    archive_dir, date_str = bundled
+    entry = load_index(archive_dir)['bundles'].get(date_str[:7], {})
+    return entry.get('dates', {}).get(date_str)
+
+
+def check_file(task):
+    """
+    校验一个文件或月度包中的一天（在子进程中运行）
+
+    参数:
+        task: (path, 期望日期或 None)
+    返回:
+        (path, 内容哈希, 结果)
+    """
+    path, expected_date = task
+    digest = source_hash(path)
+    bundled = _split_bundled(path)
+    try:
+        if bundled is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        else:
+            from archive_bundle import load_bundled
+            data = load_bundled(*bundled)
+            if data is None:
+                raise ValueError("月度包中读取失败")
+    except Exception as e:
+        return path, digest, {'format': None, 'errors': [f"JSON解析失败: {e}"], 'warnings': [], 'summary': None}
+    return path, digest, check_archive(data, expected_date)
+
+
+def check_sequence(results):
+    """
+    跨文件校验：相邻交易日的存档，收盘价推算的涨跌幅应与记录的 ret 一致
+
+    参数:
+        results: {path: 结果}（按日期排序的存档）
+    返回: {path: [警告, ...]}
+    """
+    out = {}
+    prev_date, prev = None, {}
+    for path, result in results.items():
+        summary = result.get('summary')
+        if not summary:
+            continue
+        day = date.fromisoformat(summary['date'])
+        if prev_date and (day - prev_date).days <= MAX_ADJACENT_GAP_DAYS:
+            for key, (close, ret) in summary['indices'].items():
+                if key in prev and ret is not None:
+                    implied = close / prev[key] - 1
+                    if abs(implied - ret) > RET_CLOSE_TOL:
+                        out.setdefault(path, []).append(
+                            f"{key} 涨跌幅 {ret:.4f} 与收盘价推算 {implied:.4f} 不一致（前一存档 {prev_date}）")
+        prev_date, prev = day, {key: close for key, (close, _) in summary['indices'].items()}
+    return out
+
+
+def verify_version():
+    """校验规则的版本：结构定义版本 + 校验代码（规则或评级代码变化时缓存失效）"""
+    from pipeline import code_version
+    return f"{ARCHIVE_SCHEMA['version']}-{code_version(['verify_data.py', 'factors.py'])}"
+
+
+def load_verify_cache(path):
+    """读取校验缓存，规则版本不同或损坏时返回空缓存"""
+    version = verify_version()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('version') == version:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {'version': version, 'files': {}}
+
+
+def save_verify_cache(cache, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def verify_archives(archive_dir, extra_files=(), workers=None, cache_path=None):
+    """
+    校验全部存档和输出文件（如 daily.json）
+
+    参数:
+        extra_files: 按存档结构校验、但不参与日期和跨文件校验的文件
+        workers: 进程数（1=不使用进程池）
+        cache_path: 校验缓存（None=不缓存）
+    返回:
+        {path: 结果}，结果含 errors / warnings / format
+    """
+    from archive_bundle import bundle_root, bundled_dates, load_index
+    from generate_history import list_archive_dates
+
+    archive_dir = Path(archive_dir)
+    bundles = load_index(archive_dir)['bundles']
+    bundled = bundled_dates(archive_dir)
+    tasks = []
+    for d in sorted(list_archive_dates(archive_dir)):
+        path = archive_dir / f"{d}.json"
+        if not path.exists() and d in bundled:
+            path = f"{bundle_root(archive_dir) / bundles[bundled[d]]['file']}#{d}"
+        tasks.append((str(path), d))
+    tasks += [(str(p), None) for p in extra_files if Path(p).exists()]
+
+    cache = load_verify_cache(cache_path) if cache_path else {'version': verify_version(), 'files': {}}
+    results, pending = {}, []
+    for path, expected in tasks:
+        hit = cache['files'].get(path)
+        if hit and hit['hash'] == source_hash(path):
+            results[path] = hit['result']
+        else:
+            pending.append((path, expected))
+            results[path] = None  # 占位，保持日期顺序
+    print(f"🔍 校验 {len(tasks)} 个文件：缓存命中 {len(tasks) - len(pending)} 个，需要校验 {len(pending)} 个")
 
-    success = verify_history_data(history_file)
+    if pending:
+        if workers == 1 or len(pending) == 1:
+            outputs = map(check_file, pending)
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            outputs = pool.map(check_file, pending, chunksize=max(1, len(pending) // ((workers or os.cpu_count()) * 4)))
+        try:
+            for path, digest, result in outputs:
+                results[path] = result
+                cache['files'][path] = {'hash': digest, 'result': result}
+        finally:
+            if not (workers == 1 or len(pending) == 1):
+                pool.shutdown()
+
+    # 已删除的文件不再保留缓存
+    cache['files'] = {p: v for p, v in cache['files'].items() if p in results}
+    if cache_path:
+        save_verify_cache(cache, cache_path)
+
+    # 跨文件校验每次都重新计算（只用缓存中的摘要，开销很小）
+    archives = {path: results[path] for path, expected in tasks if expected}
+    report = {path: dict(result, warnings=list(result['warnings'])) for path, result in results.items()}
+    for path, issues in check_sequence(archives).items():
+        report[path]['warnings'].extend(issues)
+    return report
+
+
+def print_report(report, max_lines=5):
+    """打印校验结果，返回是否没有错误"""
+    from collections import Counter
+
+    formats = Counter(r['format'] for r in report.values())
+    n_err = sum(1 for r in report.values() if r['errors'])
+    n_warn = sum(1 for r in report.values() if r['warnings'])
+    for path, r in report.items():
+        if not r['errors'] and not r['warnings']:
+            continue
+        mark = '❌' if r['errors'] else '⚠️ '
+        print(f"{mark} {Path(path).name}")
+        issues = [f"错误: {e}" for e in r['errors']] + [f"警告: {w}" for w in r['warnings']]
+        for line in issues[:max_lines]:
+            print(f"     {line}")
+        if len(issues) > max_lines:
+            print(f"     ... 另有 {len(issues) - max_lines} 条")
+    print(f"\n📋 {len(report)} 个文件（" + ", ".join(f"{k or '无法识别'} {v}" for k, v in formats.items())
+          + f"）：{n_err} 个有错误，{n_warn} 个有警告")
+    return n_err == 0
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description='验证历史数据、存档和 daily.json 的完整性')
+    ap.add_argument('history', nargs='?', default='data/history.json', help='history.json 路径')
+    ap.add_argument('--archive-dir', default=None, help='存档目录（提供时校验全部存档）')
+    ap.add_argument('--daily', default=None, help='daily.json 路径（按存档结构校验）')
+    ap.add_argument('--store-dir', default=None, help='数据存储目录（校验缓存，默认与存档目录同级的 store）')
+    ap.add_argument('--workers', type=int, default=None, help='进程数（默认CPU核数，1=不使用进程池）')
+    ap.add_argument('--no-cache', action='store_true', help='不读写校验缓存，全部重新校验')
+    args = ap.parse_args()
+
+    success = True
+    if args.archive_dir:
+        print("=" * 70)
+        print("📦 验证存档文件")
+        print("=" * 70)
+        store_dir = args.store_dir or str(Path(args.archive_dir).parent / 'store')
+        cache_path = None if args.no_cache else Path(store_dir) / 'verify_cache.json'
+        report = verify_archives(args.archive_dir, [args.daily] if args.daily else (),
+                                 args.workers or os.cpu_count(), cache_path)
+        success = print_report(report)
+        print()
+
+    success = verify_history_data(args.history) and success
     sys.exit(0 if success else 1)
+
+
+if __name__ == '__main__':
+    main()